@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Benchmark the construction of *sMRIPrep*'s workflow graph for many subjects.
+
+Builds the full graph for a synthetic list of subjects and reports the build
+time (wall and CPU), the peak resident memory of the process and the size of the
+serialized graph.
+CPU time is less sensitive to other load on the machine when comparing runs.
+Querying the inputs of each subject (BIDS indexing) is left out of the
+measurement: every subject gets the same, made-up T1w image.
+
+Example::
+
+    for n in 100 1000 5000; do python benchmark_graph.py $n; done
+
+Run each size in a separate process, so that peak memory figures are meaningful.
+Memory grows by about 2 MB per subject with the default settings; to fit many
+subjects on a small machine, reduce the number of nodes per subject, e.g.::
+
+    python benchmark_graph.py 5000 --no-freesurfer --skull-strip-mode skip \
+        --spaces MNI152NLin2009cAsym
+"""
+
+import argparse
+import os
+import resource
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("subjects", type=int, help="number of subjects")
+    parser.add_argument(
+        "--legacy-config",
+        action="store_true",
+        help="give each node a full copy of the configuration (former behavior)",
+    )
+    parser.add_argument(
+        "--build-nprocs", type=int, default=1, help="processes used to build the graph"
+    )
+    parser.add_argument(
+        "--no-freesurfer", action="store_false", dest="freesurfer", help="skip recon-all"
+    )
+    parser.add_argument(
+        "--skull-strip-mode",
+        choices=("auto", "skip", "force"),
+        default="force",
+        help="skull-stripping mode (\"skip\" leaves out the brain extraction workflow)",
+    )
+    parser.add_argument(
+        "--spaces",
+        nargs="*",
+        default=["MNI152NLin2009cAsym", "fsaverage5"],
+        help="output spaces",
+    )
+    opts = parser.parse_args()
+
+    from collections import namedtuple
+    from copy import deepcopy
+    from niworkflows.utils.spaces import Reference, SpatialReferences
+    from smriprep.utils.graph import save_workflow
+    from smriprep.workflows import base
+
+    os.environ.setdefault("FREESURFER_HOME", os.getcwd())
+    base.collect_data = lambda *args, **kwargs: (
+        {"t1w": ["/completely/made/up/path/sub-01_T1w.nii.gz"], "t2w": [], "flair": []},
+        None,
+    )
+
+    with TemporaryDirectory() as tmpdir:
+        tic, cpu_tic = perf_counter(), process_time()
+        workflow = base.init_smriprep_wf(
+            debug=False,
+            fast_track=False,
+            freesurfer=opts.freesurfer,
+            fs_subjects_dir=None,
+            hires=True,
+            layout=namedtuple("BIDSLayout", ["root"])(tmpdir),
+            longitudinal=False,
+            low_mem=False,
+            omp_nthreads=1,
+            output_dir=tmpdir,
+            run_uuid="benchmark",
+            skull_strip_fixed_seed=False,
+            skull_strip_mode=opts.skull_strip_mode,
+            skull_strip_template=Reference("OASIS30ANTs"),
+            spaces=SpatialReferences(spaces=opts.spaces),
+            subject_list=["%05d" % i for i in range(opts.subjects)],
+            work_dir=tmpdir,
+            bids_filters=None,
+            build_nprocs=opts.build_nprocs,
+        )
+        if opts.legacy_config:
+            for subject_wf in workflow._graph.nodes():
+                if not hasattr(subject_wf, "_get_all_nodes"):  # fsdir node
+                    continue
+                for node in subject_wf._get_all_nodes():
+                    config = deepcopy(subject_wf.config)
+                    config["execution"].update(node.config["execution"])
+                    node.config = config
+        build_time, build_cpu = perf_counter() - tic, process_time() - cpu_tic
+
+        tic = perf_counter()
+        size = save_workflow(workflow, Path(tmpdir) / "smriprep_wf.pklz")
+        save_time = perf_counter() - tic
+
+    # ru_maxrss is reported in kilobytes on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    maxrss /= 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    print(
+        f"subjects={opts.subjects} nprocs={opts.build_nprocs} "
+        f"nodes={len(workflow._get_all_nodes())} build={build_time:.1f}s "
+        f"build_cpu={build_cpu:.1f}s peak_rss={maxrss:.0f}MB "
+        f"pickle={size / 2 ** 20:.1f}MB save={save_time:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
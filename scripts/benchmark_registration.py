@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Benchmark the spatial normalization presets of *sMRIPrep*.
+
+Registers one T1w image (e.g., the ``desc-preproc_T1w`` of a previous run) to a
+template with each preset, and reports the wall time of the registration and the
+overlap (Dice) between the template's tissue maps and the subject's brain mask
+and tissue segmentation (BIDS labels: 1 GM, 2 WM, 3 CSF) mapped onto it.
+Template tissues are the most probable of their ``probseg`` maps, where the
+brain probability exceeds 0.5.
+Alternatively, ``--reference`` sets a target T1w image with its brain mask and
+tissue segmentation (e.g., to benchmark on a template that is not in TemplateFlow).
+
+Example::
+
+    python benchmark_registration.py sub-01_desc-preproc_T1w.nii.gz \\
+        sub-01_desc-brain_mask.nii.gz sub-01_dseg.nii.gz \\
+        --presets precise balanced fast --nprocs 8 > presets.tsv
+
+Results are printed as a tab-separated table.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+TISSUES = ("GM", "WM", "CSF")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("t1w", type=Path, help="bias-corrected T1w image")
+    parser.add_argument("mask", type=Path, help="brain mask of the T1w image")
+    parser.add_argument("dseg", type=Path, help="tissue segmentation of the T1w image")
+    parser.add_argument("--template", default="MNI152NLin2009cAsym", help="target template")
+    parser.add_argument("--resolution", type=int, default=1, help="template resolution index")
+    parser.add_argument(
+        "--reference",
+        nargs=3,
+        type=Path,
+        metavar=("T1W", "MASK", "DSEG"),
+        help="target images (instead of the template)",
+    )
+    parser.add_argument(
+        "--presets", nargs="+", default=["precise"], help="preset names or JSON files"
+    )
+    parser.add_argument("--nprocs", type=int, default=1, help="threads of antsRegistration")
+    parser.add_argument("--work-dir", type=Path, help="keep intermediate results here")
+    opts = parser.parse_args()
+
+    with TemporaryDirectory() as tmpdir:
+        work_dir = (opts.work_dir or Path(tmpdir)).absolute()
+        reference = (
+            _reference_tissues(*opts.reference)
+            if opts.reference
+            else _template_tissues(opts.template, opts.resolution)
+        )
+        print("\t".join(["preset", "time_s", "brain"] + list(TISSUES)))
+        for preset in opts.presets:
+            row = _benchmark(preset, opts, reference, work_dir)
+            print("\t".join([preset, f"{row[0]:.1f}"] + [f"{d:.4f}" for d in row[1:]]))
+            sys.stdout.flush()
+
+
+def _template_tissues(template, resolution):
+    """Return the template T1w, and its brain mask and tissue labels (BIDS)."""
+    import numpy as np
+    import nibabel as nb
+    from templateflow import api as tf
+
+    name, *specs = template.split(":")
+    query = dict(s.split("-", 1) for s in specs)
+    query["resolution"] = resolution
+    t1w = tf.get(name, desc=None, suffix="T1w", **query)
+    probs = np.stack([
+        np.asanyarray(nb.load(tf.get(name, label=label, suffix="probseg", **query)).dataobj)
+        for label in TISSUES
+    ])
+    brain = probs.sum(0) > 0.5
+    labels = np.where(brain, probs.argmax(0) + 1, 0)
+    return str(t1w), brain, labels
+
+
+def _reference_tissues(t1w, mask, dseg):
+    """Return a user-provided T1w, and its brain mask and tissue labels (BIDS)."""
+    import numpy as np
+    import nibabel as nb
+
+    brain = np.asanyarray(nb.load(mask).dataobj) > 0
+    labels = np.where(brain, np.asanyarray(nb.load(dseg).dataobj), 0)
+    return str(t1w.absolute()), brain, labels
+
+
+def _benchmark(preset, opts, reference, work_dir):
+    """Register with a preset, and calculate the overlaps with the template."""
+    import numpy as np
+    import nibabel as nb
+    from niworkflows.interfaces.norm import SpatialNormalization
+    from smriprep.interfaces.resampling import resample_images
+    from smriprep.utils.registration import write_preset
+
+    name, *specs = opts.template.split(":")
+    preset_dir = work_dir / Path(preset).name.split(".")[0]
+    preset_dir.mkdir(parents=True, exist_ok=True)
+    norm = SpatialNormalization(
+        float=True,
+        moving_image=str(opts.t1w.absolute()),
+        moving_mask=str(opts.mask.absolute()),
+        num_threads=opts.nprocs,
+        settings=write_preset(preset, preset_dir),
+        template=name,
+        template_spec={**dict(s.split("-", 1) for s in specs), "res": opts.resolution},
+    )
+    if opts.reference:
+        norm.inputs.reference_image = str(opts.reference[0].absolute())
+        norm.inputs.reference_mask = str(opts.reference[1].absolute())
+    tic = perf_counter()
+    result = norm.run(cwd=str(preset_dir))
+    elapsed = perf_counter() - tic
+
+    t1w, brain, labels = reference
+    mask_std, dseg_std = [
+        np.asanyarray(nb.load(f).dataobj)
+        for f in resample_images(
+            [opts.mask.absolute(), opts.dseg.absolute()],
+            ["MultiLabel", "MultiLabel"],
+            t1w,
+            [result.outputs.composite_transform],
+            num_threads=opts.nprocs,
+            newpath=preset_dir,
+        )
+    ]
+    return [elapsed, _dice(mask_std > 0, brain)] + [
+        _dice(dseg_std == i, labels == i) for i in range(1, len(TISSUES) + 1)
+    ]
+
+
+def _dice(a, b):
+    return 2.0 * (a & b).sum() / max(a.sum() + b.sum(), 1)
+
+
+if __name__ == "__main__":
+    main()
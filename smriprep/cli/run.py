@@ -107,6 +107,14 @@ def get_parser():
         "{<suffix>:{<entity>:<filter>,...},...} "
         "(https://github.com/bids-standard/pybids/blob/master/bids/layout/config/bids.json)",
     )
+    g_bids.add_argument(
+        "--bids-database-dir",
+        metavar="PATH",
+        type=Path,
+        help="Path to a PyBIDS database folder, for faster indexing (especially "
+        "useful for large datasets). Will be created if not present, and "
+        "re-indexed whenever the dataset's folder structure has changed.",
+    )
 
     g_perfm = parser.add_argument_group("Options to handle performance")
     g_perfm.add_argument(
@@ -134,6 +142,14 @@ def get_parser():
         type=float,
         help="upper bound memory limit for sMRIPrep processes (in GB).",
     )
+    g_perfm.add_argument(
+        "--build-nprocs",
+        action="store",
+        type=int,
+        default=1,
+        help="number of processes used to build the workflow graphs of subjects "
+        "in parallel (0: as many as CPUs are available)",
+    )
     g_perfm.add_argument(
         "--low-mem",
         action="store_true",
@@ -196,6 +212,47 @@ def get_parser():
         "stripping, skip ignores skull stripping, and auto automatically "
         "ignores skull stripping if pre-stripped brains are detected).",
     )
+    g_ants.add_argument(
+        "--batch-resampling",
+        action="store_true",
+        default=False,
+        help="resample all T1w-space outputs onto each template within one process "
+        "that reads the transform once, instead of one antsApplyTransforms call per "
+        "image (interpolations approximate those of ANTs)",
+    )
+    g_ants.add_argument(
+        "--hub-template",
+        action="store",
+        metavar="TEMPLATE",
+        help="register only to this template (e.g., MNI152NLin2009cAsym), and chain "
+        "the result with TemplateFlow's template-to-template transforms to normalize "
+        "to other --output-spaces",
+    )
+    g_ants.add_argument(
+        "--hub-qc",
+        action="store_true",
+        default=False,
+        help="with --hub-template, also register directly to the other templates and "
+        "report the discrepancies with the chained transforms",
+    )
+    g_ants.add_argument(
+        "--registration-resolution",
+        action="store",
+        type=int,
+        metavar="RES",
+        help="TemplateFlow resolution index of the templates the T1w is registered to "
+        "(e.g., 2 for 2mm MNI templates; default: 1, or 2 with --sloppy), "
+        "independently of the resolutions requested with --output-spaces",
+    )
+    g_ants.add_argument(
+        "--registration-preset",
+        action="store",
+        nargs="+",
+        metavar="[TEMPLATE=]PRESET",
+        help="antsRegistration presets for spatial normalization, either for all "
+        "templates or for one (e.g., fast MNI152NLin2009cAsym=precise); presets are "
+        "balanced, fast, precise (default) or testing, or a JSON file of settings",
+    )
 
     # FreeSurfer options
     g_fs = parser.add_argument_group("Specific options for FreeSurfer preprocessing")
@@ -213,6 +270,20 @@ def get_parser():
         help="Path to existing FreeSurfer subjects directory to reuse. "
         "(default: OUTPUT_DIR/freesurfer)",
     )
+    g_fs.add_argument(
+        "--fs-aseg-tissues",
+        action="store_true",
+        default=False,
+        help="derive the brain tissue segmentation and (binary) probability maps from "
+        "FreeSurfer's aseg instead of running FSL FAST (no effect with --fs-no-reconall)",
+    )
+    g_fs.add_argument(
+        "--fs-header-xfm",
+        action="store_true",
+        default=False,
+        help="derive the fsnative-to-T1w transform from the image headers, running "
+        "mri_robust_register only if the images do not match that way",
+    )
 
     # Surface generation xor
     g_surfs = parser.add_argument_group("Surface preprocessing options")
@@ -272,6 +343,13 @@ def get_parser():
         default=False,
         help="Write workflow graph.",
     )
+    g_other.add_argument(
+        "--graph-cache",
+        action="store_true",
+        default=False,
+        help="cache the workflow graph of each subject in the working directory, and "
+        "reuse it in subsequent runs with the same options and input files.",
+    )
     g_other.add_argument(
         "--stop-on-first-crash",
         action="store_true",
@@ -306,9 +384,11 @@ def build_opts(opts):
     import sys
     import gc
     import warnings
+    from time import perf_counter
     from multiprocessing import set_start_method, Process, Manager
     from nipype import logging as nlogging
     from niworkflows.utils.misc import check_valid_fs_license
+    from ..utils.graph import load_workflow
 
     set_start_method("forkserver")
 
@@ -355,7 +435,7 @@ def build_opts(opts):
         if p.exitcode != 0:
             sys.exit(p.exitcode)
 
-        smriprep_wf = retval["workflow"]
+        workflow_file = retval["workflow_file"]
         plugin_settings = retval["plugin_settings"]
         bids_dir = retval["bids_dir"]
         output_dir = retval["output_dir"]
@@ -363,9 +443,15 @@ def build_opts(opts):
         run_uuid = retval["run_uuid"]
         retcode = retval["return_code"]
 
-    if smriprep_wf is None:
+    if workflow_file is None:
         sys.exit(1)
 
+    # The workflow graph is passed from the child process through the filesystem
+    tic = perf_counter()
+    smriprep_wf = load_workflow(workflow_file)
+    logger.log(25, "Loaded workflow graph in %.2fs.", perf_counter() - tic)
+    Path(workflow_file).unlink()
+
     if opts.write_graph:
         smriprep_wf.write_graph(graph2use="colored", format="svg", simple_form=True)
 
@@ -425,20 +511,25 @@ def build_workflow(opts, retval):
     dictionary (``retval``) to allow isolation using a
     ``multiprocessing.Process`` that allows smriprep to enforce
     a hard-limited memory-scope.
+    The workflow itself is not returned through ``retval``, as proxying
+    large graphs is very slow. Instead, it is serialized into the working
+    directory and its path is set as ``retval["workflow_file"]``.
 
     """
     from shutil import copyfile
     from os import cpu_count
     import uuid
-    from time import strftime
+    from time import strftime, perf_counter
     from subprocess import check_call, CalledProcessError, TimeoutExpired
     from pkg_resources import resource_filename as pkgrf
 
     import json
-    from bids import BIDSLayout
     from nipype import logging, config as ncfg
     from niworkflows.utils.bids import collect_participants
     from ..__about__ import __version__
+    from ..utils.bids import init_layout
+    from ..utils.graph import save_workflow
+    from ..utils.registration import parse_preset_args
     from ..workflows.base import init_smriprep_wf
 
     logger = logging.getLogger("nipype.workflow")
@@ -457,7 +548,22 @@ def build_workflow(opts, retval):
 
     # First check that bids_dir looks like a BIDS folder
     bids_dir = opts.bids_dir.resolve()
-    layout = BIDSLayout(str(bids_dir), validate=False)
+    bids_database_dir = (
+        opts.bids_database_dir.resolve() if opts.bids_database_dir else None
+    )
+    tic = perf_counter()
+    layout, reused = init_layout(
+        bids_dir,
+        database_dir=bids_database_dir,
+        participant_label=opts.participant_label,
+    )
+    logger.log(
+        25,
+        "%s BIDS dataset index%s in %.2fs.",
+        "Reused" if reused else "Built",
+        " (restricted to the selected participants)" if opts.participant_label else "",
+        perf_counter() - tic,
+    )
     subject_list = collect_participants(
         layout, participant_label=opts.participant_label
     )
@@ -546,7 +652,7 @@ def build_workflow(opts, retval):
     retval["work_dir"] = str(work_dir)
     retval["subject_list"] = subject_list
     retval["run_uuid"] = run_uuid
-    retval["workflow"] = None
+    retval["workflow_file"] = None
 
     # Called with reports only
     if opts.reports_only:
@@ -578,7 +684,8 @@ def build_workflow(opts, retval):
     )
 
     # Build main workflow
-    retval["workflow"] = init_smriprep_wf(
+    tic = perf_counter()
+    smriprep_wf = init_smriprep_wf(
         debug=opts.sloppy,
         fast_track=opts.fast_track,
         freesurfer=opts.run_reconall,
@@ -597,10 +704,35 @@ def build_workflow(opts, retval):
         subject_list=subject_list,
         work_dir=str(work_dir),
         bids_filters=bids_filters,
+        graph_cache=opts.graph_cache,
+        build_nprocs=opts.build_nprocs or cpu_count(),
+        fs_aseg_tissues=opts.fs_aseg_tissues,
+        fs_header_xfm=opts.fs_header_xfm,
+        batch_resampling=opts.batch_resampling,
+        hub_template=opts.hub_template,
+        hub_qc=opts.hub_qc,
+        registration_resolution=opts.registration_resolution,
+        registration_presets=parse_preset_args(
+            opts.registration_preset, ["precise", "testing"][opts.sloppy]
+        )
+        if opts.registration_preset
+        else None,
+    )
+    logger.log(25, "Built workflow graph in %.2fs.", perf_counter() - tic)
+
+    tic = perf_counter()
+    workflow_file = work_dir / run_uuid / "smriprep_wf.pklz"
+    size = save_workflow(smriprep_wf, workflow_file)
+    logger.log(
+        25,
+        "Serialized workflow graph (%.1f MB) in %.2fs.",
+        size / 2 ** 20,
+        perf_counter() - tic,
     )
+    retval["workflow_file"] = str(workflow_file)
     retval["return_code"] = 0
 
-    boilerplate = retval["workflow"].visit_desc()
+    boilerplate = smriprep_wf.visit_desc()
     (log_dir / "CITATION.md").write_text(boilerplate)
     logger.log(
         25,
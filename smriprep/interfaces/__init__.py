@@ -2,11 +2,33 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 # Load modules for compatibility
+from niworkflows.interfaces import bids as _nwbids
 from niworkflows.interfaces.bids import DerivativesDataSink as DDS
 
+# Per-vertex maps on surfaces (e.g., sub-01_hemi-L_space-fsaverage_den-10k_thickness.shape.gii)
+_SHAPE_PATTERN = (
+    "sub-{subject}[/ses-{session}]/{datatype<anat>|anat}/sub-{subject}[_ses-{session}]"
+    "[_acq-{acquisition}][_ce-{ceagent}][_rec-{reconstruction}][_run-{run}]_hemi-{hemi<L|R>}"
+    "[_space-{space}][_cohort-{cohort}][_den-{density}]"
+    "_{suffix<thickness|curv|sulc>}{extension<.shape.gii>}"
+)
+
 
 class DerivativesDataSink(DDS):
     out_path_base = "smriprep"
+    _file_patterns = _nwbids.BIDS_DERIV_PATTERNS + (_SHAPE_PATTERN,)
+
+    def _run_interface(self, runtime):
+        # NiWorkflows builds paths from its module-level patterns, and offers
+        # no other way to extend them: swap ours in only while this sink runs.
+        # This is not thread-safe: it relies on Nipype running nodes in separate
+        # processes (or serially), never in concurrent threads of one process.
+        patterns = _nwbids.BIDS_DERIV_PATTERNS
+        _nwbids.BIDS_DERIV_PATTERNS = self._file_patterns
+        try:
+            return super()._run_interface(runtime)
+        finally:
+            _nwbids.BIDS_DERIV_PATTERNS = patterns
 
 
 del DDS
@@ -20,11 +20,19 @@
 #
 #     https://www.nipreps.org/community/licensing/
 #
-"""Nipype's recon-all replacement."""
+"""Nipype's recon-all replacement, and other FreeSurfer-related interfaces."""
 import os
 from nipype import logging
 from nipype.utils.filemanip import check_depends
-from nipype.interfaces.base import traits, InputMultiObject, isdefined
+from nipype.interfaces.base import (
+    traits,
+    BaseInterfaceInputSpec,
+    File,
+    InputMultiObject,
+    SimpleInterface,
+    TraitedSpec,
+    isdefined,
+)
 from nipype.interfaces import freesurfer as fs
 
 iflogger = logging.getLogger("nipype.interface")
@@ -199,3 +207,121 @@ class ReconAll(fs.ReconAll):
         if name == "hemi":
             return trait_spec.argstr % value
         return super()._format_arg(name, trait_spec, value)
+
+
+class _HeaderRegisterInputSpec(BaseInterfaceInputSpec):
+    source_file = File(
+        exists=True, mandatory=True, desc="conformed image (e.g., FreeSurfer's T1.mgz)"
+    )
+    target_file = File(exists=True, mandatory=True, desc="image given to recon-all")
+    flags = traits.List(traits.Str, desc="flags given to recon-all")
+    shift = traits.Float(2.0, usedefault=True, desc="size (mm) of the alignment test shifts")
+    min_corr = traits.Float(
+        0.5, usedefault=True, desc="minimal correlation of the images when aligned"
+    )
+
+
+class _HeaderRegisterOutputSpec(TraitedSpec):
+    out_reg_file = File(exists=True, desc="LTA transform from source to target")
+    method = traits.Enum("header", "robust", desc="how the transform was obtained")
+
+
+class HeaderRegister(SimpleInterface):
+    """
+    Calculate the transform between a FreeSurfer-conformed image and its source.
+
+    ``recon-all`` conforms its input preserving scanner coordinates, so (unless the
+    field of view is cropped with ``-cw256``) the transform is the identity in
+    RAS+ space, and the LTA file is determined by the geometry of both headers.
+    The result is accepted if the images are correlated, and more so than
+    after shifting the source by ``shift`` mm along any axis.
+    Otherwise, ``mri_robust_register`` is run, as in
+    :py:class:`~niworkflows.interfaces.freesurfer.PatchedRobustRegister`.
+
+    """
+
+    input_spec = _HeaderRegisterInputSpec
+    output_spec = _HeaderRegisterOutputSpec
+
+    def _run_interface(self, runtime):
+        out_file = os.path.join(runtime.cwd, "fsnative2t1w.lta")
+        flags = self.inputs.flags if isdefined(self.inputs.flags) else []
+        if "-cw256" not in flags:
+            corr = header_alignment(
+                self.inputs.source_file, self.inputs.target_file, shift=self.inputs.shift
+            )
+            iflogger.info("Correlations of header-aligned images: %s", corr)
+            if corr[0] >= self.inputs.min_corr and corr[0] > max(corr[1:]):
+                import numpy as np
+                import nibabel as nb
+                from nitransforms.io.lta import FSLinearTransformArray
+
+                # As mri_robust_register, src is the (moving) source and dst the target
+                FSLinearTransformArray.from_ras(
+                    np.eye(4),
+                    moving=nb.load(self.inputs.target_file),
+                    reference=nb.load(self.inputs.source_file),
+                ).to_filename(out_file)
+                self._results["out_reg_file"] = out_file
+                self._results["method"] = "header"
+                return runtime
+            iflogger.warning("Header-aligned images do not match, running registration.")
+
+        from niworkflows.interfaces.freesurfer import PatchedRobustRegister
+
+        result = PatchedRobustRegister(
+            auto_sens=True,
+            est_int_scale=True,
+            source_file=self.inputs.source_file,
+            target_file=self.inputs.target_file,
+            out_reg_file=out_file,
+        ).run(cwd=runtime.cwd)
+        self._results["out_reg_file"] = result.outputs.out_reg_file
+        self._results["method"] = "robust"
+        return runtime
+
+
+def header_alignment(source_file, target_file, shift=2.0, step=4):
+    """
+    Correlate two images mapped through their headers, and after small shifts.
+
+    Parameters
+    ----------
+    source_file, target_file : os.PathLike
+        The images.
+    shift : :obj:`float`
+        Distance (mm) by which the source is shifted along each axis.
+    step : :obj:`int`
+        Only every ``step``-th voxel of the target (along each axis) is sampled.
+
+    Returns
+    -------
+    corr : :obj:`list` of :obj:`float`
+        Correlations of the target's head voxels (above the mean intensity)
+        with the source, aligned first, then shifted by -/+ ``shift`` along
+        each axis.
+
+    """
+    import numpy as np
+    import nibabel as nb
+    from scipy import ndimage as ndi
+
+    src = nb.load(source_file)
+    tgt = nb.load(target_file)
+    values = np.asanyarray(tgt.dataobj[::step, ::step, ::step], dtype="float32")
+    ijk = np.indices(values.shape).reshape(3, -1) * step
+    values = values.ravel()
+    head = values > values.mean()
+    values = values[head]
+    xyz = tgt.affine[:3, :3] @ ijk[:, head] + tgt.affine[:3, 3:]
+
+    data = np.asanyarray(src.dataobj, dtype="float32")
+    ras2vox = np.linalg.inv(src.affine)
+    corr = []
+    for offset in [np.zeros(3)] + [
+        sign * shift * axis for axis in np.eye(3) for sign in (-1, 1)
+    ]:
+        vox = ras2vox[:3, :3] @ (xyz + offset[:, np.newaxis]) + ras2vox[:3, 3:]
+        sampled = ndi.map_coordinates(data, vox, order=1, cval=0.0)
+        corr.append(float(np.corrcoef(values, sampled)[0, 1]))
+    return corr
@@ -0,0 +1,487 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Resampling several images through the same transforms."""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import nibabel as nb
+from scipy import ndimage as ndi
+
+from nipype.interfaces.base import (
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    SimpleInterface,
+    File,
+    InputMultiObject,
+    OutputMultiObject,
+    traits,
+)
+from nipype.utils.filemanip import fname_presuffix
+
+INTERPOLATIONS = (
+    "Linear",
+    "NearestNeighbor",
+    "MultiLabel",
+    "Gaussian",
+    "BSpline",
+    "LanczosWindowedSinc",
+)
+
+
+class _MultiApplyTransformsInputSpec(BaseInterfaceInputSpec):
+    input_images = InputMultiObject(
+        File(exists=True), mandatory=True, desc="images to resample"
+    )
+    interpolation = InputMultiObject(
+        traits.Enum(*INTERPOLATIONS),
+        mandatory=True,
+        desc="interpolation of each input image",
+    )
+    reference_image = File(
+        exists=True, mandatory=True, desc="image defining the grid of outputs"
+    )
+    transforms = InputMultiObject(
+        File(exists=True),
+        mandatory=True,
+        desc="ANTs/ITK transform files, in the order of antsApplyTransforms "
+        "(i.e., the last one is applied first)",
+    )
+    default_value = traits.Float(
+        0.0, usedefault=True, desc="value of samples falling outside the inputs"
+    )
+    num_threads = traits.Int(1, usedefault=True, nohash=True, desc="number of threads")
+
+
+class _MultiApplyTransformsOutputSpec(TraitedSpec):
+    output_images = OutputMultiObject(File(exists=True), desc="resampled images")
+
+
+class MultiApplyTransforms(SimpleInterface):
+    """
+    Resample several images onto a reference grid through the same transforms.
+
+    A drop-in replacement for a number of ``antsApplyTransforms`` calls sharing
+    their transforms and reference: transforms are read, and the sampling
+    coordinates calculated, only once; then each input is interpolated
+    (in parallel threads) with its own method.
+    Interpolations emulate those of ANTs, with the following approximations:
+
+    * ``LanczosWindowedSinc`` and ``BSpline``: cubic B-spline.
+    * ``MultiLabel``: each voxel takes the label with the largest (trilinear)
+      partial volume at the sampling location.
+    * ``Gaussian``: trilinear, after smoothing with a Gaussian kernel truncated
+      at one voxel.
+
+    Intensity images are written in single precision, label images (``MultiLabel``
+    and ``NearestNeighbor``) keep the type of the input.
+
+    """
+
+    input_spec = _MultiApplyTransformsInputSpec
+    output_spec = _MultiApplyTransformsOutputSpec
+
+    def _run_interface(self, runtime):
+        if len(self.inputs.interpolation) != len(self.inputs.input_images):
+            raise ValueError("One interpolation method must be given per input image.")
+
+        self._results["output_images"] = resample_images(
+            self.inputs.input_images,
+            self.inputs.interpolation,
+            self.inputs.reference_image,
+            self.inputs.transforms,
+            default_value=self.inputs.default_value,
+            num_threads=self.inputs.num_threads,
+            newpath=runtime.cwd,
+        )
+        return runtime
+
+
+class _ResampleLabelsInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiObject(
+        File(exists=True), mandatory=True, desc="label volumes (e.g., FreeSurfer's aseg.mgz)"
+    )
+    reference_image = File(exists=True, mandatory=True, desc="image defining the output grid")
+    lta_file = File(
+        exists=True,
+        mandatory=True,
+        desc="FreeSurfer LTA transform, from the space of inputs to the reference",
+    )
+
+
+class _ResampleLabelsOutputSpec(TraitedSpec):
+    out_files = OutputMultiObject(File(exists=True), desc="resampled label volumes")
+
+
+class ResampleLabels(SimpleInterface):
+    """
+    Resample label volumes with nearest-neighbor interpolation, as ``mri_vol2vol``.
+
+    The index of the input voxel nearest to each output voxel is calculated only once,
+    then each label volume is gathered through it.
+    Outputs are NIfTI files with the grid of the reference and the data type of
+    the inputs, named after the inputs.
+
+    """
+
+    input_spec = _ResampleLabelsInputSpec
+    output_spec = _ResampleLabelsOutputSpec
+
+    def _run_interface(self, runtime):
+        self._results["out_files"] = resample_labels(
+            self.inputs.in_files,
+            self.inputs.reference_image,
+            self.inputs.lta_file,
+            newpath=runtime.cwd,
+        )
+        return runtime
+
+
+def load_transforms(transforms):
+    """
+    Read ANTs/ITK transforms.
+
+    Parameters
+    ----------
+    transforms : :obj:`list` of os.PathLike
+        Affine (``.mat`` or ``.txt``), displacements field (``.nii[.gz]``)
+        or composite (``.h5``) transform files, in the order of
+        ``antsApplyTransforms`` (i.e., the last one is applied first).
+
+    Returns
+    -------
+    chain : :obj:`list` of :obj:`tuple`
+        Transforms in the order they map points of the reference onto the input,
+        either ``("affine", matrix)`` or ``("field", (deltas, ras2vox))``, in RAS+.
+
+    """
+    from nitransforms.io import itk
+
+    def _convert(xfm):
+        if isinstance(xfm, itk.ITKLinearTransform):
+            return ("affine", xfm.to_ras())
+        # Displacements field, one (contiguous, single precision) volume per axis
+        deltas = np.asanyarray(xfm.dataobj).reshape(xfm.shape[:3] + (3,))
+        deltas = np.stack([deltas[..., i].astype("float32") for i in range(3)])
+        return ("field", (deltas, np.linalg.inv(xfm.affine)))
+
+    chain = []
+    for fname in reversed([str(f) for f in transforms]):
+        if fname.endswith(".h5"):
+            # Composite transforms also apply the last transform first
+            chain += [
+                _convert(xfm) for xfm in reversed(itk.ITKCompositeH5.from_filename(fname))
+            ]
+        elif fname.endswith((".nii", ".nii.gz")):
+            chain.append(_convert(itk.ITKDisplacementsField.from_filename(fname)))
+        else:
+            chain.append(_convert(itk.ITKLinearTransform.from_filename(fname)))
+    return chain
+
+
+def map_points(chain, points):
+    """
+    Map physical (RAS+) coordinates through a chain of transforms.
+
+    Displacements fields are interpolated linearly, and displacements outside
+    of their extent are zero, as in ITK.
+
+    Parameters
+    ----------
+    chain : :obj:`list` of :obj:`tuple`
+        Transforms, as returned by :py:func:`load_transforms`.
+    points : :obj:`numpy.ndarray`
+        Coordinates, of shape (3, N).
+
+    Examples
+    --------
+    >>> shift = np.eye(4)
+    >>> shift[:3, 3] = (1, 2, 3)
+    >>> field = (np.ones((3, 4, 4, 4), dtype="float32"), np.eye(4))
+    >>> map_points([("field", field), ("affine", shift)], np.zeros((3, 1))).ravel()
+    array([2., 3., 4.])
+
+    """
+    points = np.asanyarray(points, dtype="float64")
+    for kind, xfm in chain:
+        if kind == "affine":
+            points = xfm[:3, :3] @ points + xfm[:3, 3:]
+            continue
+        deltas, ras2vox = xfm
+        ijk = ras2vox[:3, :3] @ points + ras2vox[:3, 3:]
+        points = points + np.stack(
+            [ndi.map_coordinates(d, ijk, order=1, mode="constant", cval=0.0) for d in deltas]
+        )
+    return points
+
+
+def resample_images(
+    input_images,
+    interpolation,
+    reference_image,
+    transforms,
+    default_value=0.0,
+    num_threads=1,
+    newpath=None,
+):
+    """
+    Resample images onto a reference grid, calculating sampling coordinates once.
+
+    See :py:class:`MultiApplyTransforms`.
+
+    Returns
+    -------
+    out_files : :obj:`list` of :obj:`str`
+        Resampled images, named after the inputs with a ``_trans`` suffix.
+
+    """
+    ref = nb.load(reference_image)
+    shape = ref.shape[:3]
+    chain = load_transforms(transforms)
+    headers = [nb.load(str(f)).header for f in input_images]
+
+    # Voxel coordinates of the samples, per input grid (typically, just one),
+    # in the (Fortran) order of the reference's voxels
+    grids = {}
+    for hdr in headers:
+        grids.setdefault(_grid_key(hdr), np.linalg.inv(hdr.get_best_affine()))
+    coords = {key: np.zeros((3, np.prod(shape)), dtype="float32") for key in grids}
+    slab = max(1, 2 ** 20 // (shape[0] * shape[1]))
+    for k in range(0, shape[2], slab):
+        stop = min(k + slab, shape[2])
+        ijk = np.mgrid[0:shape[0], 0:shape[1], k:stop].reshape(3, -1, order="F")
+        points = map_points(chain, ref.affine[:3, :3] @ ijk + ref.affine[:3, 3:])
+        dest = np.s_[:, k * shape[0] * shape[1]:stop * shape[0] * shape[1]]
+        for key, ras2vox in grids.items():
+            coords[key][dest] = ras2vox[:3, :3] @ points + ras2vox[:3, 3:]
+    del points, ijk
+
+    newpath = Path(newpath or Path.cwd())
+    out_files = []
+    for in_file in input_images:
+        out_file = fname_presuffix(in_file, suffix="_trans", newpath=str(newpath))
+        while out_file in out_files:
+            out_file = fname_presuffix(out_file, suffix="_trans", use_ext=True)
+        out_files.append(out_file)
+
+    def _resample(i):
+        img = nb.load(str(input_images[i]))
+        data = _interpolate(
+            np.asanyarray(img.dataobj).reshape(img.shape[:3]),
+            coords[_grid_key(headers[i])],
+            interpolation[i],
+            default_value,
+        ).reshape(shape, order="F")
+        hdr = ref.header.copy()
+        hdr.set_data_dtype(data.dtype)
+        hdr.set_data_shape(shape)
+        ref.__class__(data, ref.affine, hdr).to_filename(out_files[i])
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        list(pool.map(_resample, range(len(out_files))))
+    return out_files
+
+
+def resample_labels(in_files, reference_image, lta_file, newpath=None):
+    """
+    Resample label volumes through an LTA transform, sharing nearest-neighbor indices.
+
+    See :py:class:`ResampleLabels`.
+
+    Returns
+    -------
+    out_files : :obj:`list` of :obj:`str`
+        Resampled volumes, with the names of the inputs and extension ``.nii.gz``.
+
+    """
+    from nitransforms.io.lta import FSLinearTransformArray
+
+    ref = nb.load(str(reference_image))
+    shape = ref.shape[:3]
+    # Maps points of the LTA's destination (the reference) onto its source
+    ref2src = FSLinearTransformArray.from_filename(str(lta_file)).to_ras()[0]
+    imgs = [nb.load(str(f)) for f in in_files]
+
+    indices = {}
+    for img in imgs:
+        key = _grid_key(img.header)
+        if key not in indices:
+            indices[key] = _nearest_indices(
+                ref.affine, shape, np.linalg.inv(img.affine) @ ref2src, img.shape[:3]
+            )
+
+    newpath = Path(newpath or Path.cwd())
+    out_files = []
+    for in_file, img in zip(in_files, imgs):
+        index, outside = indices[_grid_key(img.header)]
+        data = np.asanyarray(img.dataobj).reshape(img.shape[:3]).ravel(order="F")
+        labels = data[index]
+        labels[outside] = 0
+
+        out_file = fname_presuffix(in_file, suffix=".nii.gz", newpath=str(newpath), use_ext=False)
+        hdr = ref.header.copy()
+        hdr.set_data_dtype(data.dtype)
+        hdr.set_data_shape(shape)
+        nb.Nifti1Image(labels.reshape(shape, order="F"), ref.affine, hdr).to_filename(out_file)
+        out_files.append(out_file)
+    return out_files
+
+
+def _nearest_indices(ref_affine, shape, ras2vox, src_shape):
+    """
+    Index (flat, Fortran order) the nearest source voxel of each reference voxel.
+
+    Rounding is half away from zero, as FreeSurfer's ``nint``.
+
+    >>> index, outside = _nearest_indices(np.eye(4), (2, 2, 1), np.eye(4), (1, 3, 1))
+    >>> index.tolist(), outside.tolist()
+    ([0, 0, 1, 0], [False, True, False, True])
+
+    """
+    vox2vox = ras2vox @ ref_affine
+    index = np.zeros(
+        int(np.prod(shape)), dtype="int32" if np.prod(src_shape) < 2 ** 31 else "int64"
+    )
+    outside = np.zeros(index.shape, dtype=bool)
+    slab = max(1, 2 ** 20 // (shape[0] * shape[1]))
+    for k in range(0, shape[2], slab):
+        stop = min(k + slab, shape[2])
+        ijk = np.mgrid[0:shape[0], 0:shape[1], k:stop].reshape(3, -1, order="F")
+        src = vox2vox[:3, :3] @ ijk + vox2vox[:3, 3:]
+        src = (np.sign(src) * np.floor(np.abs(src) + 0.5)).astype("int64")
+        out = np.any((src < 0) | (src >= np.array(src_shape)[:, np.newaxis]), axis=0)
+        dest = np.s_[k * shape[0] * shape[1]:stop * shape[0] * shape[1]]
+        index[dest] = np.ravel_multi_index(
+            np.where(out, 0, src), src_shape, order="F"
+        )
+        outside[dest] = out
+    return index, outside
+
+
+def _grid_key(header):
+    return header.get_data_shape()[:3], header.get_best_affine().tobytes()
+
+
+def _interpolate(data, coords, method, cval):
+    """Interpolate an image at voxel coordinates, approximating ANTs' methods."""
+    kwargs = {"mode": "constant", "cval": cval, "output": np.float32}
+    if method in ("MultiLabel", "NearestNeighbor"):
+        if data.dtype.kind not in "iu":
+            data = np.rint(data).astype("int32")
+        if method == "NearestNeighbor":
+            return ndi.map_coordinates(data, coords, order=0, **{**kwargs, "output": data.dtype})
+
+        # Label voting, with partial volumes of each label
+        out = np.full(coords.shape[1], cval, dtype=data.dtype)
+        best = np.zeros(coords.shape[1], dtype="float32")
+        for label in np.unique(data):
+            weight = ndi.map_coordinates(
+                (data == label).view("uint8"), coords, order=1, **{**kwargs, "cval": 0.0}
+            )
+            wins = weight > best
+            out[wins] = label
+            best[wins] = weight[wins]
+        return out
+
+    data = data.astype("float32", copy=False)
+    if method == "Gaussian":
+        data = ndi.gaussian_filter(data, 1.0, truncate=1.0)
+    if method in ("Linear", "Gaussian"):
+        return ndi.map_coordinates(data, coords, order=1, **kwargs)
+
+    data = ndi.spline_filter(data, order=3, output=np.float32, mode="constant")
+    return ndi.map_coordinates(data, coords, order=3, prefilter=False, **kwargs)
+
+
+def concat_composites(in_files, out_file):
+    """
+    Concatenate ITK composite (``.h5``) transforms into one composite transform.
+
+    The transforms are not resampled, so the result is exact and cheap to obtain.
+
+    Parameters
+    ----------
+    in_files : :obj:`list` of os.PathLike
+        Composite transform files, in the order of ``antsApplyTransforms``
+        (i.e., the last one is applied first).
+    out_file : os.PathLike
+        The concatenated composite transform file.
+
+    """
+    import h5py
+
+    with h5py.File(out_file, "w") as out:
+        group = out.create_group("TransformGroup")
+        group.create_dataset("0/TransformType", data=[b"CompositeTransform_double_3_3"])
+        index = 0
+        for fname in in_files:
+            with h5py.File(fname, "r") as h5:
+                xfms = h5["TransformGroup"]
+                for key in sorted(xfms, key=int):
+                    xfm_type = xfms[key]["TransformType"][0]
+                    if xfm_type.decode().startswith("CompositeTransform"):
+                        continue
+                    index += 1
+                    h5.copy(xfms[key], group, name=str(index))
+    return str(out_file)
+
+
+def compare_transforms(reference, transforms1, transforms2, mask=None):
+    """
+    Measure the discrepancy between two transforms, on the grid of a reference.
+
+    Parameters
+    ----------
+    reference : os.PathLike
+        Image defining the grid of points to map.
+    transforms1, transforms2 : :obj:`list` of os.PathLike
+        Transforms to compare, as accepted by :py:func:`load_transforms`.
+    mask : os.PathLike, optional
+        Only consider voxels within this mask (on the reference grid).
+
+    Returns
+    -------
+    distances : :obj:`dict`
+        Mean, median, 95th percentile and maximum of the distances (in mm) between
+        the images of each point through either transform.
+
+    """
+    ref = nb.load(str(reference))
+    if mask is None:
+        ijk = np.indices(ref.shape[:3]).reshape(3, -1)
+    else:
+        ijk = np.array(np.nonzero(np.asanyarray(nb.load(str(mask)).dataobj) > 0))
+    points = ref.affine[:3, :3] @ ijk + ref.affine[:3, 3:]
+    del ijk
+
+    dist = np.linalg.norm(
+        map_points(load_transforms(transforms1), points)
+        - map_points(load_transforms(transforms2), points),
+        axis=0,
+    )
+    return {
+        "MeanDistance": float(dist.mean()),
+        "MedianDistance": float(np.median(dist)),
+        "Percentile95Distance": float(np.percentile(dist, 95)),
+        "MaxDistance": float(dist.max()),
+    }
@@ -31,7 +31,11 @@ from nipype.interfaces.base import (
     TraitedSpec,
     SimpleInterface,
     File,
+    InputMultiObject,
+    OutputMultiObject,
+    Directory,
     isdefined,
+    traits,
 )
 
 
@@ -89,6 +93,558 @@ class NormalizeSurf(SimpleInterface):
         return runtime
 
 
+class _FS2GiftiInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiObject(
+        File(exists=True), mandatory=True, desc="FreeSurfer surfaces (e.g., lh.pial)"
+    )
+    transform_file = File(exists=True, desc="FSL or LTA affine transform file")
+    num_threads = traits.Int(1, usedefault=True, nohash=True, desc="number of threads")
+
+
+class _FS2GiftiOutputSpec(TraitedSpec):
+    out_files = OutputMultiObject(File(exists=True), desc="GIFTI surfaces")
+
+
+class FS2Gifti(SimpleInterface):
+    """
+    Convert FreeSurfer surfaces into normalized GIFTI files.
+
+    Produces the same result as running ``mris_convert --to-scanner`` followed by
+    :py:class:`NormalizeSurf` on each surface, without launching any process:
+    vertices are mapped from *tkregister* to scanner coordinates (using the volume
+    geometry of the surface) and through the transform in one step, and no
+    ``VolGeom*`` metadata are written.
+    Surfaces are converted in parallel threads, and output files are named as
+    ``mris_convert``'s (e.g., ``lh.pial_converted.gii``).
+
+    """
+
+    input_spec = _FS2GiftiInputSpec
+    output_spec = _FS2GiftiOutputSpec
+
+    def _run_interface(self, runtime):
+        from concurrent.futures import ThreadPoolExecutor
+
+        transform_file = self.inputs.transform_file
+        transform = load_transform(transform_file if isdefined(transform_file) else None)
+        with ThreadPoolExecutor(max_workers=max(self.inputs.num_threads, 1)) as pool:
+            self._results["out_files"] = list(
+                pool.map(
+                    lambda in_file: fs_to_gifti(in_file, transform, newpath=runtime.cwd),
+                    self.inputs.in_files,
+                )
+            )
+        return runtime
+
+
+def fs_to_gifti(in_file, transform=None, newpath=None):
+    """
+    Convert a FreeSurfer surface into a GIFTI file in scanner (or transformed) coordinates.
+
+    Parameters
+    ----------
+    in_file : :obj:`str`
+        FreeSurfer surface (e.g., ``lh.smoothwm``)
+    transform : (4, 4) :obj:`numpy.ndarray`, optional
+        Affine (RAS-to-RAS) transform applied to the scanner coordinates
+    newpath : :obj:`str`, optional
+        Output directory (default: current working directory)
+
+    """
+    coords, faces, volume_info = nb.freesurfer.read_geometry(in_file, read_metadata=True)
+    affine = tkr2scanner(volume_info)
+    if transform is not None:
+        affine = transform @ affine
+    if not np.allclose(affine, np.eye(4)):
+        coords = nb.affines.apply_affine(affine, coords)
+
+    fname = os.path.basename(in_file)
+    img = nb.gifti.GiftiImage(
+        darrays=[
+            nb.gifti.GiftiDataArray(
+                coords.astype("float32"),
+                intent="NIFTI_INTENT_POINTSET",
+                datatype="NIFTI_TYPE_FLOAT32",
+                meta=nb.gifti.GiftiMetaData(surface_metadata(fname)),
+            ),
+            nb.gifti.GiftiDataArray(
+                faces.astype("int32"),
+                intent="NIFTI_INTENT_TRIANGLE",
+                datatype="NIFTI_TYPE_INT32",
+                meta=nb.gifti.GiftiMetaData({"TopologicalType": "Closed"}),
+            ),
+        ]
+    )
+
+    out_file = os.path.join(newpath or os.getcwd(), f"{fname}_converted.gii")
+    img.to_filename(out_file)
+    return out_file
+
+
+def tkr2scanner(volume_info):
+    """
+    Calculate the affine mapping *tkregister* coordinates onto scanner coordinates.
+
+    Parameters
+    ----------
+    volume_info : :obj:`dict`
+        Volume geometry, as read by :py:func:`nibabel.freesurfer.io.read_geometry`.
+        If empty or not valid, the identity is returned.
+
+    Examples
+    --------
+    >>> tkr2scanner({
+    ...     "valid": "1  # volume info valid",
+    ...     "volume": [256, 256, 256],
+    ...     "voxelsize": [1.0, 1.0, 1.0],
+    ...     "xras": [-1.0, 0.0, 0.0],
+    ...     "yras": [0.0, 0.0, -1.0],
+    ...     "zras": [0.0, 1.0, 0.0],
+    ...     "cras": [2.0, -3.0, 10.0],
+    ... })[:3].tolist()
+    [[1.0, 0.0, 0.0, 2.0], [0.0, 1.0, 0.0, -3.0], [0.0, 0.0, 1.0, 10.0]]
+    >>> tkr2scanner({}).tolist() == np.eye(4).tolist()
+    True
+
+    """
+    if not volume_info or not str(volume_info.get("valid", "")).startswith("1"):
+        return np.eye(4)
+
+    dims = np.asarray(volume_info["volume"], dtype=float)
+    zooms = np.asarray(volume_info["voxelsize"], dtype=float)
+    mdc = np.column_stack([volume_info[k] for k in ("xras", "yras", "zras")]) * zooms
+    vox2ras = nb.affines.from_matvec(mdc, np.asarray(volume_info["cras"]) - mdc @ dims / 2)
+    vox2tkr = np.array(
+        [
+            [-zooms[0], 0, 0, zooms[0] * dims[0] / 2],
+            [0, 0, zooms[2], -zooms[2] * dims[2] / 2],
+            [0, -zooms[1], 0, zooms[1] * dims[1] / 2],
+            [0, 0, 0, 1],
+        ]
+    )
+    return vox2ras @ np.linalg.inv(vox2tkr)
+
+
+def surface_metadata(fname):
+    """
+    Generate the GIFTI metadata of a surface, from its FreeSurfer name.
+
+    Follows ``mris_convert``, adding midthickness metadata as :py:class:`NormalizeSurf`.
+
+    >>> surface_metadata("rh.midthickness")  # doctest: +NORMALIZE_WHITESPACE
+    {'AnatomicalStructurePrimary': 'CortexRight',
+     'AnatomicalStructureSecondary': 'MidThickness', 'GeometricType': 'Anatomical'}
+    >>> surface_metadata("lh.inflated")
+    {'AnatomicalStructurePrimary': 'CortexLeft', 'GeometricType': 'Inflated'}
+
+    """
+    meta = {}
+    lower = fname.lower()
+    if lower.startswith("lh."):
+        meta["AnatomicalStructurePrimary"] = "CortexLeft"
+    elif lower.startswith("rh."):
+        meta["AnatomicalStructurePrimary"] = "CortexRight"
+
+    if "pial" in lower:
+        meta["AnatomicalStructureSecondary"] = "Pial"
+    elif "white" in lower:
+        meta["AnatomicalStructureSecondary"] = "GrayWhite"
+    elif "midthickness" in lower or "graymid" in lower:
+        meta["AnatomicalStructureSecondary"] = "MidThickness"
+
+    if "inflated" in lower:
+        meta["GeometricType"] = "Inflated"
+    elif "sphere" in lower:
+        meta["GeometricType"] = "Spherical"
+    else:
+        meta["GeometricType"] = "Anatomical"
+    return meta
+
+
+class _MidthicknessInputSpec(BaseInterfaceInputSpec):
+    subjects_dir = Directory(exists=True, mandatory=True, desc="FreeSurfer SUBJECTS_DIR")
+    subject_id = traits.Str(mandatory=True, desc="FreeSurfer subject ID")
+    method = traits.Enum(
+        "average",
+        "thickness",
+        usedefault=True,
+        desc="interpolate between the white and pial surfaces, or offset the smoothed "
+        "white surface along its normals by a fraction of the cortical thickness",
+    )
+    fraction = traits.Range(
+        0.0, 1.0, 0.5, usedefault=True, desc="relative distance from white to pial"
+    )
+
+
+class _MidthicknessOutputSpec(TraitedSpec):
+    out_files = OutputMultiObject(File(exists=True), desc="lh and rh midthickness surfaces")
+
+
+class Midthickness(SimpleInterface):
+    """
+    Generate midthickness surfaces of both hemispheres into the subject's ``surf/``.
+
+    Used in place of ``mris_expand -thickness`` (see
+    :py:class:`niworkflows.interfaces.freesurfer.MakeMidthickness`), which moves
+    the surface iteratively, with smoothing and self-intersection checks.
+    The results are not the same: by default (``method="average"``), each vertex is
+    placed at ``fraction`` of the way from the white to the pial surface.
+    With ``method="thickness"``, ``?h.smoothwm`` is offset in a single step along
+    its (area-weighted) vertex normals, which may self-intersect in tight sulci.
+    Surfaces are not regenerated if ``?h.midthickness`` (or, else, ``?h.graymid``)
+    is newer than the surfaces it derives from, and was generated with the same
+    method and fraction (as recorded in the surface's creation stamp).
+    Surfaces created by other tools (e.g., ``mris_expand``, or provided by the user)
+    are assumed to be correct, and are reused with the default method and fraction.
+    A ``?h.graymid`` surface is copied to ``?h.midthickness``.
+
+    """
+
+    input_spec = _MidthicknessInputSpec
+    output_spec = _MidthicknessOutputSpec
+
+    def _run_interface(self, runtime):
+        surf_dir = os.path.join(self.inputs.subjects_dir, self.inputs.subject_id, "surf")
+        self._results["out_files"] = [
+            make_midthickness(surf_dir, hemi, self.inputs.method, self.inputs.fraction)
+            for hemi in ("lh", "rh")
+        ]
+        return runtime
+
+
+def make_midthickness(surf_dir, hemi, method="average", fraction=0.5):
+    """
+    Write ``<surf_dir>/<hemi>.midthickness``, unless it is up to date.
+
+    See :py:class:`Midthickness`.
+
+    """
+    import shutil
+
+    if method == "average":
+        sources = [os.path.join(surf_dir, f"{hemi}.{name}") for name in ("white", "pial")]
+    else:
+        sources = [os.path.join(surf_dir, f"{hemi}.{name}") for name in ("smoothwm", "thickness")]
+    out_file = os.path.join(surf_dir, f"{hemi}.midthickness")
+    graymid = os.path.join(surf_dir, f"{hemi}.graymid")
+
+    stamp = _midthickness_stamp(method, fraction)
+    sources_mtime = max(os.stat(src).st_mtime for src in sources)
+    for existing in (out_file, graymid):
+        if (
+            os.path.isfile(existing)
+            and os.stat(existing).st_mtime >= sources_mtime
+            and _reusable_midthickness(_read_create_stamp(existing), stamp)
+        ):
+            if existing != out_file:
+                shutil.copy2(existing, out_file)
+            return out_file
+
+    coords, faces, volume_info = nb.freesurfer.read_geometry(sources[0], read_metadata=True)
+    if method == "average":
+        mid = coords + fraction * (nb.freesurfer.read_geometry(sources[1])[0] - coords)
+    else:
+        thickness = nb.freesurfer.read_morph_data(sources[1])
+        mid = coords + (fraction * thickness)[:, np.newaxis] * vertex_normals(coords, faces)
+
+    # Write next to the target and rename, so that readers never see a partial file
+    tmp_file = f"{out_file}.tmp{os.getpid()}"
+    nb.freesurfer.write_geometry(
+        tmp_file, mid, faces, create_stamp=stamp, volume_info=volume_info
+    )
+    os.replace(tmp_file, out_file)
+    return out_file
+
+
+def _midthickness_stamp(method, fraction):
+    return f"created by smriprep ({method}, {fraction:g})"
+
+
+def _read_create_stamp(fname):
+    """Read the creation stamp of a FreeSurfer surface, without reading the mesh."""
+    with open(fname, "rb") as f:
+        # A 3-byte magic number, and the stamp terminated by a newline
+        return f.read(1027)[3:].split(b"\n", 1)[0].decode("latin-1")
+
+
+def _reusable_midthickness(found, expected):
+    """
+    Decide whether a surface with stamp ``found`` can stand for ``expected``.
+
+    >>> ours, theirs = "created by smriprep (average, 0.5)", "created by jdoe on Mon Jan 4"
+    >>> _reusable_midthickness(ours, _midthickness_stamp("average", 0.5))
+    True
+    >>> _reusable_midthickness(ours, _midthickness_stamp("thickness", 0.5))
+    False
+    >>> _reusable_midthickness(theirs, _midthickness_stamp("average", 0.5))
+    True
+    >>> _reusable_midthickness(theirs, _midthickness_stamp("thickness", 0.5))
+    False
+
+    """
+    if found.startswith("created by smriprep ("):
+        return found == expected
+    # Generated elsewhere (mris_expand, earlier versions, or the user)
+    return expected == _midthickness_stamp("average", 0.5)
+
+
+def vertex_normals(coords, faces):
+    """
+    Calculate the unit normals of a mesh, averaging face normals weighted by area.
+
+    >>> coords = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+    >>> faces = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    >>> np.round(vertex_normals(coords, faces), 3)[:2].tolist()
+    [[-0.577, -0.577, -0.577], [1.0, 0.0, 0.0]]
+
+    """
+    v0, v1, v2 = (coords[faces[:, i]] for i in range(3))
+    face_normals = np.cross(v1 - v0, v2 - v0)
+    # Each face contributes its normal to its three vertices
+    normals = np.column_stack([
+        np.bincount(faces.ravel(), weights=np.repeat(face_normals[:, k], 3), minlength=len(coords))
+        for k in range(3)
+    ])
+    norms = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(norms > 0, norms, 1.0)
+
+
+class _ResampleSurfaceMapsInputSpec(BaseInterfaceInputSpec):
+    subjects_dir = Directory(exists=True, mandatory=True, desc="FreeSurfer SUBJECTS_DIR")
+    subject_id = traits.Str(mandatory=True, desc="FreeSurfer subject ID")
+    targets = traits.List(
+        traits.Str,
+        mandatory=True,
+        desc="target spaces with density (e.g., ``fsaverage:den-10k``, ``fsLR:den-32k``)",
+    )
+    maps = traits.List(
+        traits.Str,
+        value=["thickness", "curv", "sulc"],
+        usedefault=True,
+        desc="per-vertex maps in the subject's ``surf/`` (e.g., ``thickness``)",
+    )
+
+
+class _ResampleSurfaceMapsOutputSpec(TraitedSpec):
+    out_files = OutputMultiObject(
+        File(exists=True),
+        desc="resampled maps (e.g., ``lh.thickness_space-fsaverage_den-10k.shape.gii``)",
+    )
+
+
+class ResampleSurfaceMaps(SimpleInterface):
+    """
+    Resample per-vertex maps of a FreeSurfer subject onto standard surfaces.
+
+    The target vertices are located on the subject's ``?h.sphere.reg``, and the
+    barycentric weights of the three vertices of the enclosing triangle are stored
+    in a sparse matrix, so that resampling a map is a single sparse matrix-vector
+    product.
+    One matrix is calculated per hemisphere and target, and cached in the subject's
+    ``surf/`` (e.g., ``lh.resample_fsaverage_den-10k.npz``) until either sphere
+    is modified.
+
+    Targets are the ``?h.sphere.reg`` of the ``fsaverage`` subjects in the
+    SUBJECTS_DIR, and TemplateFlow's ``fsLR`` spheres aligned to ``fsaverage``.
+
+    """
+
+    input_spec = _ResampleSurfaceMapsInputSpec
+    output_spec = _ResampleSurfaceMapsOutputSpec
+
+    def _run_interface(self, runtime):
+        surf_dir = os.path.join(self.inputs.subjects_dir, self.inputs.subject_id, "surf")
+        self._results["out_files"] = []
+        for hemi in ("lh", "rh"):
+            source_sphere = os.path.join(surf_dir, f"{hemi}.sphere.reg")
+            data = {
+                name: nb.freesurfer.read_morph_data(os.path.join(surf_dir, f"{hemi}.{name}"))
+                for name in self.inputs.maps
+            }
+            for target in self.inputs.targets:
+                space, density = _parse_target(target)
+                cache_file = f"{hemi}.resample_{space}_den-{density}.npz"
+                weights = resampling_matrix(
+                    source_sphere,
+                    _target_sphere(space, density, hemi, self.inputs.subjects_dir),
+                    cache_file=os.path.join(surf_dir, cache_file),
+                )
+                for name, values in data.items():
+                    out_file = os.path.join(
+                        runtime.cwd, f"{hemi}.{name}_space-{space}_den-{density}.shape.gii"
+                    )
+                    _write_shape(weights @ values, hemi, out_file)
+                    self._results["out_files"].append(out_file)
+        return runtime
+
+
+def resampling_matrix(source_sphere, target_sphere, cache_file=None):
+    """
+    Calculate (or load from cache) the matrix resampling maps between two spheres.
+
+    Parameters
+    ----------
+    source_sphere : :obj:`str`
+        Registered sphere of the source mesh (FreeSurfer or GIFTI format)
+    target_sphere : :obj:`str`
+        Sphere of the target mesh, in the space of ``source_sphere``
+    cache_file : :obj:`str`, optional
+        ``.npz`` file where the matrix is stored; it is reused if it is newer than
+        both spheres, and its shape matches them.
+
+    Returns
+    -------
+    weights : :obj:`scipy.sparse.csr_matrix`
+        Matrix of shape (target vertices, source vertices), with the barycentric
+        weights of three source vertices per row.
+
+    """
+    from scipy import sparse
+
+    if cache_file and os.path.isfile(cache_file):
+        mtime = max(os.stat(source_sphere).st_mtime, os.stat(target_sphere).st_mtime)
+        if os.stat(cache_file).st_mtime >= mtime:
+            weights = sparse.load_npz(cache_file).tocsr()
+            shape = (len(_load_surface(target_sphere)[0]), len(_load_surface(source_sphere)[0]))
+            if weights.shape == shape:
+                return weights
+
+    src_coords, src_faces = _load_surface(source_sphere)
+    weights = barycentric_weights(src_coords, src_faces, _load_surface(target_sphere)[0])
+    if cache_file:
+        tmp_file = f"{cache_file[:-4]}.tmp{os.getpid()}.npz"
+        sparse.save_npz(tmp_file, weights)
+        os.replace(tmp_file, cache_file)
+    return weights
+
+
+def barycentric_weights(coords, faces, targets, candidates=8, max_candidates=256):
+    """
+    Interpolate target points on a spherical mesh with barycentric weights.
+
+    Points are projected from the center of the sphere onto the planes of the
+    ``candidates`` triangles with nearest centroids, and assigned to the first
+    triangle containing them.
+    The search is widened (up to ``max_candidates`` triangles) for the points no
+    candidate contains; any point still not contained (only possible on degenerate
+    meshes) is assigned to the triangle it is closest to being contained by.
+
+    >>> coords = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0]], dtype=float)
+    >>> faces = np.array([[0, 1, 2], [1, 3, 2]])
+    >>> weights = barycentric_weights(coords, faces, np.array([[1, 1, 1], [0, 0, 1.0]]))
+    >>> np.round(weights.toarray(), 3).tolist()
+    [[0.333, 0.333, 0.333, 0.0], [0.0, 0.0, 1.0, 0.0]]
+
+    """
+    from scipy import sparse
+    from scipy.spatial import cKDTree
+
+    coords = coords / np.linalg.norm(coords, axis=1, keepdims=True)
+    targets = targets / np.linalg.norm(targets, axis=1, keepdims=True)
+    tree = cKDTree(coords[faces].mean(axis=1))
+
+    chosen = np.zeros(len(targets), dtype=int)
+    weights = np.full((len(targets), 3), -np.inf)
+    pending = np.ones(len(targets), dtype=bool)
+    checked, k = 0, min(candidates, len(faces))
+    while True:
+        idx = np.flatnonzero(pending)
+        nearest = tree.query(targets[idx], k=k)[1].reshape(len(idx), k)
+        for j in range(checked, k):
+            cand_weights = _ray_triangle_weights(targets[idx], coords[faces[nearest[:, j]]])
+            better = cand_weights.min(axis=1) > weights[idx].min(axis=1)
+            chosen[idx[better]] = nearest[better, j]
+            weights[idx[better]] = cand_weights[better]
+        pending[idx[weights[idx].min(axis=1) >= -1e-8]] = False
+
+        if not pending.any() or k >= min(max_candidates, len(faces)):
+            break
+        checked, k = k, min(4 * k, max_candidates, len(faces))
+
+    weights = np.clip(weights, 0, None)
+    weights /= weights.sum(axis=1, keepdims=True)
+    rows = np.repeat(np.arange(len(targets)), 3)
+    return sparse.csr_matrix(
+        (weights.ravel(), (rows, faces[chosen].ravel())), shape=(len(targets), len(coords))
+    )
+
+
+def _ray_triangle_weights(rays, triangles):
+    """Barycentric coordinates where rays from the origin hit the triangles' planes."""
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    e1, e2 = b - a, c - a
+    pvec = np.cross(rays, e2)
+    det = np.einsum("ij,ij->i", e1, pvec)
+    det = np.where(np.abs(det) > 1e-12, det, 1e-12)
+    tvec = -a
+    u = np.einsum("ij,ij->i", tvec, pvec) / det
+    v = np.einsum("ij,ij->i", rays, np.cross(tvec, e1)) / det
+    return np.column_stack((1.0 - u - v, u, v))
+
+
+def _parse_target(target):
+    """
+    Split a target into space and density.
+
+    >>> _parse_target("fsaverage:den-10k")
+    ('fsaverage', '10k')
+
+    """
+    space, _, spec = target.partition(":")
+    density = dict(s.split("-", 1) for s in spec.split(":") if s).get("den")
+    if density is None:
+        raise ValueError(f"Surface target <{target}> has no density.")
+    return space, density
+
+
+def _target_sphere(space, density, hemi, subjects_dir):
+    """Locate the sphere of a target space."""
+    if space == "fsaverage":
+        from niworkflows.utils.spaces import FSAVERAGE_DENSITY
+
+        subject = {den: name for name, den in FSAVERAGE_DENSITY.items()}[density]
+        return os.path.join(subjects_dir, subject, "surf", f"{hemi}.sphere.reg")
+
+    from templateflow import api as tf
+
+    return str(
+        tf.get(
+            space,
+            space="fsaverage",
+            hemi=hemi[0].upper(),
+            density=density,
+            suffix="sphere",
+            extension=".surf.gii",
+        )
+    )
+
+
+def _load_surface(fname):
+    """Read the vertices and faces of a FreeSurfer or GIFTI surface."""
+    if str(fname).endswith(".gii"):
+        img = nb.load(fname)
+        return (
+            img.get_arrays_from_intent("NIFTI_INTENT_POINTSET")[0].data,
+            img.get_arrays_from_intent("NIFTI_INTENT_TRIANGLE")[0].data,
+        )
+    return nb.freesurfer.read_geometry(fname)
+
+
+def _write_shape(values, hemi, out_file):
+    nb.gifti.GiftiImage(
+        darrays=[
+            nb.gifti.GiftiDataArray(
+                values.astype("float32"),
+                intent="NIFTI_INTENT_SHAPE",
+                datatype="NIFTI_TYPE_FLOAT32",
+            )
+        ],
+        meta=nb.gifti.GiftiMetaData(
+            {"AnatomicalStructurePrimary": {"lh": "CortexLeft", "rh": "CortexRight"}[hemi]}
+        ),
+    ).to_filename(out_file)
+
+
 def normalize_surfs(in_file, transform_file, newpath=None):
     """
     Update GIFTI metadata and apply rigid coordinate correction.
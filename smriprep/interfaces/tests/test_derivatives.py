@@ -0,0 +1,57 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+from pathlib import Path
+
+import numpy as np
+import nibabel as nb
+from niworkflows.interfaces import bids as nwbids
+
+from .. import DerivativesDataSink
+
+
+def test_shape_derivatives(tmp_path):
+    patterns = nwbids.BIDS_DERIV_PATTERNS
+    in_file = tmp_path / "rh.thickness_space-fsaverage_den-10k.shape.gii"
+    nb.GiftiImage(
+        darrays=[nb.gifti.GiftiDataArray(np.zeros(10, dtype="float32"))]
+    ).to_filename(str(in_file))
+
+    result = DerivativesDataSink(
+        base_directory=str(tmp_path / "out"),
+        source_file=str(tmp_path / "sub-01" / "anat" / "sub-01_T1w.nii.gz"),
+        in_file=str(in_file),
+        extension=".shape.gii",
+        hemi="R",
+        space="fsaverage",
+        density="10k",
+        suffix="thickness",
+    ).run(cwd=str(tmp_path))
+
+    out_file = Path(result.outputs.out_file)
+    assert out_file.relative_to(tmp_path / "out") == Path(
+        "smriprep/sub-01/anat/sub-01_hemi-R_space-fsaverage_den-10k_thickness.shape.gii"
+    )
+    assert out_file.exists()
+    # Other users of NiWorkflows' sinks do not see our patterns
+    assert nwbids.BIDS_DERIV_PATTERNS is patterns
+    assert not any(".shape.gii" in p for p in patterns)
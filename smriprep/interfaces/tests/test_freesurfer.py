@@ -0,0 +1,125 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+from pathlib import Path
+
+import numpy as np
+import nibabel as nb
+import pytest
+from nitransforms.io.lta import FSLinearTransformArray
+from scipy import ndimage as ndi
+
+from ..freesurfer import HeaderRegister
+from ..resampling import ResampleLabels
+from ..surf import load_transform
+
+
+def _conformed(tmp_path, shift=(0.0, 0.0, 0.0)):
+    """Write a FreeSurfer-conformed (LIA) T1.mgz, and the same image in RAS+ as T1w."""
+    rng = np.random.default_rng(1234)
+    data = ndi.gaussian_filter(rng.normal(size=(40, 40, 40)), 2.0)
+    data = (data - data.min()) / np.ptp(data) * 100
+    lia = np.array([[-1, 0, 0, 20], [0, 0, 1, -20], [0, -1, 0, 20], [0, 0, 0, 1]], float)
+    t1_mgz = tmp_path / "T1.mgz"
+    nb.MGHImage(data.astype("float32"), lia).to_filename(str(t1_mgz))
+
+    t1w = nb.as_closest_canonical(nb.Nifti1Image(data.astype("float32"), lia))
+    affine = t1w.affine.copy()
+    affine[:3, 3] += shift
+    t1w_file = tmp_path / "sub-01_T1w.nii.gz"
+    nb.Nifti1Image(np.asanyarray(t1w.dataobj), affine).to_filename(str(t1w_file))
+    return t1_mgz, t1w_file
+
+
+class _FakeRobustRegister:
+    calls = []
+
+    def __init__(self, **inputs):
+        self.inputs = inputs
+
+    def run(self, cwd=None):
+        self.calls.append(self.inputs)
+        Path(self.inputs["out_reg_file"]).write_text("")
+        return type("Result", (), {"outputs": type("Outputs", (), self.inputs)})
+
+
+@pytest.fixture
+def robust_register(monkeypatch):
+    _FakeRobustRegister.calls = []
+    monkeypatch.setattr(
+        "niworkflows.interfaces.freesurfer.PatchedRobustRegister", _FakeRobustRegister
+    )
+    return _FakeRobustRegister
+
+
+def test_header_register(tmp_path, robust_register):
+    t1_mgz, t1w = _conformed(tmp_path)
+
+    result = HeaderRegister(source_file=str(t1_mgz), target_file=str(t1w)).run(
+        cwd=str(tmp_path)
+    )
+    assert result.outputs.method == "header"
+    assert not robust_register.calls
+
+    lta = FSLinearTransformArray.from_filename(result.outputs.out_reg_file)
+    assert lta["type"] == 1  # LINEAR_RAS_TO_RAS
+    xform = lta["xforms"][0]
+    assert xform["src"]["filename"] == str(t1_mgz)
+    assert xform["dst"]["filename"] == str(t1w)
+    assert np.allclose(lta.to_ras(), np.eye(4))
+    assert np.allclose(load_transform(result.outputs.out_reg_file), np.eye(4))
+
+    # Labels are mapped onto the T1w grid through the headers only
+    labels = np.asanyarray(nb.load(str(t1_mgz)).dataobj).astype("int16") // 10
+    (tmp_path / "mri").mkdir()
+    aseg = tmp_path / "mri" / "aseg.mgz"
+    nb.MGHImage(labels, nb.load(str(t1_mgz)).affine).to_filename(str(aseg))
+    (tmp_path / "sub-01").mkdir()
+    out = ResampleLabels(
+        in_files=[str(aseg), str(aseg)],
+        reference_image=str(t1w),
+        lta_file=result.outputs.out_reg_file,
+    ).run(cwd=str(tmp_path / "sub-01"))
+    expected = nb.as_closest_canonical(nb.MGHImage(labels, nb.load(str(aseg)).affine))
+    assert np.array_equal(
+        np.asanyarray(nb.load(out.outputs.out_files[0]).dataobj),
+        np.asanyarray(expected.dataobj),
+    )
+
+
+def test_header_register_fallback(tmp_path, robust_register):
+    # The T1w header is off by a few millimeters
+    t1_mgz, t1w = _conformed(tmp_path, shift=(4.0, -3.0, 2.0))
+    result = HeaderRegister(source_file=str(t1_mgz), target_file=str(t1w)).run(
+        cwd=str(tmp_path)
+    )
+    assert result.outputs.method == "robust"
+    assert len(robust_register.calls) == 1
+    assert robust_register.calls[0]["source_file"] == str(t1_mgz)
+
+    # Cropped by recon-all: headers are not trusted, even if aligned
+    t1_mgz, t1w = _conformed(tmp_path)
+    result = HeaderRegister(
+        source_file=str(t1_mgz), target_file=str(t1w), flags=["-cw256"]
+    ).run(cwd=str(tmp_path))
+    assert result.outputs.method == "robust"
+    assert len(robust_register.calls) == 2
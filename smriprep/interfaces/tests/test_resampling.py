@@ -0,0 +1,179 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+import h5py
+import numpy as np
+import nibabel as nb
+import nitransforms as nt
+from nitransforms.io.lta import FSLinearTransformArray
+
+from ..resampling import (
+    MultiApplyTransforms,
+    ResampleLabels,
+    concat_composites,
+    load_transforms,
+    map_points,
+)
+
+# A rotation about each axis, and a translation (RAS+)
+ANGLES, SHIFT = (0.1, -0.07, 0.05), (2.3, -1.6, 0.7)
+
+
+def _rigid():
+    (cx, cy, cz), (sx, sy, sz) = np.cos(ANGLES), np.sin(ANGLES)
+    rot_x = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    rot_y = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rot_z = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return nb.affines.from_matvec(rot_z @ rot_y @ rot_x, SHIFT)
+
+
+def _image(fname, data, zooms, origin):
+    affine = nb.affines.from_matvec(np.diag(zooms), origin)
+    nb.Nifti1Image(data, affine).to_filename(str(fname))
+    return fname
+
+
+def _composite(fname, affines):
+    """Write ITK composite (``.h5``) transforms, given as RAS+ affines."""
+    lps = np.diag([-1.0, -1.0, 1.0, 1.0])
+    with h5py.File(fname, "w") as h5:
+        group = h5.create_group("TransformGroup")
+        group.create_dataset("0/TransformType", data=[b"CompositeTransform_double_3_3"])
+        for i, affine in enumerate(affines, start=1):
+            affine = lps @ affine @ lps
+            group.create_dataset(f"{i}/TransformType", data=[b"AffineTransform_double_3_3"])
+            group.create_dataset(
+                f"{i}/TransformParameters",
+                data=np.hstack((affine[:3, :3].ravel(), affine[:3, 3])),
+            )
+            group.create_dataset(f"{i}/TransformFixedParameters", data=np.zeros(3))
+    return fname
+
+
+def test_load_transforms(tmp_path):
+    rigid = _rigid()
+    nt.linear.Affine(rigid).to_filename(str(tmp_path / "rigid.mat"), fmt="itk")
+
+    # ITK fields are in LPS: displacements (1, 2, 3) are (-1, -2, 3) in RAS
+    field = np.zeros((4, 4, 4, 1, 3), dtype="float32")
+    field[...] = (1.0, 2.0, 3.0)
+    hdr = nb.Nifti1Header()
+    hdr.set_intent("vector")
+    nb.Nifti1Image(field, np.eye(4), hdr).to_filename(str(tmp_path / "field.nii.gz"))
+
+    chain = load_transforms([tmp_path / "rigid.mat", tmp_path / "field.nii.gz"])
+    assert [kind for kind, _ in chain] == ["field", "affine"]
+    assert np.allclose(chain[1][1], rigid)
+    points = np.array([[1.0, 0.5], [2.0, 1.5], [1.0, 2.5]])
+    assert np.allclose(
+        map_points(chain, points),
+        rigid[:3, :3] @ (points + [[-1.0], [-2.0], [3.0]]) + rigid[:3, 3:],
+        atol=1e-5,
+    )
+
+
+def test_concat_composites(tmp_path):
+    scale = np.diag([2.0, 2.0, 2.0, 1.0])
+    shift = nb.affines.from_matvec(np.eye(3), (1.0, 0.0, 0.0))
+    first = _composite(tmp_path / "first.h5", [scale])
+    second = _composite(tmp_path / "second.h5", [shift, _rigid()])
+
+    out_file = concat_composites([first, second], tmp_path / "concat.h5")
+    chain = load_transforms([out_file])
+    assert [kind for kind, _ in chain] == ["affine"] * 3
+    # The last transform is applied first, as in antsApplyTransforms
+    for (_, found), expected in zip(chain, (_rigid(), shift, scale)):
+        assert np.allclose(found, expected)
+    assert np.allclose(
+        map_points(chain, np.zeros((3, 1))).ravel(),
+        scale[:3, :3] @ (_rigid()[:3, 3] + shift[:3, 3]),
+    )
+
+
+def test_multi_apply_transforms(tmp_path):
+    rng = np.random.default_rng(1234)
+    smooth = np.cumsum(np.cumsum(rng.normal(size=(20, 22, 18)), axis=0), axis=1)
+    moving = _image(tmp_path / "moving.nii.gz", smooth.astype("float32"), (1.5,) * 3, (-15,) * 3)
+    labels = _image(
+        tmp_path / "labels.nii.gz",
+        np.digitize(smooth, np.percentile(smooth, (25, 50, 75))).astype("int16"),
+        (1.5,) * 3,
+        (-15,) * 3,
+    )
+    reference = _image(
+        tmp_path / "reference.nii.gz",
+        np.zeros((16, 18, 14), dtype="uint8"),
+        (1.7,) * 3,
+        (-13,) * 3,
+    )
+    xfm = nt.linear.Affine(_rigid(), reference=str(reference))
+    xfm.to_filename(str(tmp_path / "rigid.mat"), fmt="itk")
+
+    result = MultiApplyTransforms(
+        input_images=[str(moving), str(labels)],
+        interpolation=["Linear", "NearestNeighbor"],
+        reference_image=str(reference),
+        transforms=[str(tmp_path / "rigid.mat")],
+        num_threads=2,
+    ).run(cwd=str(tmp_path))
+
+    linear, nearest = [nb.load(f) for f in result.outputs.output_images]
+    assert np.allclose(linear.affine, nb.load(str(reference)).affine)
+    assert nearest.get_data_dtype() == np.dtype("int16")
+    expected = np.asanyarray(nt.resampling.apply(xfm, str(moving), order=1).dataobj)
+    assert np.allclose(linear.get_fdata(), expected, atol=1e-3 * np.abs(expected).max())
+    expected = np.asanyarray(nt.resampling.apply(xfm, str(labels), order=0).dataobj)
+    assert np.mean(np.asanyarray(nearest.dataobj) == expected) > 0.99
+
+
+def test_resample_labels(tmp_path):
+    rng = np.random.default_rng(1234)
+    # Outputs are named after the inputs. Inputs cover the reference, because
+    # NiTransforms (unlike FreeSurfer) drops samples off the edge by less than half a voxel
+    (tmp_path / "mri").mkdir()
+    asegs = [
+        _image(
+            tmp_path / "mri" / f"{name}.nii.gz",
+            rng.integers(0, 60, size=(30, 32, 28)).astype("int32"),
+            (1.0,) * 3,
+            (-15,) * 3,
+        )
+        for name in ("aseg", "wmparc")
+    ]
+    reference = _image(
+        tmp_path / "t1w.nii.gz", np.zeros((14, 16, 12), dtype="uint8"), (1.3,) * 3, (-9,) * 3
+    )
+    lta_file = str(tmp_path / "fs2t1w.lta")
+    FSLinearTransformArray.from_ras(
+        _rigid(), moving=nb.load(str(asegs[0])), reference=nb.load(str(reference))
+    ).to_filename(lta_file)
+
+    result = ResampleLabels(
+        in_files=[str(f) for f in asegs], reference_image=str(reference), lta_file=lta_file
+    ).run(cwd=str(tmp_path))
+
+    xfm = nt.linear.load(lta_file, fmt="fs", reference=str(reference))
+    for in_file, out_file in zip(asegs, result.outputs.out_files):
+        out = nb.load(out_file)
+        assert out.get_data_dtype() == np.dtype("int32")
+        expected = np.asanyarray(nt.resampling.apply(xfm, str(in_file), order=0).dataobj)
+        assert np.array_equal(np.asanyarray(out.dataobj), expected)
@@ -0,0 +1,248 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+import os
+
+import numpy as np
+import nibabel as nb
+
+from .. import surf
+from ..surf import FS2Gifti, ResampleSurfaceMaps, make_midthickness
+
+
+def test_make_midthickness_reuse(tmp_path):
+    coords = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+    faces = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    for name, offset in (("white", 0.0), ("smoothwm", 0.0), ("pial", 2.0)):
+        nb.freesurfer.write_geometry(str(tmp_path / f"lh.{name}"), coords + offset, faces)
+    nb.freesurfer.write_morph_data(str(tmp_path / "lh.thickness"), np.full(4, 2.0))
+
+    out_file = make_midthickness(str(tmp_path), "lh", "average")
+    assert np.allclose(nb.freesurfer.read_geometry(out_file)[0], coords + 1.0)
+    mtime = os.stat(out_file).st_mtime_ns
+    assert make_midthickness(str(tmp_path), "lh", "average") == out_file
+    assert os.stat(out_file).st_mtime_ns == mtime
+
+    # An up-to-date surface made with another method or fraction is regenerated
+    make_midthickness(str(tmp_path), "lh", "thickness", 0.25)
+    mid = nb.freesurfer.read_geometry(out_file)[0]
+    assert np.allclose(np.linalg.norm(mid - coords, axis=1), 0.5)
+
+    # Surfaces of other tools are taken for the default (averaging white and pial)
+    nb.freesurfer.write_geometry(out_file, coords, faces)
+    make_midthickness(str(tmp_path), "lh")
+    assert np.allclose(nb.freesurfer.read_geometry(out_file)[0], coords)
+    make_midthickness(str(tmp_path), "lh", "thickness")
+    mid = nb.freesurfer.read_geometry(out_file)[0]
+    assert np.allclose(np.linalg.norm(mid - coords, axis=1), 1.0)
+
+
+def test_fs2gifti(tmp_path):
+    from nitransforms.io.lta import FSLinearTransformArray
+
+    coords = np.array([[0, 0, 0], [10, 0, 0], [0, 10, 0], [0, 0, 10]], dtype=float)
+    faces = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+
+    # An oblique, anisotropic and off-center conformed volume
+    header = nb.freesurfer.mghformat.MGHHeader()
+    header.set_data_shape((128, 120, 100))
+    header.set_zooms((1.0, 1.2, 0.9))
+    c, s = np.cos(0.2), np.sin(0.2)
+    header["Mdc"] = np.array([[-c, 0, s], [0, 0, -1], [-s, -c, 0]]).T  # rows: x, y, z ras
+    header["Pxyz_c"] = [3.5, -12.0, 20.0]
+    volume_info = {
+        "head": [2, 0, 20],
+        "valid": "1  # volume info valid",
+        "filename": "T1.mgz",
+        "volume": np.array(header.get_data_shape()),
+        "voxelsize": np.array(header.get_zooms()),
+        "xras": header["Mdc"][0],
+        "yras": header["Mdc"][1],
+        "zras": header["Mdc"][2],
+        "cras": header["Pxyz_c"],
+    }
+    nb.freesurfer.write_geometry(
+        str(tmp_path / "lh.pial"), coords, faces, volume_info=volume_info
+    )
+    nb.freesurfer.write_geometry(
+        str(tmp_path / "rh.midthickness"), coords, faces, volume_info=volume_info
+    )
+
+    transform = np.array(
+        [[0.99, -0.1, 0, 2.0], [0.1, 0.99, 0, -1.5], [0, 0, 1, 0.5], [0, 0, 0, 1]]
+    )
+    ref = nb.Nifti1Image(np.zeros((10, 10, 10), dtype="uint8"), np.eye(4))
+    lta_file = str(tmp_path / "fsnative2t1w.lta")
+    # LTAs store the inverse (the RAS-to-RAS mapping of target onto source)
+    FSLinearTransformArray.from_ras(
+        np.linalg.inv(transform), moving=ref, reference=ref
+    ).to_filename(lta_file)
+
+    (tmp_path / "work").mkdir()
+    result = FS2Gifti(
+        in_files=[str(tmp_path / "lh.pial"), str(tmp_path / "rh.midthickness")],
+        transform_file=lta_file,
+        num_threads=2,
+    ).run(cwd=str(tmp_path / "work"))
+    assert [os.path.basename(f) for f in result.outputs.out_files] == [
+        "lh.pial_converted.gii",
+        "rh.midthickness_converted.gii",
+    ]
+
+    expected = nb.affines.apply_affine(
+        transform @ header.get_affine() @ np.linalg.inv(header.get_vox2ras_tkr()), coords
+    )
+    pial, midthickness = (nb.load(f) for f in result.outputs.out_files)
+    for img in (pial, midthickness):
+        assert np.allclose(img.darrays[0].data, expected, atol=1e-4)
+        assert np.array_equal(img.darrays[1].data, faces)
+        assert not any(key.startswith("VolGeom") for key in img.darrays[0].meta)
+        assert img.darrays[1].meta["TopologicalType"] == "Closed"
+
+    assert dict(pial.darrays[0].meta) == {
+        "AnatomicalStructurePrimary": "CortexLeft",
+        "AnatomicalStructureSecondary": "Pial",
+        "GeometricType": "Anatomical",
+    }
+    assert dict(midthickness.darrays[0].meta) == {
+        "AnatomicalStructurePrimary": "CortexRight",
+        "AnatomicalStructureSecondary": "MidThickness",
+        "GeometricType": "Anatomical",
+    }
+
+
+def _icosphere(order, radius=100.0):
+    """Subdivide an icosahedron ``order`` times (as FreeSurfer's ``ic<order>``)."""
+    t = (1 + 5**0.5) / 2
+    coords = [
+        (-1, t, 0), (1, t, 0), (-1, -t, 0), (1, -t, 0), (0, -1, t), (0, 1, t),
+        (0, -1, -t), (0, 1, -t), (t, 0, -1), (t, 0, 1), (-t, 0, -1), (-t, 0, 1),
+    ]
+    faces = [
+        (0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11), (1, 5, 9), (5, 11, 4),
+        (11, 10, 2), (10, 7, 6), (7, 1, 8), (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8),
+        (3, 8, 9), (4, 9, 5), (2, 4, 11), (6, 2, 10), (8, 6, 7), (9, 8, 1),
+    ]
+    for _ in range(order):
+        midpoints = {}
+
+        def midpoint(i, j):
+            key = (min(i, j), max(i, j))
+            if key not in midpoints:
+                midpoints[key] = len(coords)
+                coords.append(tuple((np.array(coords[i]) + coords[j]) / 2))
+            return midpoints[key]
+
+        new_faces = []
+        for a, b, c in faces:
+            ab, bc, ca = midpoint(a, b), midpoint(b, c), midpoint(c, a)
+            new_faces += [(a, ab, ca), (b, bc, ab), (c, ca, bc), (ab, bc, ca)]
+        faces = new_faces
+    coords = np.array(coords)
+    return radius * coords / np.linalg.norm(coords, axis=1, keepdims=True), np.array(faces)
+
+
+def test_resample_surface_maps(tmp_path, monkeypatch):
+    from niworkflows.interfaces.surf import Path2BIDS
+
+    gradient = np.array([0.3, -0.5, 0.8])
+    c, s = np.cos(0.1), np.sin(0.1)
+    rotation = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    (tmp_path / "sub-01" / "surf").mkdir(parents=True)
+    (tmp_path / "fsaverage4" / "surf").mkdir(parents=True)
+    for hemi in ("lh", "rh"):
+        coords, faces = _icosphere(5)
+        nb.freesurfer.write_geometry(
+            str(tmp_path / "sub-01" / "surf" / f"{hemi}.sphere.reg"), coords, faces
+        )
+        # A linear field of the (unit-sphere) coordinates
+        nb.freesurfer.write_morph_data(
+            str(tmp_path / "sub-01" / "surf" / f"{hemi}.thickness"), coords @ gradient / 100
+        )
+        # Target vertices do not coincide with source vertices
+        coords, faces = _icosphere(4)
+        nb.freesurfer.write_geometry(
+            str(tmp_path / "fsaverage4" / "surf" / f"{hemi}.sphere.reg"),
+            coords @ rotation.T,
+            faces,
+        )
+
+    calls = []
+
+    def barycentric_weights(*args, **kwargs):
+        calls.append(args)
+        return _barycentric_weights(*args, **kwargs)
+
+    _barycentric_weights = surf.barycentric_weights
+    monkeypatch.setattr(surf, "barycentric_weights", barycentric_weights)
+
+    def run():
+        return ResampleSurfaceMaps(
+            subjects_dir=str(tmp_path),
+            subject_id="sub-01",
+            targets=["fsaverage:den-2562"],
+            maps=["thickness"],
+        ).run(cwd=str(tmp_path)).outputs.out_files
+
+    out_files = run()
+    assert len(calls) == 2
+    assert [os.path.basename(f) for f in out_files] == [
+        "lh.thickness_space-fsaverage_den-2562.shape.gii",
+        "rh.thickness_space-fsaverage_den-2562.shape.gii",
+    ]
+    target = nb.freesurfer.read_geometry(str(tmp_path / "fsaverage4" / "surf" / "lh.sphere.reg"))
+    resampled = nb.load(out_files[0]).darrays[0].data
+    assert np.abs(resampled - target[0] @ gradient / 100).max() < 2e-3
+
+    # Output names are understood by the derivatives workflow
+    for out_file, hemi in zip(out_files, "lr"):
+        entities = Path2BIDS(
+            in_file=out_file,
+            pattern=r"(?P<hemi>[lr])h\.(?P<suffix>\w+)_space-(?P<space>[a-zA-Z0-9]+)"
+            r"_den-(?P<density>[a-zA-Z0-9]+)(?P<extprefix>\.\w+)?",
+        ).run().outputs
+        assert (entities.hemi, entities.suffix, entities.space, entities.density) == (
+            hemi.upper(), "thickness", "fsaverage", "2562"
+        )
+
+    # Cached matrices are reused...
+    cache_file = tmp_path / "sub-01" / "surf" / "lh.resample_fsaverage_den-2562.npz"
+    assert cache_file.is_file()
+    assert np.allclose(nb.load(run()[0]).darrays[0].data, resampled)
+    assert len(calls) == 2
+
+    # ... until the subject's sphere is modified
+    mtime = cache_file.stat().st_mtime
+    source_sphere = tmp_path / "sub-01" / "surf" / "lh.sphere.reg"
+    os.utime(source_sphere, (mtime + 10, mtime + 10))
+    run()
+    assert len(calls) == 3
+    os.utime(source_sphere, (mtime - 10, mtime - 10))
+
+    # ... or the target sphere has a different number of vertices (yet an older timestamp)
+    target_sphere = tmp_path / "fsaverage4" / "surf" / "rh.sphere.reg"
+    nb.freesurfer.write_geometry(str(target_sphere), *_icosphere(3))
+    cache_file = tmp_path / "sub-01" / "surf" / "rh.resample_fsaverage_den-2562.npz"
+    mtime = cache_file.stat().st_mtime
+    os.utime(target_sphere, (mtime - 10, mtime - 10))
+    assert len(nb.load(run()[1]).darrays[0].data) == 642
+    assert len(calls) == 4
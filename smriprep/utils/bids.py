@@ -21,12 +21,164 @@
 #     https://www.nipreps.org/community/licensing/
 #
 """Utilities to handle BIDS inputs."""
+import os
 from collections import defaultdict
 from pathlib import Path
-from json import loads
+from json import loads, dumps
 from pkg_resources import resource_filename as pkgrf
 from bids.layout.writing import build_path
 
+LAYOUT_FINGERPRINT = "smriprep_layout.json"
+
+
+def _participant_labels(participant_label):
+    """Normalize participant labels, dropping the ``sub-`` prefix."""
+    if not participant_label:
+        return None
+    if isinstance(participant_label, str):
+        participant_label = [participant_label]
+    return sorted(
+        {label[4:] if label.startswith("sub-") else label for label in participant_label}
+    )
+
+
+def bids_fingerprint(bids_dir, participant_label=None):
+    """
+    Summarize the structure of a BIDS dataset from directory modification times.
+
+    Only directories are visited (files are never listed), which makes the
+    fingerprint cheap to calculate even for very large datasets.
+    Adding, removing or renaming a file changes the modification time of the
+    directory containing it, and therefore the fingerprint.
+    Hidden folders and those that *PyBIDS* does not index by default
+    (``code/``, ``derivatives/``, ``sourcedata/``, etc.) are skipped.
+
+    Parameters
+    ----------
+    bids_dir : os.PathLike
+        Root of the BIDS dataset.
+    participant_label : :obj:`list` of :obj:`str` or None
+        If provided, only the folders of these participants are visited.
+
+    Returns
+    -------
+    fingerprint : :obj:`dict`
+        Mapping of relative directory paths to their modification time
+        (in nanoseconds).
+
+    """
+    bids_dir = Path(bids_dir)
+    skip = {"code", "derivatives", "models", "sourcedata", "stimuli"}
+    participant_label = _participant_labels(participant_label)
+    if participant_label is not None:
+        participant_label = {f"sub-{label}" for label in participant_label}
+
+    fingerprint = {}
+    pending = [bids_dir]
+    while pending:
+        path = pending.pop()
+        fingerprint[str(path.relative_to(bids_dir))] = path.stat().st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                if path == bids_dir and (
+                    entry.name in skip
+                    or (
+                        participant_label is not None
+                        and entry.name.startswith("sub-")
+                        and entry.name not in participant_label
+                    )
+                ):
+                    continue
+                pending.append(Path(entry.path))
+    return fingerprint
+
+
+def init_layout(bids_dir, database_dir=None, participant_label=None):
+    """
+    Index a BIDS dataset with *PyBIDS*, optionally caching the index on disk.
+
+    When ``database_dir`` is provided, the *PyBIDS* database is stored there
+    along with a :py:func:`fingerprint <bids_fingerprint>` of the dataset.
+    Subsequent calls reuse the stored index as long as the dataset's
+    directories have not been modified since, and re-index otherwise.
+
+    When ``participant_label`` is provided, only the folders of those participants
+    (plus the files at the top level of the dataset) are indexed.
+    Scoped indexes are stored in a subfolder of ``database_dir`` that is specific
+    to the set of participants, so that concurrent executions on different
+    participants do not share (or overwrite) a database.
+
+    Parameters
+    ----------
+    bids_dir : os.PathLike
+        Root of the BIDS dataset.
+    database_dir : os.PathLike or None
+        Folder where the *PyBIDS* database is (or will be) stored.
+    participant_label : :obj:`list` of :obj:`str` or None
+        Restrict indexing to these participants (the ``sub-`` prefix is optional).
+
+    Returns
+    -------
+    layout : :obj:`bids.layout.BIDSLayout`
+        The dataset's layout.
+    reused : :obj:`bool`
+        Whether a previously stored index was reused.
+
+    """
+    import re
+    from hashlib import sha1
+    from bids.layout import BIDSLayout, BIDSLayoutIndexer
+
+    bids_dir = Path(bids_dir)
+    participant_label = _participant_labels(participant_label)
+
+    ignore = [
+        re.compile(r"^/(code|models|sourcedata|stimuli)"),
+        re.compile(r"/\."),
+    ]
+    if participant_label is not None:
+        labels = "|".join(re.escape(label) for label in participant_label)
+        ignore.append(re.compile(r"^/sub-(?!(%s)(/|$))" % labels))
+    indexer = BIDSLayoutIndexer(validate=False, ignore=ignore)
+
+    if database_dir is None:
+        return BIDSLayout(str(bids_dir), validate=False, indexer=indexer), False
+
+    database_dir = Path(database_dir)
+    if participant_label is not None:
+        database_dir /= "participants-%s" % sha1(
+            " ".join(participant_label).encode()
+        ).hexdigest()[:12]
+    database_dir.mkdir(parents=True, exist_ok=True)
+    fingerprint_file = database_dir / LAYOUT_FINGERPRINT
+
+    fingerprint = {
+        "root": str(bids_dir),
+        "participant_label": participant_label,
+        "directories": bids_fingerprint(bids_dir, participant_label=participant_label),
+    }
+    reused = (
+        fingerprint_file.exists()
+        and (database_dir / "layout_index.sqlite").exists()
+        and loads(fingerprint_file.read_text()) == fingerprint
+    )
+    if not reused and fingerprint_file.exists():
+        # Invalidate before indexing, in case indexing is interrupted
+        fingerprint_file.unlink()
+
+    layout = BIDSLayout(
+        str(bids_dir),
+        validate=False,
+        database_path=str(database_dir),
+        reset_database=not reused,
+        indexer=indexer,
+    )
+    if not reused:
+        fingerprint_file.write_text(dumps(fingerprint))
+    return layout, reused
+
 
 def get_outputnode_spec():
     """
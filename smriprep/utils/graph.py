@@ -0,0 +1,145 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Utilities to store and retrieve workflow graphs."""
+import gzip
+import os
+import pickle
+import sys
+from pathlib import Path
+
+
+def _open(filename, mode, compress=None):
+    if compress is None:
+        compress = str(filename).endswith(".pklz")
+    if compress:
+        # Favor speed over size, graphs are mostly repetitive strings
+        return gzip.open(filename, mode, compresslevel=1)
+    return open(filename, mode)
+
+
+def save_workflow(workflow, filename):
+    """
+    Serialize a workflow graph (or any other picklable object) to disk.
+
+    The file is written atomically (first to a temporary file, then renamed),
+    so that readers never see a partially written graph.
+    Files with the ``.pklz`` extension are gzip-compressed.
+
+    Parameters
+    ----------
+    workflow : :obj:`nipype.pipeline.engine.Workflow`
+        The workflow to be stored.
+    filename : os.PathLike
+        Destination path.
+
+    Returns
+    -------
+    size : :obj:`int`
+        Size of the file written, in bytes.
+
+    """
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    tmpfile = filename.parent / f".{filename.name}.{os.getpid()}.tmp"
+    with _open(tmpfile, "wb", compress=filename.suffix == ".pklz") as fobj:
+        pickle.dump(workflow, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile, filename)
+    return filename.stat().st_size
+
+
+def load_workflow(filename):
+    """
+    Load a workflow graph stored with :py:func:`save_workflow`.
+
+    """
+    with _open(filename, "rb") as fobj:
+        return pickle.load(fobj)
+
+
+def _key_default(obj):
+    from niworkflows.utils.spaces import SpatialReferences
+
+    if isinstance(obj, SpatialReferences):
+        return {
+            "references": [repr(ref) for ref in obj.references],
+            "cached": (
+                [repr(ref) for ref in obj.cached.references]
+                if obj.is_cached()
+                else None
+            ),
+        }
+    if isinstance(obj, os.PathLike):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return repr(obj)
+
+
+def file_identity(path):
+    """
+    Summarize a file's identity as its path, size and modification time.
+
+    >>> file_identity(None) is None
+    True
+
+    """
+    if path is None:
+        return None
+    stat = Path(path).stat()
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+def graph_cache_key(**kwargs):
+    """
+    Calculate a hash that identifies a workflow graph from the arguments that shape it.
+
+    Besides the keyword arguments, the key accounts for the versions of
+    *sMRIPrep*, *NiWorkflows* and *Nipype*, as the graph is only valid for
+    the software that generated it, and for what the graph records about the
+    run: the command line and the versions of ANTs, FSL and FreeSurfer
+    (written into the boilerplate).
+
+    >>> key = graph_cache_key(debug=False, t1w=["sub-01_T1w.nii.gz"])
+    >>> key == graph_cache_key(t1w=["sub-01_T1w.nii.gz"], debug=False)
+    True
+    >>> key == graph_cache_key(debug=True, t1w=["sub-01_T1w.nii.gz"])
+    False
+    >>> argv, sys.argv = sys.argv, ["smriprep", "bids", "out", "participant"]
+    >>> key == graph_cache_key(debug=False, t1w=["sub-01_T1w.nii.gz"])
+    False
+    >>> sys.argv = argv
+
+    """
+    from hashlib import sha256
+    from json import dumps
+    from nipype import __version__ as nipype_ver
+    from niworkflows import __version__ as niworkflows_ver
+    from ..__about__ import __version__
+    from .versions import prefetch_versions
+
+    kwargs["_versions"] = [__version__, niworkflows_ver, nipype_ver]
+    kwargs["_tools"] = {name: str(ver) for name, ver in prefetch_versions().items()}
+    kwargs["_command"] = list(sys.argv)
+    return sha256(
+        dumps(kwargs, sort_keys=True, default=_key_default).encode()
+    ).hexdigest()
@@ -22,12 +22,330 @@
 #
 """Self-contained utilities to be used within Function nodes."""
 
+_SKULL_STRIPPED = {}
 
-def apply_lut(in_dseg, lut, newpath=None):
-    """Map the input discrete segmentation to a new label set (lookup table, LUT)."""
+
+def iter_slabs(in_file, max_bytes=2 ** 23):
+    """
+    Iterate over the data of an image in slabs of whole slices (along the third axis).
+
+    Three-dimensional images are streamed from disk, reading the data array in
+    a single forward pass: in Fortran order, a slab is a contiguous range of whole
+    slices, so compressed files are decompressed only once and the full array
+    is never allocated.
+    Slabs keep the on-disk data type, unless the image has scaling factors.
+
+    Parameters
+    ----------
+    in_file : os.PathLike
+        Input image.
+    max_bytes : :obj:`int`
+        Approximate size of each slab, before scaling.
+
+    Yields
+    ------
+    start : :obj:`int`
+        Index of the first slice of the slab.
+    slab : :obj:`numpy.ndarray`
+        Image data of the slab.
+
+    """
+    import gzip
     import numpy as np
     import nibabel as nb
+
+    dataobj = nb.load(in_file).dataobj
+    shape = dataobj.shape
+    if len(shape) != 3 or getattr(dataobj, "order", None) != "F":
+        data = np.asanyarray(dataobj)
+        step = max(1, max_bytes // max(1, data[:, :, 0].nbytes))
+        for k in range(0, shape[2], step):
+            yield k, data[:, :, k:k + step]
+        return
+
+    dtype = dataobj.dtype
+    slope, inter = dataobj.slope, dataobj.inter
+    step = max(1, max_bytes // max(1, shape[0] * shape[1] * dtype.itemsize))
+    # A single forward pass does not benefit from the random access indexed_gzip
+    # provides (which nibabel's openers would use), and building its index is slow
+    with (gzip.open if str(in_file).endswith(".gz") else open)(in_file, "rb") as fobj:
+        fobj.seek(dataobj.offset)
+        for k in range(0, shape[2], step):
+            nread = min(step, shape[2] - k)
+            slab = np.frombuffer(
+                fobj.read(shape[0] * shape[1] * nread * dtype.itemsize), dtype=dtype
+            ).reshape((shape[0], shape[1], nread), order="F")
+            if slope != 1.0 or inter != 0.0:
+                slab = slab * slope + inter
+            yield k, slab
+
+
+def lut_table(lut):
+    """
+    Build a dense lookup table from a sequence or a mapping of labels.
+
+    Parameters
+    ----------
+    lut : sequence or :obj:`dict`
+        A sequence where the value at position *i* is the new label of *i*,
+        or a mapping of original labels to new labels.
+
+    Returns
+    -------
+    table : :obj:`numpy.ndarray`
+        Dense table, in the smallest integer type holding all new labels.
+    offset : :obj:`int`
+        Original label corresponding to the first position of ``table``.
+
+    Examples
+    --------
+    >>> lut_table((0, 3, 1, 2))
+    (array([0, 3, 1, 2], dtype=uint8), 0)
+    >>> table, offset = lut_table({-1: 5, 1000: 2, 1002: -2})
+    >>> offset, table.size, table.dtype
+    (-1, 1004, dtype('int16'))
+    >>> table[[0, 1, 1001, 1003]].tolist()
+    [5, 0, 2, -2]
+
+    """
+    import numpy as np
+
+    if isinstance(lut, dict):
+        offset = int(min(lut))
+        table = np.zeros(int(max(lut)) - offset + 1, dtype="int64")
+        table[np.array(list(lut), dtype="int64") - offset] = list(lut.values())
+    else:
+        offset = 0
+        table = np.array(lut, dtype="int64")
+
+    dtype = np.result_type(
+        np.min_scalar_type(table.min(initial=0)), np.min_scalar_type(table.max(initial=0))
+    )
+    return table.astype(dtype), offset
+
+
+def remap_labels(in_file, lut, out_dtype=None):
+    """
+    Map the labels of a discrete segmentation through a lookup table.
+
+    The input is read in slabs (see :py:func:`iter_slabs`) and remapped
+    in its on-disk type, so that the only full-size array is the output,
+    in the (compact) type of the new labels.
+    Labels not covered by the lookup table are mapped to zero.
+
+    Parameters
+    ----------
+    in_file : os.PathLike
+        Input segmentation.
+    lut : sequence or :obj:`dict`
+        Lookup table (see :py:func:`lut_table`).
+    out_dtype : :obj:`numpy.dtype`, optional
+        Type of the output array (by default, the type of the lookup table).
+
+    Returns
+    -------
+    out : :obj:`numpy.ndarray`
+        The remapped segmentation.
+
+    """
+    import numpy as np
+    import nibabel as nb
+
+    def _lookup(labels):
+        # Clip labels onto the table, padded with zeros for labels beyond its ends,
+        # without widening the input type
+        info = np.iinfo(labels.dtype)
+        lo = min(max(offset - 1, info.min), info.max)
+        hi = min(max(offset + table.size, info.min), info.max)
+        padded = np.zeros(hi - lo + 1, dtype=out.dtype)
+        start, stop = max(lo, offset), min(hi, offset + table.size - 1)
+        if start <= stop:
+            padded[start - lo:stop - lo + 1] = table[start - offset:stop - offset + 1]
+        # Offsets from the lower end fit in the unsigned counterpart of the input type
+        utype = np.dtype("u%d" % labels.dtype.itemsize)
+        index = np.clip(labels, lo, hi).view(utype)
+        index -= utype.type(lo % 2 ** (8 * utype.itemsize))
+        return padded[index]
+
+    table, offset = lut_table(lut)
+    # Fortran order matches both the slabs and the layout of NIfTI files
+    out = np.zeros(nb.load(in_file).shape, dtype=out_dtype or table.dtype, order="F")
+    expanded = {}
+    for k, slab in iter_slabs(in_file):
+        dest = (slice(None), slice(None), slice(k, k + slab.shape[2]))
+        if slab.dtype.kind in "iu" and slab.dtype.itemsize <= 2:
+            # Index a table over all the values of the (8 or 16 bit) input type,
+            # which requires no temporary arrays
+            slab = slab.astype(slab.dtype.newbyteorder("="), copy=False)
+            utype = "u%d" % slab.dtype.itemsize
+            if slab.dtype not in expanded:
+                expanded[slab.dtype] = _lookup(
+                    np.arange(2 ** (8 * slab.dtype.itemsize), dtype=utype).view(slab.dtype)
+                )
+            out[dest] = expanded[slab.dtype][slab.view(utype)]
+        else:
+            out[dest] = _lookup(
+                slab if slab.dtype.kind in "iu" else np.rint(slab).astype("int64")
+            )
+    return out
+
+
+def label_masks(in_file, labels):
+    """
+    Calculate the masks of several labels of a segmentation, in a single scan.
+
+    Parameters
+    ----------
+    in_file : os.PathLike
+        Input segmentation.
+    labels : sequence
+        Each item is a label, or a collection of labels that make up one mask
+        (masks may overlap).
+
+    Returns
+    -------
+    bits : :obj:`numpy.ndarray`
+        Bit field where the *k*-th bit of a voxel is set if it belongs in the
+        *k*-th mask, in the smallest unsigned integer type fitting all masks.
+
+    """
+    import numpy as np
+
+    if not 0 < len(labels) < 64:
+        raise ValueError("Between 1 and 63 masks can be calculated at once.")
+
+    lut = {}
+    for k, group in enumerate(labels):
+        for value in np.atleast_1d(group).tolist():
+            lut[int(value)] = lut.get(int(value), 0) | (1 << k)
+    return remap_labels(in_file, lut, out_dtype=np.min_scalar_type((1 << len(labels)) - 1))
+
+
+def write_masks(
+    bits,
+    ref_file,
+    names,
+    out_prefix,
+    suffix="mask",
+    out_format="files",
+    newpath=None,
+    nprocs=None,
+):
+    """
+    Write the masks encoded in a bit field (see :py:func:`label_masks`).
+
+    Parameters
+    ----------
+    bits : :obj:`numpy.ndarray`
+        Bit field with one bit per mask.
+    ref_file : os.PathLike
+        Image providing the affine and header of the outputs.
+    names : :obj:`list` of :obj:`str`
+        Name of each mask, in bit order.
+    out_prefix : :obj:`str`
+        Prefix of output file names.
+    suffix : :obj:`str`
+        Suffix of output file names.
+    out_format : :obj:`str`
+        ``"files"`` writes one (uint8) file per mask, compressed in parallel;
+        ``"4d"`` writes all masks into one 4D (uint8) file, in bit order;
+        and ``"bitpacked"`` writes the bit field itself, with the mask names
+        stored in the header's ``descrip`` field.
+    newpath : os.PathLike, optional
+        Output directory (by default, the current working directory).
+    nprocs : :obj:`int`, optional
+        Maximum number of files written concurrently.
+
+    Returns
+    -------
+    out_files : :obj:`list` of :obj:`str`
+        The output files (a single one, unless ``out_format`` is ``"files"``).
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from pathlib import Path
+    import numpy as np
+    import nibabel as nb
+
+    ref = nb.load(ref_file)
+    newpath = Path(newpath or Path.cwd())
+
+    def _write(data, out_name, descrip=None):
+        hdr = ref.header.copy()
+        hdr.set_data_dtype(data.dtype)
+        img = ref.__class__(data, ref.affine, hdr)
+        if descrip is not None:
+            img.header["descrip"] = descrip
+        out_file = str(newpath / f"{out_prefix}_{out_name}.nii.gz")
+        img.to_filename(out_file)
+        return out_file
+
+    if out_format == "bitpacked":
+        return [_write(bits, f"desc-bits_{suffix}", descrip=",".join(names))]
+
+    if out_format == "4d":
+        masks = np.zeros(bits.shape + (len(names),), dtype="uint8", order="F")
+        for k in range(len(names)):
+            np.bitwise_and(np.right_shift(bits, k), 1, out=masks[..., k], casting="unsafe")
+        return [_write(masks, suffix)]
+
+    if out_format != "files":
+        raise ValueError(f"Unknown output format <{out_format}>.")
+
+    def _write_mask(k):
+        mask = np.right_shift(bits, k).astype("uint8", copy=False)
+        mask &= 1
+        return _write(mask, f"label-{names[k]}_{suffix}")
+
+    # Compression (zlib) releases the GIL, so that files are written in parallel
+    with ThreadPoolExecutor(max_workers=nprocs) as pool:
+        return list(pool.map(_write_mask, range(len(names))))
+
+
+def split_labels(
+    in_file,
+    labels,
+    names,
+    out_prefix=None,
+    suffix="mask",
+    out_format="files",
+    newpath=None,
+    nprocs=None,
+):
+    """
+    Split a segmentation into masks of labels (or groups of labels), reading it once.
+
+    See :py:func:`label_masks` and :py:func:`write_masks`.
+    By default, outputs are prefixed with the name of the input file.
+
+    """
+    from nipype.utils.filemanip import split_filename
+    from smriprep.utils.misc import label_masks, write_masks
+
+    return write_masks(
+        label_masks(in_file, labels),
+        in_file,
+        names,
+        out_prefix or split_filename(in_file)[1],
+        suffix=suffix,
+        out_format=out_format,
+        newpath=newpath,
+        nprocs=nprocs,
+    )
+
+
+def apply_lut(in_dseg, lut, newpath=None, low_mem=False):
+    """
+    Map the input discrete segmentation to a new label set (lookup table, LUT).
+
+    See :py:func:`remap_labels`.
+    With ``low_mem``, the output is written uncompressed so that downstream
+    nodes can memory-map it.
+
+    """
+    import nibabel as nb
     from nipype.utils.filemanip import fname_presuffix
+    from smriprep.utils.misc import remap_labels
 
     if newpath is None:
         from os import getcwd
@@ -35,18 +353,76 @@ def apply_lut(in_dseg, lut, newpath=None):
         newpath = getcwd()
 
     out_file = fname_presuffix(in_dseg, suffix="_dseg", newpath=newpath)
-    lut = np.array(lut, dtype="int16")
+    if low_mem:
+        out_file = fname_presuffix(
+            in_dseg, suffix="_dseg.nii", newpath=newpath, use_ext=False
+        )
 
     segm = nb.load(in_dseg)
+    labels = remap_labels(in_dseg, lut)
     hdr = segm.header.copy()
-    hdr.set_data_dtype("int16")
-    segm.__class__(
-        lut[np.asanyarray(segm.dataobj, dtype=int)].astype("int16"), segm.affine, hdr
-    ).to_filename(out_file)
-
+    hdr.set_data_dtype(labels.dtype)
+    segm.__class__(labels, segm.affine, hdr).to_filename(out_file)
     return out_file
 
 
+def is_skull_stripped(imgs, nprocs=None):
+    """
+    Check whether all the input T1w images are skull-stripped.
+
+    An image is deemed skull-stripped if its voxel values on the six faces
+    of the field of view sum up (in absolute value) to less than 10.
+    Images are streamed in slabs (see :py:func:`iter_slabs`), and reading
+    stops as soon as the faces are found to contain signal.
+    Verdicts are cached by file path, size and modification time.
+
+    Parameters
+    ----------
+    imgs : :obj:`list` of os.PathLike
+        Input images.
+    nprocs : :obj:`int`, optional
+        Number of images to be checked concurrently.
+
+    Returns
+    -------
+    stripped : :obj:`bool`
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from pathlib import Path
+    import numpy as np
+    import nibabel as nb
+
+    def _check_img(img):
+        stat = Path(img).stat()
+        key = (str(img), stat.st_size, stat.st_mtime_ns)
+        if key in _SKULL_STRIPPED:
+            return _SKULL_STRIPPED[key]
+
+        nslices = nb.load(img).shape[2]
+        sidevals = 0.0
+        for k, data in iter_slabs(img):
+            data = np.abs(data.astype(np.float32))
+            sidevals += (
+                data[0].sum() + data[-1].sum() + data[:, 0].sum() + data[:, -1].sum()
+            )
+            if k == 0:
+                sidevals += data[:, :, 0].sum()
+            if k + data.shape[2] == nslices:
+                sidevals += data[:, :, -1].sum()
+            if sidevals >= 10:
+                break
+
+        _SKULL_STRIPPED[key] = bool(sidevals < 10)
+        return _SKULL_STRIPPED[key]
+
+    if len(imgs) < 2 or nprocs == 1:
+        return all(_check_img(img) for img in imgs)
+
+    with ThreadPoolExecutor(max_workers=nprocs) as pool:
+        return all(pool.map(_check_img, imgs))
+
+
 def fs_isRunning(subjects_dir, subject_id, mtime_tol=86400, logger=None):
     """
     Checks FreeSurfer subjects dir for presence of recon-all blocking ``IsRunning`` files,
@@ -0,0 +1,177 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""
+Registry of ``antsRegistration`` presets for spatial normalization.
+
+A preset is a list of ``antsRegistration`` settings (in the format of
+:py:class:`nipype.interfaces.ants.Registration`'s ``from_file``), which are tried
+in order until one succeeds.
+Presets distributed with *sMRIPrep* are named after their JSON file in
+``smriprep/data/registration``:
+
+* ``precise``: three-level SyN down to full resolution (the default).
+* ``balanced``: as ``precise``, but SyN stops at half resolution (in both attempts).
+* ``fast``: Mattes-driven SyN on two coarse levels.
+* ``testing``: affine only (for debugging).
+
+User presets are JSON files with either a list of settings, or a single
+dictionary. A dictionary with a ``base`` key names a preset whose attempts are
+updated with the remaining keys (e.g.,
+``{"base": "precise", "number_of_iterations": [[50], [50], [70, 50, 20]]}``).
+
+"""
+from json import dumps, loads
+from pathlib import Path
+
+from pkg_resources import resource_filename as pkgr
+
+PRESETS_DIR = Path(pkgr("smriprep", "data/registration"))
+
+
+def list_presets():
+    """
+    List the names of the presets distributed with *sMRIPrep*.
+
+    >>> list_presets()
+    ['balanced', 'fast', 'precise', 'testing']
+
+    """
+    return sorted(f.stem for f in PRESETS_DIR.glob("*.json"))
+
+
+def load_preset(preset):
+    """
+    Read the settings of a preset.
+
+    Parameters
+    ----------
+    preset : :obj:`str`, os.PathLike or :obj:`list`
+        Either the name of a preset distributed with *sMRIPrep*, or a JSON file.
+        A list is taken as the (already loaded) attempts of a preset.
+
+    Returns
+    -------
+    attempts : :obj:`list` of :obj:`dict`
+        The ``antsRegistration`` settings of each attempt.
+
+    Examples
+    --------
+    >>> [len(load_preset(p)) for p in list_presets()]
+    [2, 1, 3, 3]
+    >>> load_preset("precise")[0]["transforms"]
+    ['Rigid', 'Affine', 'SyN']
+    >>> load_preset("accurate")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ValueError:
+
+    """
+    if isinstance(preset, list):
+        return preset
+
+    preset = str(preset)
+    if preset in list_presets():
+        return loads((PRESETS_DIR / f"{preset}.json").read_text())
+
+    if not preset.endswith(".json") or not Path(preset).is_file():
+        raise ValueError(
+            f"Unknown registration preset <{preset}> (choices: "
+            f"{', '.join(list_presets())}; or a JSON file)."
+        )
+
+    settings = loads(Path(preset).read_text())
+    if isinstance(settings, list):
+        return settings
+    if "base" not in settings:
+        return [settings]
+    base = settings.pop("base")
+    return [{**attempt, **settings} for attempt in load_preset(base)]
+
+
+def select_preset(template, presets):
+    """
+    Pick the preset of a template.
+
+    Parameters
+    ----------
+    template : :obj:`str`
+        Template identifier, possibly with specs.
+    presets : :obj:`dict`
+        Presets indexed by template identifiers, with or without specs;
+        the ``*`` key applies to all other templates.
+
+    Examples
+    --------
+    >>> presets = {"*": "fast", "MNIInfant": "balanced", "MNIInfant:cohort-1": "precise"}
+    >>> select_preset("MNI152NLin6Asym", presets)
+    'fast'
+    >>> select_preset("MNIInfant:cohort-2", presets)
+    'balanced'
+    >>> select_preset("MNIInfant:cohort-1", presets)
+    'precise'
+
+    """
+    for key in (template, template.split(":")[0], "*"):
+        if key in presets:
+            return presets[key]
+    return None
+
+
+def parse_preset_args(values, default):
+    """
+    Convert command line arguments into presets indexed by template.
+
+    Examples
+    --------
+    >>> parse_preset_args(["fast", "MNI152NLin6Asym=precise"], "precise")
+    {'*': 'fast', 'MNI152NLin6Asym': 'precise'}
+    >>> parse_preset_args(["MNIInfant:cohort-1=balanced"], "testing")
+    {'*': 'testing', 'MNIInfant:cohort-1': 'balanced'}
+
+    """
+    presets = {"*": default}
+    for value in values or []:
+        template, _, preset = value.rpartition("=")
+        presets[template or "*"] = preset
+    for preset in set(presets.values()):
+        load_preset(preset)
+    return presets
+
+
+def write_preset(preset, out_dir=None):
+    """
+    Write the attempts of a preset as settings files for ``SpatialNormalization``.
+
+    Returns
+    -------
+    settings : :obj:`list` of :obj:`str`
+        One JSON file per attempt.
+
+    """
+    out_dir = Path(out_dir or Path.cwd())
+    name = "settings" if isinstance(preset, list) else Path(str(preset)).name.split(".")[0]
+    settings = []
+    for i, attempt in enumerate(load_preset(preset)):
+        out_file = out_dir / f"{name}_{i:03d}.json"
+        out_file.write_text(dumps(attempt, indent=2))
+        settings.append(str(out_file))
+    return settings
@@ -0,0 +1,190 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""Process-wide cache of TemplateFlow metadata."""
+from json import dumps, loads
+from pathlib import Path
+
+_METADATA = {}
+
+
+def _cache_id():
+    from templateflow import __version__ as tf_ver
+    from templateflow.conf import TF_HOME
+
+    return {"templateflow": tf_ver, "home": str(TF_HOME)}
+
+
+def get_template_metadata(template):
+    """
+    Retrieve the metadata of a template, querying TemplateFlow only once.
+
+    The returned dictionary is shared by all callers and must not be modified.
+
+    Parameters
+    ----------
+    template : :obj:`str`
+        A template identifier, possibly with specs (e.g., ``MNIPediatricAsym:cohort-1``);
+        specs are ignored.
+
+    Examples
+    --------
+    >>> _METADATA["MyTemplate"] = {"Name": "My template"}
+    >>> get_template_metadata("MyTemplate:res-1")["Name"]
+    'My template'
+    >>> del _METADATA["MyTemplate"]
+
+    """
+    template = template.split(":")[0]
+    if template not in _METADATA:
+        from templateflow.api import get_metadata
+
+        _METADATA[template] = get_metadata(template)
+    return _METADATA[template]
+
+
+def prefetch_template_metadata(templates, cache_file=None):
+    """
+    Populate the metadata cache for several templates.
+
+    If ``cache_file`` is given, metadata stored there by a previous run with the same
+    TemplateFlow version and home folder are reused, and the file is updated with
+    any templates that had to be queried.
+
+    Parameters
+    ----------
+    templates : :obj:`list` of :obj:`str`
+        Template identifiers.
+    cache_file : os.PathLike, optional
+        A JSON file where metadata are stored across runs.
+
+    """
+    templates = {t.split(":")[0] for t in templates}
+    stored = {}
+    if cache_file is not None:
+        cache_file = Path(cache_file)
+        if cache_file.exists():
+            try:
+                stored = loads(cache_file.read_text())
+            except ValueError:
+                stored = {}
+            if stored.get("id") != _cache_id():
+                stored = {}
+        for template, meta in stored.get("metadata", {}).items():
+            _METADATA.setdefault(template, meta)
+
+    for template in sorted(templates):
+        get_template_metadata(template)
+
+    if cache_file is not None and not templates.issubset(stored.get("metadata", {})):
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(
+            dumps({"id": _cache_id(), "metadata": _METADATA}, indent=2, sort_keys=True)
+        )
+
+
+def get_template_xfm(template, source, fetch=False):
+    """
+    Find the TemplateFlow transform resampling images of one template into another.
+
+    Parameters
+    ----------
+    template : :obj:`str`
+        Identifier of the target template, possibly with specs (only the cohort is
+        considered, e.g., ``MNIInfant:cohort-1``).
+    source : :obj:`str`
+        Identifier of the template images are resampled from.
+    fetch : :obj:`bool`
+        Download the transform file, if necessary (otherwise, only its presence in
+        TemplateFlow's archive is checked, which does not require network access).
+
+    Returns
+    -------
+    xfm : :obj:`~pathlib.Path` or ``None``
+        The ITK composite (``.h5``) transform file, which (in the order of
+        ``antsApplyTransforms``) maps points of ``template`` onto ``source``.
+
+    Examples
+    --------
+    >>> get_template_xfm("MNI152NLin6Asym", "MNI152NLin2009cAsym").name
+    'tpl-MNI152NLin6Asym_from-MNI152NLin2009cAsym_mode-image_xfm.h5'
+    >>> get_template_xfm("MNI152NLin6Asym", "MNIInfant:cohort-1:res-2").name
+    'tpl-MNI152NLin6Asym_from-MNIInfant+1_mode-image_xfm.h5'
+    >>> get_template_xfm("MNIInfant:cohort-1", "MNI152NLin6Asym").name
+    'tpl-MNIInfant_cohort-1_from-MNI152NLin6Asym_mode-image_xfm.h5'
+    >>> get_template_xfm("MNI152NLin2009cAsym", "MNIInfant:cohort-1") is None
+    True
+
+    """
+    from templateflow import api as tf
+
+    def _split(identifier):
+        name, *specs = identifier.split(":")
+        cohort = dict(s.split("-", 1) for s in specs).get("cohort")
+        return name, cohort
+
+    name, cohort = _split(template)
+    src_name, src_cohort = _split(source)
+    query = {
+        "from": src_name if src_cohort is None else f"{src_name}+{src_cohort}",
+        "mode": "image",
+        "suffix": "xfm",
+        "extension": ".h5",
+    }
+    if cohort is not None:
+        query["cohort"] = cohort
+
+    xfms = (tf.get if fetch else tf.ls)(name, **query)
+    if not isinstance(xfms, list):
+        xfms = [xfms]
+    return Path(xfms[0]) if len(xfms) == 1 else None
+
+
+def get_surface_targets(spaces):
+    """
+    List the standard surface spaces that per-vertex maps are resampled onto.
+
+    Parameters
+    ----------
+    spaces : :py:class:`~niworkflows.utils.spaces.SpatialReferences`
+        Output spaces.
+
+    Returns
+    -------
+    targets : :obj:`list` of :obj:`str`
+        Spaces with their density (``fsLR`` defaults to ``32k``).
+
+    Examples
+    --------
+    >>> from niworkflows.utils.spaces import SpatialReferences
+    >>> get_surface_targets(
+    ...     SpatialReferences(["MNI152NLin2009cAsym", "fsnative", "fsaverage5", "fsLR"])
+    ... )
+    ['fsaverage:den-10k', 'fsLR:den-32k']
+
+    """
+    targets = [
+        f"{ref.space}:den-{ref.spec.get('den', '32k')}"
+        for ref in spaces.get_standard(dim=(2,))
+        if ref.space in ("fsaverage", "fsLR")
+    ]
+    return list(dict.fromkeys(targets))
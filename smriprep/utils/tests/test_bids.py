@@ -0,0 +1,90 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+import json
+
+from ..bids import bids_fingerprint, init_layout
+
+
+def _gen_bids(tmp_path, subjects=("01", "02")):
+    bids_dir = tmp_path / "bids"
+    bids_dir.mkdir()
+    (bids_dir / "dataset_description.json").write_text(
+        json.dumps({"Name": "test", "BIDSVersion": "1.4.0"})
+    )
+    for sub in subjects:
+        anat = bids_dir / f"sub-{sub}" / "anat"
+        anat.mkdir(parents=True)
+        (anat / f"sub-{sub}_T1w.nii.gz").write_text("")
+    (bids_dir / "code").mkdir()
+    return bids_dir
+
+
+def test_bids_fingerprint(tmp_path):
+    bids_dir = _gen_bids(tmp_path)
+    fingerprint = bids_fingerprint(bids_dir)
+    assert sorted(fingerprint) == [
+        ".", "sub-01", "sub-01/anat", "sub-02", "sub-02/anat",
+    ]
+
+
+def test_init_layout(tmp_path):
+    bids_dir = _gen_bids(tmp_path)
+    database_dir = tmp_path / "bids_db"
+
+    layout, reused = init_layout(bids_dir, database_dir=database_dir)
+    assert not reused
+    assert sorted(layout.get_subjects()) == ["01", "02"]
+
+    layout, reused = init_layout(bids_dir, database_dir=database_dir)
+    assert reused
+    assert sorted(layout.get_subjects()) == ["01", "02"]
+
+    # Adding a subject invalidates the stored index
+    anat = bids_dir / "sub-03" / "anat"
+    anat.mkdir(parents=True)
+    (anat / "sub-03_T1w.nii.gz").write_text("")
+    layout, reused = init_layout(bids_dir, database_dir=database_dir)
+    assert not reused
+    assert sorted(layout.get_subjects()) == ["01", "02", "03"]
+
+
+def test_init_layout_participants(tmp_path):
+    bids_dir = _gen_bids(tmp_path, subjects=("01", "010", "02"))
+    database_dir = tmp_path / "bids_db"
+
+    layout, reused = init_layout(bids_dir, participant_label=["sub-01"])
+    assert layout.get_subjects() == ["01"]
+
+    layout, reused = init_layout(
+        bids_dir, database_dir=database_dir, participant_label=["01", "02"]
+    )
+    assert not reused
+    assert sorted(layout.get_subjects()) == ["01", "02"]
+    assert layout.get(return_type="id", target="subject", suffix="T1w") == ["01", "02"]
+
+    # Modifying a participant outside the selection does not invalidate the index
+    (bids_dir / "sub-010" / "anat" / "sub-010_T2w.nii.gz").write_text("")
+    layout, reused = init_layout(
+        bids_dir, database_dir=database_dir, participant_label=["02", "sub-01"]
+    )
+    assert reused
@@ -20,9 +20,13 @@
 #
 #     https://www.nipreps.org/community/licensing/
 #
+from pathlib import Path
+
+import numpy as np
+import nibabel as nb
 import pytest
 
-from ..misc import fs_isRunning
+from ..misc import fs_isRunning, is_skull_stripped, remap_labels, split_labels
 
 
 def _gen_fsdir(tmp_path, isrunning):
@@ -52,3 +56,68 @@ def test_fs_isRunning(tmp_path, isrunning, mtime_tol, error):
         with pytest.raises(error):
             fs_isRunning(fs_dir, "sub-01", mtime_tol=mtime_tol)
         assert tuple(fs_dir.glob("**/IsRunning*"))
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+@pytest.mark.parametrize("face", [None, 0, 1, 2])
+def test_is_skull_stripped(tmp_path, ext, face):
+    data = np.zeros((10, 11, 12), dtype="int16")
+    data[2:-2, 2:-2, 2:-2] = 100
+    if face is not None:
+        # Signal on the far end of one axis only
+        data[(slice(None),) * face + (-1,)] = 5
+
+    in_file = tmp_path / f"sub-01_T1w{ext}"
+    nb.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+    assert is_skull_stripped([in_file]) is (face is None)
+    # The verdict is cached, and images are checked all together
+    assert is_skull_stripped([in_file, in_file], nprocs=2) is (face is None)
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "int16", "int32", "float32"])
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+@pytest.mark.parametrize("lut", [(0, 3, 1, 2), {-3: 7, 0: 1, 2: 300}, {1000: 2, 1001: 3}])
+def test_remap_labels(tmp_path, dtype, ext, lut):
+    labels = np.random.default_rng(1234).integers(-3, 5, size=(20, 21, 22))
+    if dtype == "uint8":
+        labels = np.abs(labels)
+    elif isinstance(lut, dict) and min(lut) >= 1000:
+        labels[labels > 0] += 1000
+
+    in_file = tmp_path / f"dseg{ext}"
+    nb.Nifti1Image(labels.astype(dtype), np.eye(4)).to_filename(in_file)
+
+    mapping = lut if isinstance(lut, dict) else dict(enumerate(lut))
+    expected = np.vectorize(lambda v: mapping.get(v, 0))(labels)
+    assert np.array_equal(remap_labels(in_file, lut), expected)
+
+
+@pytest.mark.parametrize("out_format", ["files", "4d", "bitpacked"])
+def test_split_labels(tmp_path, out_format):
+    labels = np.random.default_rng(1234).integers(0, 6, size=(20, 21, 22))
+    in_file = tmp_path / "dseg.nii.gz"
+    nb.Nifti1Image(labels.astype("int16"), np.eye(4)).to_filename(in_file)
+
+    # Masks of a label, of a group of labels, and overlapping
+    groups = (1, (2, 3), (3, 4, 5))
+    expected = [np.isin(labels, group) for group in groups]
+    out_files = split_labels(
+        in_file, groups, ("A", "B", "C"), out_format=out_format, newpath=tmp_path
+    )
+
+    if out_format == "files":
+        assert [Path(f).name for f in out_files] == [
+            f"dseg_label-{name}_mask.nii.gz" for name in "ABC"
+        ]
+        masks = [np.asanyarray(nb.load(f).dataobj) for f in out_files]
+    else:
+        (out_file,) = out_files
+        data = np.asanyarray(nb.load(out_file).dataobj)
+        if out_format == "4d":
+            masks = np.moveaxis(data, -1, 0)
+        else:
+            assert nb.load(out_file).header["descrip"].tobytes().rstrip(b"\0") == b"A,B,C"
+            masks = [data & (1 << k) for k in range(len(groups))]
+
+    for mask, exp in zip(masks, expected):
+        assert np.array_equal(mask.astype(bool), exp)
@@ -0,0 +1,94 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+from json import dumps, loads
+
+import pytest
+
+from ..registration import load_preset, parse_preset_args, write_preset
+
+
+def test_preset_overrides(tmp_path):
+    iterations = [[10], [10], [10, 5]]
+    user_file = tmp_path / "quick.json"
+    user_file.write_text(dumps({"base": "precise", "number_of_iterations": iterations}))
+
+    attempts = load_preset(user_file)
+    assert len(attempts) == len(load_preset("precise"))
+    assert all(a["number_of_iterations"] == iterations for a in attempts)
+    assert attempts[0]["transforms"] == ["Rigid", "Affine", "SyN"]
+
+    settings = write_preset(user_file, tmp_path)
+    assert [loads(open(f).read()) for f in settings] == attempts
+
+    assert parse_preset_args([str(user_file)], "fast") == {"*": str(user_file)}
+    with pytest.raises(ValueError):
+        parse_preset_args(["MNI152NLin6Asym=accurate"], "fast")
+
+
+def test_preset_edits_rerun_registration(tmp_path):
+    from ...workflows.norm import init_anat_norm_wf
+
+    user_file = tmp_path / "user.json"
+
+    def settings_hash(iterations):
+        user_file.write_text(dumps({"base": "fast", "number_of_iterations": iterations}))
+        wf = init_anat_norm_wf(
+            debug=False,
+            omp_nthreads=1,
+            templates=["MNI152NLin2009cAsym"],
+            registration_presets={"*": str(user_file)},
+        )
+        return wf.get_node("reg_settings").inputs.get_hashval()[1]
+
+    assert settings_hash([[10], [5]]) != settings_hash([[20], [5]])
+
+
+@pytest.mark.parametrize("hub_qc", [False, True])
+def test_registration_resolution(monkeypatch, hub_qc):
+    from ...workflows import norm
+
+    resolutions = {"MNI152NLin2009cAsym": ["1", "2"], "MNI152NLin6Asym": ["1"]}
+    monkeypatch.setattr(
+        norm, "get_template_metadata", lambda tpl: {"Name": tpl, "res": resolutions[tpl]}
+    )
+    monkeypatch.setattr(norm, "get_template_xfm", lambda src, dst: f"/tpl-{dst}_from-{src}.h5")
+
+    def build(**kwargs):
+        return norm.init_anat_norm_wf(
+            debug=False,
+            omp_nthreads=1,
+            templates=["MNI152NLin2009cAsym", "MNI152NLin6Asym"],
+            registration_resolution=2,
+            **kwargs,
+        )
+
+    # The T1w is only registered to the hub, unless chained transforms are checked
+    if hub_qc:
+        with pytest.raises(ValueError, match="MNI152NLin6Asym"):
+            build(hub_template="MNI152NLin2009cAsym", hub_qc=True)
+    else:
+        build(hub_template="MNI152NLin2009cAsym")
+    with pytest.raises(ValueError, match="MNI152NLin6Asym"):
+        build(hub_template="MNI152NLin6Asym", hub_qc=hub_qc)
+    with pytest.raises(ValueError, match="MNI152NLin6Asym"):
+        build()
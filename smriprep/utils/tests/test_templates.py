@@ -0,0 +1,52 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+from json import loads
+
+from .. import templates
+
+
+def test_prefetch_template_metadata(tmp_path, monkeypatch):
+    calls = []
+
+    def _get_metadata(template):
+        calls.append(template)
+        return {"Name": template.lower()}
+
+    monkeypatch.setattr(templates, "_METADATA", {})
+    monkeypatch.setattr("templateflow.api.get_metadata", _get_metadata)
+    cache_file = tmp_path / "templateflow.json"
+
+    templates.prefetch_template_metadata(
+        ["MNI152NLin2009cAsym", "MNIPediatricAsym:cohort-1"], cache_file=cache_file
+    )
+    assert sorted(calls) == ["MNI152NLin2009cAsym", "MNIPediatricAsym"]
+    assert templates.get_template_metadata("MNIPediatricAsym:cohort-2")["Name"] == (
+        "mnipediatricasym"
+    )
+    assert len(calls) == 2
+    assert sorted(loads(cache_file.read_text())["metadata"]) == calls
+
+    # A new process reuses the metadata stored in the cache file
+    monkeypatch.setattr(templates, "_METADATA", {})
+    templates.prefetch_template_metadata(["MNI152NLin2009cAsym"], cache_file=cache_file)
+    assert len(calls) == 2
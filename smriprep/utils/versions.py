@@ -0,0 +1,94 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+#
+# Copyright 2021 The NiPreps Developers <nipreps@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# We support and encourage derived works from this project, please read
+# about our expectations at
+#
+#     https://www.nipreps.org/community/licensing/
+#
+"""
+Run-scoped registry of external tool versions.
+
+Versions are only needed to write the workflow boilerplate, but probing them
+may spawn a subprocess.
+*Nipype* remembers a version once found, but it probes again (every time)
+if the tool is not available.
+The functions below probe each tool once per process, regardless of the outcome.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def ants_version():
+    """Return the version of ANTs, or ``None`` if not available."""
+    from nipype.interfaces.ants.base import Info
+
+    return Info.version()
+
+
+@lru_cache(maxsize=None)
+def fsl_version():
+    """Return the version of FSL, or ``None`` if not available."""
+    from nipype.interfaces.fsl.base import Info
+
+    return Info.version()
+
+
+@lru_cache(maxsize=None)
+def fs_version():
+    """Return the (comparable) version of FreeSurfer, ``0.0.0`` if not available."""
+    from nipype.interfaces.freesurfer.base import Info
+
+    return Info.looseversion()
+
+
+TOOLS = {
+    "ants": ants_version,
+    "fsl": fsl_version,
+    "freesurfer": fs_version,
+}
+
+
+def prefetch_versions(tools=None):
+    """
+    Probe the versions of several tools concurrently.
+
+    Parameters
+    ----------
+    tools : :obj:`list` of :obj:`str`, optional
+        Names of tools (keys of :py:data:`TOOLS`) to probe; all, by default.
+
+    Returns
+    -------
+    versions : :obj:`dict`
+        A mapping of tool names to their versions.
+
+    Examples
+    --------
+    >>> versions = prefetch_versions()
+    >>> sorted(versions)
+    ['ants', 'freesurfer', 'fsl']
+    >>> versions["ants"] is ants_version()
+    True
+
+    """
+    tools = list(TOOLS) if tools is None else list(tools)
+    with ThreadPoolExecutor(max_workers=len(tools) or 1) as pool:
+        versions = pool.map(lambda name: TOOLS[name](), tools)
+        return dict(zip(tools, versions))
@@ -27,12 +27,10 @@ from nipype import logging
 from nipype.pipeline import engine as pe
 from nipype.interfaces import (
     utility as niu,
-    freesurfer as fs,
     fsl,
     image,
 )
 
-from nipype.interfaces.ants.base import Info as ANTsInfo
 from nipype.interfaces.ants import N4BiasFieldCorrection
 
 from niworkflows.engine.workflows import LiterateWorkflow as Workflow
@@ -46,8 +44,15 @@ from niworkflows.interfaces.nitransforms import ConcatenateXFMs
 from niworkflows.interfaces.utility import KeySelect
 from niworkflows.utils.misc import fix_multi_T1w_source_name, add_suffix
 from niworkflows.anat.ants import init_brain_extraction_wf, init_n4_only_wf
+from ..interfaces.surf import ResampleSurfaceMaps
 from ..utils.bids import get_outputnode_spec
-from ..utils.misc import apply_lut as _apply_bids_lut, fs_isRunning as _fs_isRunning
+from ..utils.misc import (
+    apply_lut as _apply_bids_lut,
+    fs_isRunning as _fs_isRunning,
+    is_skull_stripped,
+)
+from ..utils.templates import get_surface_targets
+from ..utils.versions import ants_version, fs_version, fsl_version
 from .norm import init_anat_norm_wf
 from .outputs import init_anat_reports_wf, init_anat_derivatives_wf
 from .surfaces import init_surface_recon_wf
@@ -67,9 +72,17 @@ def init_anat_preproc_wf(
     skull_strip_mode,
     skull_strip_template,
     spaces,
+    batch_resampling=False,
     debug=False,
     existing_derivatives=None,
+    fs_aseg_tissues=False,
+    fs_header_xfm=False,
+    hub_qc=False,
+    hub_template=None,
+    low_mem=False,
     name="anat_preproc_wf",
+    registration_presets=None,
+    registration_resolution=None,
     skull_strip_fixed_seed=False,
 ):
     """
@@ -131,10 +144,40 @@ def init_anat_preproc_wf(
         Spatial reference to use in atlas-based brain extraction.
     spaces : :py:class:`~niworkflows.utils.spaces.SpatialReferences`
         Object containing standard and nonstandard space specifications.
+    batch_resampling : :obj:`bool`
+        Resample T1w-space images onto each template within a single process
+        (see :py:func:`~smriprep.workflows.norm.init_anat_norm_wf`; default: ``False``).
     debug : :obj:`bool`
         Enable debugging outputs
+    fs_aseg_tissues : :obj:`bool`
+        Derive the brain tissue segmentation and probability maps from FreeSurfer's
+        ``aseg`` (instead of running FSL FAST). Only effective with ``freesurfer``
+        (default: ``False``).
+    fs_header_xfm : :obj:`bool`
+        Derive the transform between FreeSurfer's conformed space and the T1w from
+        their header geometry, running ``mri_robust_register`` only if the images do
+        not match that way (default: ``False``).
+    hub_qc : :obj:`bool`
+        With ``hub_template``, also register directly to the other templates and
+        write the discrepancies with the chained transforms (as JSON files, under
+        ``figures/``; default: ``False``).
+    hub_template : :obj:`str` or ``None``
+        Register only to this template, and chain the result with TemplateFlow's
+        template-to-template transforms for other standard spaces
+        (see :py:func:`~smriprep.workflows.norm.init_anat_norm_wf`).
+    low_mem : :obj:`bool`
+        Reduce the memory footprint of Python nodes (single-precision data,
+        uncompressed intermediate files), at the cost of disk usage in the working
+        directory (default: ``False``).
     name : :obj:`str`, optional
         Workflow name (default: anat_preproc_wf)
+    registration_presets : :obj:`dict` or ``None``
+        ``antsRegistration`` presets indexed by template
+        (see :py:mod:`smriprep.utils.registration`).
+    registration_resolution : :obj:`int` or ``None``
+        TemplateFlow resolution index of the template images the T1w is registered
+        to, independently of the resolution of outputs
+        (see :py:func:`~smriprep.workflows.norm.init_anat_norm_wf`).
     skull_strip_mode : :obj:`str`
         Determiner for T1-weighted skull stripping (`force` ensures skull stripping,
         `skip` ignores skull stripping, and `auto` automatically ignores skull stripping
@@ -186,6 +229,10 @@ def init_anat_preproc_wf(
     anat2std_xfm
         Nonlinear spatial transform to resample imaging data given in anatomical space
         into standard space.
+    anat2std_warp
+        The ``anat2std_xfm`` transforms composed into displacements fields on the
+        template grids (faster to apply than ``anat2std_xfm``); not available if
+        derivatives are reused with ``fast_track``.
     std2anat_xfm
         Inverse transform of the above.
     subject_id
@@ -207,6 +254,7 @@ def init_anat_preproc_wf(
     """
     workflow = Workflow(name=name)
     num_t1w = len(t1w)
+    fs_aseg_tissues = fs_aseg_tissues and freesurfer
     desc = """
 Anatomical data preprocessing
 
@@ -226,25 +274,12 @@ BIDS dataset.""".format(
 
     outputnode = pe.Node(
         niu.IdentityInterface(
-            fields=["template", "subjects_dir", "subject_id"] + get_outputnode_spec()
+            fields=["template", "subjects_dir", "subject_id", "anat2std_warp"]
+            + get_outputnode_spec()
         ),
         name="outputnode",
     )
 
-    # Connect reportlets workflows
-    anat_reports_wf = init_anat_reports_wf(
-        freesurfer=freesurfer,
-        output_dir=output_dir,
-    )
-    # fmt:off
-    workflow.connect([
-        (outputnode, anat_reports_wf, [
-            ('t1w_preproc', 'inputnode.t1w_preproc'),
-            ('t1w_mask', 'inputnode.t1w_mask'),
-            ('t1w_dseg', 'inputnode.t1w_dseg')]),
-    ])
-    # fmt:on
-
     if existing_derivatives is not None:
         LOGGER.log(
             25,
@@ -266,6 +301,11 @@ Anatomical preprocessing was reused from previously existing derivative objects.
         for field, value in existing_derivatives.items():
             setattr(outputnode.inputs, field, value)
 
+        anat_reports_wf = init_anat_reports_wf(
+            freesurfer=freesurfer,
+            low_mem=low_mem,
+            output_dir=output_dir,
+        )
         anat_reports_wf.inputs.inputnode.source_file = [
             existing_derivatives["t1w_preproc"]
         ]
@@ -282,6 +322,10 @@ Anatomical preprocessing was reused from previously existing derivative objects.
             (inputnode, anat_reports_wf, [
                 ('subjects_dir', 'inputnode.subjects_dir'),
                 ('subject_id', 'inputnode.subject_id')]),
+            (outputnode, anat_reports_wf, [
+                ('t1w_preproc', 'inputnode.t1w_preproc'),
+                ('t1w_mask', 'inputnode.t1w_mask'),
+                ('t1w_dseg', 'inputnode.t1w_dseg')]),
             (templatesource, stdselect, [('template', 'key')]),
             (outputnode, stdselect, [('std_preproc', 'std_preproc'),
                                      ('std_mask', 'std_mask')]),
@@ -317,15 +361,29 @@ with `N4BiasFieldCorrection` [@n4], distributed with ANTs {ants_ver} \
 The T1w-reference was then skull-stripped with a *Nipype* implementation of
 the `antsBrainExtraction.sh` workflow (from ANTs), using {skullstrip_tpl}
 as target template.
+"""
+    desc += (
+        """\
+Brain tissue segmentation of cerebrospinal fluid (CSF),
+white-matter (WM) and gray-matter (GM) was derived from the
+volumetric segmentation (`aseg`) calculated by FreeSurfer's `recon-all`
+(see below).
+Accordingly, the tissue probability maps are binary (each voxel was assigned
+a probability of 1 for its `aseg` tissue class and 0 for the other two), rather
+than estimates of partial volume.
+"""
+        if fs_aseg_tissues
+        else """\
 Brain tissue segmentation of cerebrospinal fluid (CSF),
 white-matter (WM) and gray-matter (GM) was performed on
 the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
 @fsl_fast].
 """
+    )
 
     workflow.__desc__ = desc.format(
-        ants_ver=ANTsInfo.version() or "(version unknown)",
-        fsl_ver=fsl.FAST().version or "(version unknown)",
+        ants_ver=ants_version() or "(version unknown)",
+        fsl_ver=fsl_version() or "(version unknown)",
         num_t1w=num_t1w,
         skullstrip_tpl=skull_strip_template.fullname,
     )
@@ -345,27 +403,7 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
 
     # 2. Brain-extraction and INU (bias field) correction.
     if skull_strip_mode == "auto":
-        import numpy as np
-        import nibabel as nb
-
-        def _is_skull_stripped(imgs):
-            """Check if T1w images are skull-stripped."""
-
-            def _check_img(img):
-                data = np.abs(nb.load(img).get_fdata(dtype=np.float32))
-                sidevals = (
-                    data[0, :, :].sum()
-                    + data[-1, :, :].sum()
-                    + data[:, 0, :].sum()
-                    + data[:, -1, :].sum()
-                    + data[:, :, 0].sum()
-                    + data[:, :, -1].sum()
-                )
-                return sidevals < 10
-
-            return all(_check_img(img) for img in imgs)
-
-        skull_strip_mode = _is_skull_stripped(t1w)
+        skull_strip_mode = is_skull_stripped(t1w, nprocs=omp_nthreads)
 
     if skull_strip_mode in (True, "skip"):
         brain_extraction_wf = init_n4_only_wf(
@@ -386,6 +424,11 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
         debug=debug,
         omp_nthreads=omp_nthreads,
         templates=spaces.get_spaces(nonstandard=False, dim=(3,)),
+        batch_resampling=batch_resampling,
+        hub_template=hub_template,
+        hub_qc=hub_qc,
+        registration_presets=registration_presets,
+        registration_resolution=registration_resolution,
     )
 
     # fmt:off
@@ -416,27 +459,28 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
             ('poutputnode.std_tpms', 'std_tpms'),
             ('outputnode.template', 'template'),
             ('outputnode.anat2std_xfm', 'anat2std_xfm'),
+            ('outputnode.anat2std_warp', 'anat2std_warp'),
             ('outputnode.std2anat_xfm', 'std2anat_xfm'),
         ]),
     ])
     # fmt:on
 
-    # Change LookUp Table - BIDS wants: 0 (bg), 1 (gm), 2 (wm), 3 (csf)
-    lut_t1w_dseg = pe.Node(niu.Function(function=_apply_bids_lut), name="lut_t1w_dseg")
-
-    # fmt:off
-    workflow.connect([
-        (lut_t1w_dseg, anat_norm_wf, [
-            ('out', 'inputnode.moving_segmentation')]),
-        (lut_t1w_dseg, outputnode, [('out', 't1w_dseg')]),
-    ])
-    # fmt:on
-
-    # Connect reportlets
+    # Connect reportlets workflows
+    # Chaining QC only runs if spatial normalization could chain any template
+    hub_qc = "qc_outputnode" in anat_norm_wf.list_node_names()
+    anat_reports_wf = init_anat_reports_wf(
+        freesurfer=freesurfer,
+        hub_qc=hub_qc,
+        low_mem=low_mem,
+        output_dir=output_dir,
+    )
     # fmt:off
     workflow.connect([
         (inputnode, anat_reports_wf, [('t1w', 'inputnode.source_file')]),
         (outputnode, anat_reports_wf, [
+            ('t1w_preproc', 'inputnode.t1w_preproc'),
+            ('t1w_mask', 'inputnode.t1w_mask'),
+            ('t1w_dseg', 'inputnode.t1w_dseg'),
             ('std_preproc', 'inputnode.std_t1w'),
             ('std_mask', 'inputnode.std_mask'),
         ]),
@@ -447,6 +491,16 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
     ])
     # fmt:on
 
+    if hub_qc:
+        # fmt:off
+        workflow.connect([
+            (inputnode, anat_reports_wf, [('t1w', 'qc_inputnode.source_file')]),
+            (anat_norm_wf, anat_reports_wf, [
+                ('qc_outputnode.chain_qc', 'qc_inputnode.chain_qc'),
+                ('qc_outputnode.template', 'qc_inputnode.template')]),
+        ])
+        # fmt:on
+
     # Write outputs ############################################3
     anat_derivatives_wf = init_anat_derivatives_wf(
         bids_root=bids_root,
@@ -454,6 +508,8 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
         num_t1w=num_t1w,
         output_dir=output_dir,
         spaces=spaces,
+        norm_resolution=1 + debug,
+        batch_resampling=batch_resampling,
     )
 
     # fmt:off
@@ -464,7 +520,11 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
         (anat_norm_wf, anat_derivatives_wf, [
             ('outputnode.template', 'inputnode.template'),
             ('outputnode.anat2std_xfm', 'inputnode.anat2std_xfm'),
-            ('outputnode.std2anat_xfm', 'inputnode.std2anat_xfm')
+            ('outputnode.anat2std_warp', 'inputnode.anat2std_warp'),
+            ('outputnode.std2anat_xfm', 'inputnode.std2anat_xfm'),
+            ('outputnode.std_mask', 'inputnode.std_mask'),
+            ('outputnode.std_dseg', 'inputnode.std_dseg'),
+            ('outputnode.std_tpms', 'inputnode.std_tpms'),
         ]),
         (outputnode, anat_derivatives_wf, [
             ('t1w_ref_xfms', 'inputnode.t1w_ref_xfms'),
@@ -477,29 +537,39 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
     # fmt:on
 
     # XXX Keeping FAST separate so that it's easier to swap in ANTs or FreeSurfer
+    if not fs_aseg_tissues:
+        # Brain tissue segmentation - FAST produces: 0 (bg), 1 (wm), 2 (csf), 3 (gm)
+        t1w_dseg = pe.Node(
+            fsl.FAST(segments=True, no_bias=True, probability_maps=True),
+            name="t1w_dseg",
+            mem_gb=3,
+        )
+        if low_mem:
+            t1w_dseg.inputs.output_type = "NIFTI"
 
-    # Brain tissue segmentation - FAST produces: 0 (bg), 1 (wm), 2 (csf), 3 (gm)
-    t1w_dseg = pe.Node(
-        fsl.FAST(segments=True, no_bias=True, probability_maps=True),
-        name="t1w_dseg",
-        mem_gb=3,
-    )
-    lut_t1w_dseg.inputs.lut = (0, 3, 1, 2)  # Maps: 0 -> 0, 3 -> 1, 1 -> 2, 2 -> 3.
-    fast2bids = pe.Node(
-        niu.Function(function=_probseg_fast2bids),
-        name="fast2bids",
-        run_without_submitting=True,
-    )
+        # Change LookUp Table - BIDS wants: 0 (bg), 1 (gm), 2 (wm), 3 (csf)
+        lut_t1w_dseg = pe.Node(
+            niu.Function(function=_apply_bids_lut), name="lut_t1w_dseg", mem_gb=0.1
+        )
+        lut_t1w_dseg.inputs.lut = (0, 3, 1, 2)  # Maps: 0 -> 0, 3 -> 1, 1 -> 2, 2 -> 3.
+        lut_t1w_dseg.inputs.low_mem = low_mem
+        fast2bids = pe.Node(
+            niu.Function(function=_probseg_fast2bids),
+            name="fast2bids",
+            run_without_submitting=True,
+        )
 
-    # fmt:off
-    workflow.connect([
-        (buffernode, t1w_dseg, [('t1w_brain', 'in_files')]),
-        (t1w_dseg, lut_t1w_dseg, [('partial_volume_map', 'in_dseg')]),
-        (t1w_dseg, fast2bids, [('partial_volume_files', 'inlist')]),
-        (fast2bids, anat_norm_wf, [('out', 'inputnode.moving_tpms')]),
-        (fast2bids, outputnode, [('out', 't1w_tpms')]),
-    ])
-    # fmt:on
+        # fmt:off
+        workflow.connect([
+            (buffernode, t1w_dseg, [('t1w_brain', 'in_files')]),
+            (t1w_dseg, lut_t1w_dseg, [('partial_volume_map', 'in_dseg')]),
+            (t1w_dseg, fast2bids, [('partial_volume_files', 'inlist')]),
+            (lut_t1w_dseg, anat_norm_wf, [('out', 'inputnode.moving_segmentation')]),
+            (lut_t1w_dseg, outputnode, [('out', 't1w_dseg')]),
+            (fast2bids, anat_norm_wf, [('out', 'inputnode.moving_tpms')]),
+            (fast2bids, outputnode, [('out', 't1w_tpms')]),
+        ])
+        # fmt:on
     if not freesurfer:  # Flag --fs-no-reconall is set - return
         # fmt:off
         workflow.connect([
@@ -517,7 +587,10 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
 
     # 5. Surface reconstruction (--fs-no-reconall not set)
     surface_recon_wf = init_surface_recon_wf(
-        name="surface_recon_wf", omp_nthreads=omp_nthreads, hires=hires
+        name="surface_recon_wf",
+        omp_nthreads=omp_nthreads,
+        hires=hires,
+        header_xfm=fs_header_xfm,
     )
     applyrefined = pe.Node(fsl.ApplyMask(), name="applyrefined")
     # fmt:off
@@ -556,6 +629,9 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
         (surface_recon_wf, anat_derivatives_wf, [
             ('outputnode.out_aseg', 'inputnode.t1w_fs_aseg'),
             ('outputnode.out_aparc', 'inputnode.t1w_fs_aparc'),
+            ('outputnode.out_aparc_a2009s', 'inputnode.t1w_fs_aparc_a2009s'),
+            ('outputnode.out_aparc_dkt', 'inputnode.t1w_fs_aparc_dkt'),
+            ('outputnode.out_wmparc', 'inputnode.t1w_fs_wmparc'),
         ]),
         (outputnode, anat_derivatives_wf, [
             ('t1w2fsnative_xfm', 'inputnode.t1w2fsnative_xfm'),
@@ -565,6 +641,48 @@ the brain-extracted T1w using `fast` [FSL {fsl_ver}, RRID:SCR_002823,
     ])
     # fmt:on
 
+    surface_targets = get_surface_targets(spaces)
+    if surface_targets:
+        # Cortical thickness, curvature and sulcal depth on standard surfaces
+        surface_maps = pe.Node(
+            ResampleSurfaceMaps(targets=surface_targets), name="surface_maps"
+        )
+        # The maps live in (and are read from) the subjects directory
+        surface_maps.interface._always_run = True
+        # fmt:off
+        workflow.connect([
+            (surface_recon_wf, surface_maps, [
+                ('outputnode.subjects_dir', 'subjects_dir'),
+                ('outputnode.subject_id', 'subject_id')]),
+            (surface_maps, anat_derivatives_wf, [
+                ('out_files', 'inputnode.surface_maps')]),
+        ])
+        # fmt:on
+
+    if fs_aseg_tissues:
+        # Brain tissue segmentation and (binary) probability maps from FreeSurfer's aseg
+        aseg_tissues = pe.Node(
+            niu.Function(
+                function=_aseg_to_tissues, output_names=["out_dseg", "out_tpms"]
+            ),
+            name="aseg_tissues",
+            n_procs=omp_nthreads,
+            mem_gb=0.1,
+        )
+        aseg_tissues.inputs.lut = _aseg_to_three()
+        aseg_tissues.inputs.nprocs = omp_nthreads
+
+        # fmt:off
+        workflow.connect([
+            (surface_recon_wf, aseg_tissues, [('outputnode.out_aseg', 'in_aseg')]),
+            (aseg_tissues, anat_norm_wf, [
+                ('out_dseg', 'inputnode.moving_segmentation'),
+                ('out_tpms', 'inputnode.moving_tpms')]),
+            (aseg_tissues, outputnode, [('out_dseg', 't1w_dseg'),
+                                        ('out_tpms', 't1w_tpms')]),
+        ])
+        # fmt:on
+
     return workflow
 
 
@@ -618,7 +736,7 @@ A T1w-reference map was computed after registration of
 {num_t1w} T1w images (after INU-correction) using
 `mri_robust_template` [FreeSurfer {fs_ver}, @fs_template].
 """.format(
-            num_t1w=num_t1w, fs_ver=fs.Info().looseversion() or "<ver>"
+            num_t1w=num_t1w, fs_ver=fs_version() or "<ver>"
         )
 
     inputnode = pe.Node(niu.IdentityInterface(fields=["t1w"]), name="inputnode")
@@ -783,23 +901,33 @@ def _aseg_to_three():
     return tuple(aseg_lut)
 
 
-def _split_segments(in_file):
+def _aseg_to_tissues(in_aseg, lut, nprocs=1):
+    """
+    Derive a brain tissue segmentation and the corresponding (binary) probability
+    maps from FreeSurfer's aseg, reading the aseg only once.
+    Up to ``nprocs`` probability maps are compressed concurrently.
+    """
     from pathlib import Path
     import numpy as np
     import nibabel as nb
+    from smriprep.utils.misc import label_masks, write_masks
 
-    segimg = nb.load(in_file)
-    data = np.int16(segimg.dataobj)
-    hdr = segimg.header.copy()
-    hdr.set_data_dtype("uint8")
+    lut = np.asarray(lut)
+    bits = label_masks(in_aseg, [np.flatnonzero(lut == i) for i in (1, 2, 3)])
 
-    out_files = []
-    for i, label in enumerate(("GM", "WM", "CSF"), 1):
-        out_fname = str(Path.cwd() / f"aseg_label-{label}_mask.nii.gz")
-        segimg.__class__(data == i, segimg.affine, hdr).to_filename(out_fname)
-        out_files.append(out_fname)
+    # Tissue masks are disjoint: bits 1, 2 and 4 map onto labels 1, 2 and 3
+    aseg = nb.load(in_aseg)
+    hdr = aseg.header.copy()
+    hdr.set_data_dtype("uint8")
+    out_dseg = str(Path.cwd() / "aseg_dseg.nii.gz")
+    dseg = np.array([0, 1, 2, 0, 3, 0, 0, 0], dtype="uint8")[bits]
+    aseg.__class__(dseg, aseg.affine, hdr).to_filename(out_dseg)
+    del dseg
 
-    return out_files
+    out_tpms = write_masks(
+        bits, in_aseg, ("GM", "WM", "CSF"), "aseg", suffix="probseg", nprocs=nprocs
+    )
+    return out_dseg, out_tpms
 
 
 def _probseg_fast2bids(inlist):
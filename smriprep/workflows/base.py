@@ -24,9 +24,8 @@
 import sys
 import os
 from pathlib import Path
-from copy import deepcopy
 
-from nipype import __version__ as nipype_ver
+from nipype import __version__ as nipype_ver, logging
 from nipype.pipeline import engine as pe
 from nipype.interfaces import utility as niu
 
@@ -37,9 +36,13 @@ from niworkflows.utils.misc import fix_multi_T1w_source_name
 
 from ..interfaces import DerivativesDataSink
 from ..__about__ import __version__
+from ..utils.templates import prefetch_template_metadata
+from ..utils.versions import prefetch_versions
 
 from .anatomical import init_anat_preproc_wf
 
+LOGGER = logging.getLogger("nipype.workflow")
+
 
 def init_smriprep_wf(
     *,
@@ -61,6 +64,15 @@ def init_smriprep_wf(
     subject_list,
     work_dir,
     bids_filters,
+    graph_cache=False,
+    build_nprocs=1,
+    fs_aseg_tissues=False,
+    fs_header_xfm=False,
+    batch_resampling=False,
+    hub_template=None,
+    hub_qc=False,
+    registration_presets=None,
+    registration_resolution=None,
 ):
     """
     Create the execution graph of *sMRIPrep*, with a sub-workflow for each subject.
@@ -68,6 +80,14 @@ def init_smriprep_wf(
     If FreeSurfer's ``recon-all`` is to be run, a FreeSurfer derivatives folder is
     created and populated with any needed template subjects.
 
+    With ``graph_cache``, the sub-workflow of each subject is stored in the
+    working directory, under a key calculated from the arguments of
+    :py:func:`init_single_subject_wf`, the subject's input files (as returned by
+    :py:func:`~niworkflows.utils.bids.collect_data`, including their size and
+    modification time) and the versions of *sMRIPrep* and its core dependencies.
+    When a subject's key is found in the cache, its sub-workflow is loaded instead
+    of rebuilt, so only subjects whose options or inputs changed are rebuilt.
+
     Workflow Graph
         .. workflow::
             :graph2use: orig
@@ -144,6 +164,27 @@ def init_smriprep_wf(
     bids_filters : dict
         Provides finer specification of the pipeline input files through pybids entities filters.
         A dict with the following structure {<suffix>:{<entity>:<filter>,...},...}
+    graph_cache : :obj:`bool`
+        Reuse (and store) per-subject workflow graphs cached in ``work_dir``.
+        The cache is not used with ``fast_track``, as the graph then depends on the
+        derivatives found in the output folder.
+    build_nprocs : :obj:`int`
+        Number of processes used to build the sub-workflows of subjects in parallel.
+    fs_aseg_tissues : :obj:`bool`
+        Derive brain tissue segmentations from FreeSurfer's ``aseg`` instead of FSL FAST.
+    fs_header_xfm : :obj:`bool`
+        Derive the fsnative-to-T1w transform from header geometry when possible.
+    batch_resampling : :obj:`bool`
+        Resample T1w-space images onto each template within a single process.
+    hub_template : :obj:`str` or ``None``
+        Register only to this template, and chain the result with TemplateFlow's
+        template-to-template transforms for other standard spaces.
+    hub_qc : :obj:`bool`
+        Compare chained transforms with direct registrations.
+    registration_presets : :obj:`dict` or ``None``
+        ``antsRegistration`` presets indexed by template.
+    registration_resolution : :obj:`int` or ``None``
+        TemplateFlow resolution index of the registration targets.
 
     """
     smriprep_wf = Workflow(name="smriprep_wf")
@@ -162,18 +203,35 @@ def init_smriprep_wf(
         if fs_subjects_dir is not None:
             fsdir.inputs.subjects_dir = str(fs_subjects_dir.absolute())
 
+    graph_cache = graph_cache and not fast_track
+    cache_dir = Path(work_dir) / "graph_cache"
+
+    # Gather boilerplate information (tool versions, template metadata) once for all subjects
+    prefetch_versions()
+    prefetch_template_metadata(
+        spaces.get_spaces(nonstandard=False, dim=(3,)) + [hub_template] * bool(hub_template),
+        cache_file=cache_dir / "templateflow_metadata.json" if graph_cache else None,
+    )
+
+    subjects = []
     for subject_id in subject_list:
-        single_subject_wf = init_single_subject_wf(
+        wf_args = dict(
+            batch_resampling=batch_resampling,
             debug=debug,
             freesurfer=freesurfer,
             fast_track=fast_track,
+            fs_aseg_tissues=fs_aseg_tissues,
+            fs_header_xfm=fs_header_xfm,
             hires=hires,
-            layout=layout,
+            hub_qc=hub_qc,
+            hub_template=hub_template,
             longitudinal=longitudinal,
             low_mem=low_mem,
             name="single_subject_%s_wf" % subject_id,
             omp_nthreads=omp_nthreads,
             output_dir=output_dir,
+            registration_presets=registration_presets,
+            registration_resolution=registration_resolution,
             skull_strip_fixed_seed=skull_strip_fixed_seed,
             skull_strip_mode=skull_strip_mode,
             skull_strip_template=skull_strip_template,
@@ -182,21 +240,108 @@ def init_smriprep_wf(
             bids_filters=bids_filters,
         )
 
-        single_subject_wf.config["execution"]["crashdump_dir"] = os.path.join(
-            output_dir, "smriprep", "sub-" + subject_id, "log", run_uuid
+        single_subject_wf = None
+        cache_file = None
+        if graph_cache or build_nprocs > 1:
+            # Query the layout here, as it cannot be shared with worker processes
+            wf_args["subject_data"] = collect_data(
+                layout, subject_id, bids_filters=bids_filters
+            )[0]
+
+        if graph_cache:
+            from ..utils.graph import file_identity, graph_cache_key, load_workflow
+            from ..utils.registration import load_preset
+
+            cache_key = graph_cache_key(
+                bids_root=layout.root,
+                # Contents of the presets (user presets may be JSON files)
+                registration_settings={
+                    tpl: load_preset(preset)
+                    for tpl, preset in (registration_presets or {}).items()
+                },
+                **{
+                    **wf_args,
+                    "subject_data": {
+                        k: [file_identity(f) for f in v] if isinstance(v, list) else v
+                        for k, v in wf_args["subject_data"].items()
+                    },
+                },
+            )
+            cache_file = cache_dir / f"sub-{subject_id}_{cache_key}.pklz"
+            if cache_file.exists():
+                LOGGER.info("Reusing cached workflow graph of subject <%s>.", subject_id)
+                single_subject_wf = load_workflow(cache_file)
+
+        subjects.append((subject_id, wf_args, cache_file, single_subject_wf))
+
+    pending = [wf_args for _, wf_args, _, wf in subjects if wf is None]
+    if build_nprocs > 1 and len(pending) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from functools import partial
+
+        LOGGER.info(
+            "Building workflow graphs of %d subjects with %d processes.",
+            len(pending),
+            build_nprocs,
         )
+        with ProcessPoolExecutor(max_workers=min(build_nprocs, len(pending))) as pool:
+            built = pool.map(partial(_build_single_subject_wf, layout.root), pending)
+            built = list(built)
+    else:
+        built = [init_single_subject_wf(layout=layout, **wf_args) for wf_args in pending]
+
+    built = iter(built)
+    subject_wfs = []
+    for subject_id, wf_args, cache_file, single_subject_wf in subjects:
+        if single_subject_wf is None:
+            single_subject_wf = next(built)
+            if cache_file is not None:
+                from ..utils.graph import save_workflow
+
+                for stale in cache_dir.glob(f"sub-{subject_id}_*.pklz"):
+                    # Another job sharing the working directory may remove it first
+                    # (Path.unlink's missing_ok requires Python 3.8)
+                    try:
+                        stale.unlink()
+                    except FileNotFoundError:
+                        pass
+                save_workflow(single_subject_wf, cache_file)
+
+        # Nipype gives each node its own copy of the configuration when it is created.
+        # Free those: all nodes of the subject share one (read-only) dictionary with the
+        # overrides, which Nipype merges into the top-level configuration at run time.
+        node_config = {
+            "execution": {
+                "crashdump_dir": os.path.join(
+                    output_dir, "smriprep", "sub-" + subject_id, "log", run_uuid
+                )
+            }
+        }
+        single_subject_wf.config["execution"].update(node_config["execution"])
         for node in single_subject_wf._get_all_nodes():
-            node.config = deepcopy(single_subject_wf.config)
-        if freesurfer:
-            smriprep_wf.connect(
-                fsdir, "subjects_dir", single_subject_wf, "inputnode.subjects_dir"
-            )
-        else:
-            smriprep_wf.add_nodes([single_subject_wf])
+            node.config = node_config
+        subject_wfs.append(single_subject_wf)
+
+    # Nipype checks new nodes against all the nodes already in the workflow:
+    # add all subjects at once, so that the cost does not grow quadratically
+    if freesurfer:
+        smriprep_wf.connect([
+            (fsdir, single_subject_wf, [("subjects_dir", "inputnode.subjects_dir")])
+            for single_subject_wf in subject_wfs
+        ])
+    else:
+        smriprep_wf.add_nodes(subject_wfs)
 
     return smriprep_wf
 
 
+def _build_single_subject_wf(bids_root, wf_args):
+    """Build a single subject workflow in a worker process."""
+    from types import SimpleNamespace
+
+    return init_single_subject_wf(layout=SimpleNamespace(root=bids_root), **wf_args)
+
+
 def init_single_subject_wf(
     *,
     debug,
@@ -215,6 +360,14 @@ def init_single_subject_wf(
     spaces,
     subject_id,
     bids_filters,
+    subject_data=None,
+    fs_aseg_tissues=False,
+    fs_header_xfm=False,
+    batch_resampling=False,
+    hub_template=None,
+    hub_qc=False,
+    registration_presets=None,
+    registration_resolution=None,
 ):
     """
     Create a single subject workflow.
@@ -295,6 +448,25 @@ def init_single_subject_wf(
     bids_filters : dict
         Provides finer specification of the pipeline input files through pybids entities filters.
         A dict with the following structure {<suffix>:{<entity>:<filter>,...},...}
+    subject_data : :obj:`dict` or None
+        The subject's input files, as returned by
+        :py:func:`~niworkflows.utils.bids.collect_data`.
+        If ``None``, they are queried from ``layout``.
+    fs_aseg_tissues : :obj:`bool`
+        Derive brain tissue segmentations from FreeSurfer's ``aseg`` instead of FSL FAST.
+    fs_header_xfm : :obj:`bool`
+        Derive the fsnative-to-T1w transform from header geometry when possible.
+    batch_resampling : :obj:`bool`
+        Resample T1w-space images onto each template within a single process.
+    hub_template : :obj:`str` or ``None``
+        Register only to this template, and chain the result with TemplateFlow's
+        template-to-template transforms for other standard spaces.
+    hub_qc : :obj:`bool`
+        Compare chained transforms with direct registrations.
+    registration_presets : :obj:`dict` or ``None``
+        ``antsRegistration`` presets indexed by template.
+    registration_resolution : :obj:`int` or ``None``
+        TemplateFlow resolution index of the registration targets.
 
     Inputs
     ------
@@ -309,7 +481,7 @@ def init_single_subject_wf(
         subject_data = {
             "t1w": ["/completely/made/up/path/sub-01_T1w.nii.gz"],
         }
-    else:
+    elif subject_data is None:
         subject_data = collect_data(layout, subject_id, bids_filters=bids_filters)[0]
 
     if not subject_data["t1w"]:
@@ -398,13 +570,21 @@ to workflows in *sMRIPrep*'s documentation]\
 
     # Preprocessing of T1w (includes registration to MNI)
     anat_preproc_wf = init_anat_preproc_wf(
+        batch_resampling=batch_resampling,
         bids_root=layout.root,
         debug=debug,
         existing_derivatives=deriv_cache,
         freesurfer=freesurfer,
+        fs_aseg_tissues=fs_aseg_tissues,
+        fs_header_xfm=fs_header_xfm,
         hires=hires,
+        hub_qc=hub_qc,
+        hub_template=hub_template,
         longitudinal=longitudinal,
+        low_mem=low_mem,
         name="anat_preproc_wf",
+        registration_presets=registration_presets,
+        registration_resolution=registration_resolution,
         t1w=subject_data["t1w"],
         omp_nthreads=omp_nthreads,
         output_dir=output_dir,
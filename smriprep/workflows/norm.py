@@ -22,17 +22,22 @@
 #
 """Spatial normalization workflows."""
 from collections import defaultdict
+from nipype import logging
 from nipype.pipeline import engine as pe
 from nipype.interfaces import utility as niu
 
 from nipype.interfaces import ants
-from nipype.interfaces.ants.base import Info as ANTsInfo
 
-from templateflow.api import get_metadata
 from niworkflows.engine.workflows import LiterateWorkflow as Workflow
 from niworkflows.interfaces.norm import SpatialNormalization
 from niworkflows.interfaces.fixes import FixHeaderApplyTransforms as ApplyTransforms
+from ..interfaces.resampling import MultiApplyTransforms
 from ..interfaces.templateflow import TemplateFlowSelect, TemplateDesc
+from ..utils.registration import load_preset
+from ..utils.templates import get_template_metadata, get_template_xfm
+from ..utils.versions import ants_version
+
+LOGGER = logging.getLogger("nipype.workflow")
 
 
 def init_anat_norm_wf(
@@ -40,6 +45,11 @@ def init_anat_norm_wf(
     debug,
     omp_nthreads,
     templates,
+    batch_resampling=False,
+    hub_template=None,
+    hub_qc=False,
+    registration_resolution=None,
+    registration_presets=None,
     name="anat_norm_wf",
 ):
     """
@@ -78,6 +88,39 @@ def init_anat_norm_wf(
         List of standard space fullnames (e.g., ``MNI152NLin6Asym``
         or ``MNIPediatricAsym:cohort-4``) which are targets for spatial
         normalization.
+    batch_resampling : :obj:`bool`
+        Resample all T1w-space inputs onto each template within one process, which
+        reads the transform and calculates the sampling coordinates only once
+        (see :py:class:`~smriprep.interfaces.resampling.MultiApplyTransforms`),
+        instead of running ``antsApplyTransforms`` on each of them.
+        Interpolators are approximated, so these outputs are meant for internal
+        use only (derivatives are resampled again, see
+        :py:func:`~smriprep.workflows.outputs.init_anat_derivatives_wf`).
+    hub_template : :obj:`str` or ``None``
+        Register the T1w only to this template (the *hub*), and obtain the
+        normalization to the other ``templates`` by concatenating the result with the
+        template-to-template transforms distributed by TemplateFlow.
+        If TemplateFlow does not provide transforms between the hub and any of the
+        ``templates``, all of them are registered directly.
+    hub_qc : :obj:`bool`
+        When chaining transforms through ``hub_template``, also register the T1w
+        directly to each of the other templates, and report the distances between
+        the mappings of the template's brain voxels through either transform
+        (the ``qc_outputnode.chain_qc`` JSON file, one per template).
+    registration_resolution : :obj:`int` or ``None``
+        TemplateFlow resolution index (``res-<label>``) of the template images the
+        T1w is registered to (by default, ``1``, or ``2`` with ``debug``).
+        Outputs are still sampled at resolution ``1 + debug`` with the
+        resulting transforms.
+        A :obj:`ValueError` is raised if any of the templates the T1w is registered
+        to (the hub, the templates checked with ``hub_qc``, or else all ``templates``)
+        does not provide this resolution.
+    registration_presets : :obj:`dict` or ``None``
+        ``antsRegistration`` presets (names in the registry of
+        :py:mod:`smriprep.utils.registration`, or JSON files) indexed by template,
+        where the ``*`` key applies to the remaining templates
+        (which otherwise use ``precise``, or ``testing`` with ``debug``).
+        If ``None``, the settings of ``SpatialNormalization``'s flavor are used.
 
     Inputs
     ------
@@ -105,6 +148,10 @@ def init_anat_norm_wf(
         The T1w after spatial normalization, in template space.
     anat2std_xfm
         The T1w-to-template transform.
+    anat2std_warp
+        The ``anat2std_xfm`` transform composed into a dense displacements field,
+        sampled on the template grid (uncompressed NIfTI, in ITK format), which
+        is faster to read and apply than the composite transform.
     std2anat_xfm
         The template-to-T1w transform.
     std_mask
@@ -121,10 +168,61 @@ def init_anat_norm_wf(
         Template specifications extracted from the input parameter ``template``, for
         further use in downstream nodes.
 
+    With ``hub_qc`` (and any chained template), ``qc_outputnode`` has one output per
+    chained template (to be connected separately from the outputs above):
+
+    chain_qc
+        JSON file with the distances between the chained and direct mappings.
+    template
+        The chained template the ``chain_qc`` file refers to.
+
     """
     ntpls = len(templates)
     workflow = Workflow(name=name)
 
+    if registration_presets:
+        registration_presets = {
+            "*": ["precise", "testing"][debug],
+            **registration_presets,
+        }
+        # Also validates the presets
+        preset_settings = {
+            tpl: load_preset(preset) for tpl, preset in registration_presets.items()
+        }
+
+    chained = [tpl for tpl in templates if tpl != hub_template] if hub_template else []
+    missing = [
+        tpl
+        for tpl in chained
+        if get_template_xfm(tpl, hub_template) is None
+        or get_template_xfm(hub_template, tpl) is None
+    ]
+    if missing:
+        LOGGER.warning(
+            "TemplateFlow does not provide transforms between %s and %s: "
+            "registering to all templates directly.",
+            hub_template,
+            ", ".join(missing),
+        )
+        chained = []
+
+    if registration_resolution is not None:
+        # Only check the templates the T1w is actually registered to
+        registered = set(chained) if hub_qc else set()
+        registered |= {hub_template} if chained else set(templates)
+        unavailable = [
+            tpl
+            for tpl in registered
+            if "res" in get_template_metadata(tpl)
+            and registration_resolution
+            not in {int(res) for res in get_template_metadata(tpl)["res"]}
+        ]
+        if unavailable:
+            raise ValueError(
+                "Resolution %d is not available for template(s): %s."
+                % (registration_resolution, ", ".join(sorted(unavailable)))
+            )
+
     if templates:
         workflow.__desc__ = """\
 Volume-based spatial normalization to {targets} ({targets_id}) was performed through
@@ -132,7 +230,7 @@ nonlinear registration with `antsRegistration` (ANTs {ants_ver}),
 using brain-extracted versions of both T1w reference and the T1w template.
 The following template{tpls} selected for spatial normalization:
 """.format(
-            ants_ver=ANTsInfo.version() or "(version unknown)",
+            ants_ver=ants_version() or "(version unknown)",
             targets="%s standard space%s"
             % (
                 defaultdict(
@@ -146,7 +244,7 @@ The following template{tpls} selected for spatial normalization:
 
         # Append template citations to description
         for template in templates:
-            template_meta = get_metadata(template.split(":")[0])
+            template_meta = get_template_metadata(template)
             template_refs = ["@%s" % template.split(":")[0].lower()]
 
             if template_meta.get("RRID", None):
@@ -160,6 +258,13 @@ The following template{tpls} selected for spatial normalization:
             )
             workflow.__desc__ += ".\n" if template == templates[-1] else ", "
 
+        if chained:
+            workflow.__desc__ += """\
+The T1w reference was registered only to {hub}, and the normalization to
+{others} was obtained by concatenating the resulting transform with the
+template-to-template transforms distributed with TemplateFlow.
+""".format(hub=hub_template, others=", ".join(chained))
+
     inputnode = pe.Node(
         niu.IdentityInterface(
             fields=[
@@ -174,9 +279,15 @@ The following template{tpls} selected for spatial normalization:
         ),
         name="inputnode",
     )
-    inputnode.iterables = [("template", templates)]
+    if chained:
+        # Iterate over templates downstream of the (single) registration to the hub
+        tplsource = pe.Node(niu.IdentityInterface(fields=["template"]), name="tplsource")
+    else:
+        tplsource = inputnode
+    tplsource.iterables = [("template", templates)]
 
     out_fields = [
+        "anat2std_warp",
         "anat2std_xfm",
         "standardized",
         "std2anat_xfm",
@@ -211,71 +322,250 @@ The following template{tpls} selected for spatial normalization:
         n_procs=omp_nthreads,
         mem_gb=2,
     )
+    if registration_presets:
+        reg_settings = pe.Node(
+            niu.Function(function=_registration_settings),
+            name="reg_settings",
+            run_without_submitting=True,
+        )
+        # Settings are passed by content, so that edits of user presets rerun registration
+        reg_settings.inputs.presets = preset_settings
+        if chained:
+            reg_settings.inputs.template = hub_template
+        else:
+            workflow.connect(tplsource, "template", reg_settings, "template")
+        workflow.connect(reg_settings, "out", registration, "settings")
+
+    if chained:
+        hub_name, *hub_spec = hub_template.split(":")
+        registration.inputs.template = hub_name
+        registration.inputs.template_spec = _set_resolution(
+            dict(s.split("-", 1) for s in hub_spec), registration_resolution
+        )
 
-    # Resample T1w-space inputs
-    tpl_moving = pe.Node(
-        ApplyTransforms(
+    # Compose the transform into a displacements field once, so that resampling
+    # onto the template does not have to evaluate the composite transform each time
+    std_warp = pe.Node(
+        ants.ApplyTransforms(
             dimension=3,
-            default_value=0,
             float=True,
-            interpolation="LanczosWindowedSinc",
-        ),
-        name="tpl_moving",
-    )
-
-    std_mask = pe.Node(ApplyTransforms(interpolation="MultiLabel"), name="std_mask")
-    std_dseg = pe.Node(ApplyTransforms(interpolation="MultiLabel"), name="std_dseg")
-
-    std_tpms = pe.MapNode(
-        ApplyTransforms(
-            dimension=3, default_value=0, float=True, interpolation="Gaussian"
+            print_out_composite_warp_file=True,
+            output_image="anat2std_warp.nii",
         ),
-        iterfield=["input_image"],
-        name="std_tpms",
+        name="std_warp",
     )
 
     # fmt:off
     workflow.connect([
-        (inputnode, split_desc, [('template', 'template')]),
-        (inputnode, poutputnode, [('template', 'template')]),
+        (tplsource, split_desc, [('template', 'template')]),
+        (tplsource, poutputnode, [('template', 'template')]),
         (inputnode, trunc_mov, [('moving_image', 'op1')]),
         (inputnode, registration, [
             ('moving_mask', 'moving_mask'),
             ('lesion_mask', 'lesion_mask')]),
-        (inputnode, tpl_moving, [('moving_image', 'input_image')]),
-        (inputnode, std_mask, [('moving_mask', 'input_image')]),
         (split_desc, tf_select, [('name', 'template'),
                                  ('spec', 'template_spec')]),
-        (split_desc, registration, [('name', 'template'),
-                                    ('spec', 'template_spec')]),
-        (tf_select, tpl_moving, [('t1w_file', 'reference_image')]),
-        (tf_select, std_mask, [('t1w_file', 'reference_image')]),
-        (tf_select, std_dseg, [('t1w_file', 'reference_image')]),
-        (tf_select, std_tpms, [('t1w_file', 'reference_image')]),
         (trunc_mov, registration, [
             ('output_image', 'moving_image')]),
-        (registration, tpl_moving, [('composite_transform', 'transforms')]),
-        (registration, std_mask, [('composite_transform', 'transforms')]),
-        (inputnode, std_dseg, [('moving_segmentation', 'input_image')]),
-        (registration, std_dseg, [('composite_transform', 'transforms')]),
-        (inputnode, std_tpms, [('moving_tpms', 'input_image')]),
-        (registration, std_tpms, [('composite_transform', 'transforms')]),
-        (registration, poutputnode, [
-            ('composite_transform', 'anat2std_xfm'),
-            ('inverse_composite_transform', 'std2anat_xfm')]),
-        (tpl_moving, poutputnode, [('output_image', 'standardized')]),
-        (std_mask, poutputnode, [('output_image', 'std_mask')]),
-        (std_dseg, poutputnode, [('output_image', 'std_dseg')]),
-        (std_tpms, poutputnode, [('output_image', 'std_tpms')]),
+        (tf_select, std_warp, [('t1w_file', 'input_image'),
+                               ('t1w_file', 'reference_image')]),
+        (std_warp, poutputnode, [('output_image', 'anat2std_warp')]),
         (split_desc, poutputnode, [('spec', 'template_spec')]),
     ])
     # fmt:on
 
+    if chained:
+        chain_xfms = pe.Node(
+            niu.Function(
+                function=_chain_xfms, output_names=["anat2std_xfm", "std2anat_xfm"]
+            ),
+            name="chain_xfms",
+        )
+        chain_xfms.inputs.hub = hub_template
+
+        # fmt:off
+        workflow.connect([
+            (tplsource, chain_xfms, [('template', 'template')]),
+            (registration, chain_xfms, [
+                ('composite_transform', 'anat2hub_xfm'),
+                ('inverse_composite_transform', 'hub2anat_xfm')]),
+            (chain_xfms, std_warp, [('anat2std_xfm', 'transforms')]),
+            (chain_xfms, poutputnode, [('anat2std_xfm', 'anat2std_xfm'),
+                                       ('std2anat_xfm', 'std2anat_xfm')]),
+        ])
+        # fmt:on
+    else:
+        # fmt:off
+        workflow.connect([
+            (split_desc, registration, [
+                ('name', 'template'),
+                (('spec', _set_resolution, registration_resolution), 'template_spec')]),
+            (registration, std_warp, [('composite_transform', 'transforms')]),
+            (registration, poutputnode, [
+                ('composite_transform', 'anat2std_xfm'),
+                ('inverse_composite_transform', 'std2anat_xfm')]),
+        ])
+        # fmt:on
+
+    if chained and hub_qc:
+        # Compare the chained transforms with direct registrations
+        qc_source = pe.Node(niu.IdentityInterface(fields=["template"]), name="qc_source")
+        qc_source.iterables = [("template", chained)]
+        qc_desc = pe.Node(TemplateDesc(), run_without_submitting=True, name="qc_desc")
+        qc_select = pe.Node(
+            TemplateFlowSelect(resolution=1 + debug),
+            name="qc_select",
+            run_without_submitting=True,
+        )
+        qc_registration = pe.Node(
+            SpatialNormalization(
+                float=True,
+                flavor=["precise", "testing"][debug],
+            ),
+            name="qc_registration",
+            n_procs=omp_nthreads,
+            mem_gb=2,
+        )
+        if registration_presets:
+            qc_settings = pe.Node(
+                niu.Function(function=_registration_settings),
+                name="qc_settings",
+                run_without_submitting=True,
+            )
+            qc_settings.inputs.presets = preset_settings
+            # fmt:off
+            workflow.connect([
+                (qc_source, qc_settings, [('template', 'template')]),
+                (qc_settings, qc_registration, [('out', 'settings')]),
+            ])
+            # fmt:on
+        qc_chain = pe.Node(
+            niu.Function(
+                function=_chain_xfms, output_names=["anat2std_xfm", "std2anat_xfm"]
+            ),
+            name="qc_chain",
+        )
+        qc_chain.inputs.hub = hub_template
+        chain_qc = pe.Node(niu.Function(function=_chain_qc), name="chain_qc", mem_gb=2)
+        chain_qc.inputs.hub = hub_template
+        qc_outputnode = pe.Node(
+            niu.IdentityInterface(fields=["chain_qc", "template"]), name="qc_outputnode"
+        )
+
+        # fmt:off
+        workflow.connect([
+            (inputnode, qc_registration, [
+                ('moving_mask', 'moving_mask'),
+                ('lesion_mask', 'lesion_mask')]),
+            (trunc_mov, qc_registration, [('output_image', 'moving_image')]),
+            (qc_source, qc_desc, [('template', 'template')]),
+            (qc_source, qc_chain, [('template', 'template')]),
+            (qc_source, chain_qc, [('template', 'template')]),
+            (qc_source, qc_outputnode, [('template', 'template')]),
+            (qc_desc, qc_select, [('name', 'template'),
+                                  ('spec', 'template_spec')]),
+            (qc_desc, qc_registration, [
+                ('name', 'template'),
+                (('spec', _set_resolution, registration_resolution), 'template_spec')]),
+            (registration, qc_chain, [
+                ('composite_transform', 'anat2hub_xfm'),
+                ('inverse_composite_transform', 'hub2anat_xfm')]),
+            (qc_select, chain_qc, [('t1w_file', 'reference'),
+                                   ('brain_mask', 'mask')]),
+            (qc_chain, chain_qc, [('anat2std_xfm', 'chained_xfm')]),
+            (qc_registration, chain_qc, [('composite_transform', 'direct_xfm')]),
+            (chain_qc, qc_outputnode, [('out', 'chain_qc')]),
+        ])
+        # fmt:on
+
+    if batch_resampling:
+        # Resample T1w-space inputs, reading the transform once
+        merge_moving = pe.Node(
+            niu.Merge(4, ravel_inputs=True), name="merge_moving", run_without_submitting=True
+        )
+        std_resample = pe.Node(
+            MultiApplyTransforms(
+                # T1w, mask, segmentation, and three tissue probability maps
+                interpolation=["LanczosWindowedSinc"]
+                + ["MultiLabel"] * 2
+                + ["Gaussian"] * 3,
+                num_threads=omp_nthreads,
+            ),
+            name="std_resample",
+            n_procs=omp_nthreads,
+            mem_gb=2,
+        )
+        split_std = pe.Node(
+            niu.Split(splits=[1, 1, 1, 3], squeeze=True),
+            name="split_std",
+            run_without_submitting=True,
+        )
+
+        # fmt:off
+        workflow.connect([
+            (inputnode, merge_moving, [('moving_image', 'in1'),
+                                       ('moving_mask', 'in2'),
+                                       ('moving_segmentation', 'in3'),
+                                       ('moving_tpms', 'in4')]),
+            (merge_moving, std_resample, [('out', 'input_images')]),
+            (tf_select, std_resample, [('t1w_file', 'reference_image')]),
+            (std_warp, std_resample, [('output_image', 'transforms')]),
+            (std_resample, split_std, [('output_images', 'inlist')]),
+            (split_std, poutputnode, [('out1', 'standardized'),
+                                      ('out2', 'std_mask'),
+                                      ('out3', 'std_dseg'),
+                                      ('out4', 'std_tpms')]),
+        ])
+        # fmt:on
+    else:
+        # Resample T1w-space inputs
+        tpl_moving = pe.Node(
+            ApplyTransforms(
+                dimension=3,
+                default_value=0,
+                float=True,
+                interpolation="LanczosWindowedSinc",
+            ),
+            name="tpl_moving",
+        )
+
+        std_mask = pe.Node(ApplyTransforms(interpolation="MultiLabel"), name="std_mask")
+        std_dseg = pe.Node(ApplyTransforms(interpolation="MultiLabel"), name="std_dseg")
+
+        std_tpms = pe.MapNode(
+            ApplyTransforms(
+                dimension=3, default_value=0, float=True, interpolation="Gaussian"
+            ),
+            iterfield=["input_image"],
+            name="std_tpms",
+        )
+
+        # fmt:off
+        workflow.connect([
+            (inputnode, tpl_moving, [('moving_image', 'input_image')]),
+            (inputnode, std_mask, [('moving_mask', 'input_image')]),
+            (tf_select, tpl_moving, [('t1w_file', 'reference_image')]),
+            (tf_select, std_mask, [('t1w_file', 'reference_image')]),
+            (tf_select, std_dseg, [('t1w_file', 'reference_image')]),
+            (tf_select, std_tpms, [('t1w_file', 'reference_image')]),
+            (std_warp, tpl_moving, [('output_image', 'transforms')]),
+            (std_warp, std_mask, [('output_image', 'transforms')]),
+            (inputnode, std_dseg, [('moving_segmentation', 'input_image')]),
+            (std_warp, std_dseg, [('output_image', 'transforms')]),
+            (inputnode, std_tpms, [('moving_tpms', 'input_image')]),
+            (std_warp, std_tpms, [('output_image', 'transforms')]),
+            (tpl_moving, poutputnode, [('output_image', 'standardized')]),
+            (std_mask, poutputnode, [('output_image', 'std_mask')]),
+            (std_dseg, poutputnode, [('output_image', 'std_dseg')]),
+            (std_tpms, poutputnode, [('output_image', 'std_tpms')]),
+        ])
+        # fmt:on
+
     # Provide synchronized output
     outputnode = pe.JoinNode(
         niu.IdentityInterface(fields=out_fields),
         name="outputnode",
-        joinsource="inputnode",
+        joinsource=tplsource.name,
     )
     # fmt:off
     workflow.connect([
@@ -284,3 +574,58 @@ The following template{tpls} selected for spatial normalization:
     # fmt:on
 
     return workflow
+
+
+def _set_resolution(spec, resolution):
+    """
+    Set the resolution of the template images used as registration targets.
+
+    >>> _set_resolution({"cohort": "1"}, 2)
+    {'cohort': '1', 'res': 2}
+    >>> _set_resolution({"cohort": "1"}, None)
+    {'cohort': '1'}
+
+    """
+    if resolution is None:
+        return spec
+    return {**spec, "res": resolution}
+
+
+def _registration_settings(template, presets):
+    """Write the settings files of the registration preset of a template."""
+    from smriprep.utils.registration import select_preset, write_preset
+
+    return write_preset(select_preset(template, presets))
+
+
+def _chain_xfms(template, hub, anat2hub_xfm, hub2anat_xfm):
+    """Concatenate the registration to the hub with TemplateFlow's transforms."""
+    if template == hub:
+        return anat2hub_xfm, hub2anat_xfm
+
+    from pathlib import Path
+    from smriprep.interfaces.resampling import concat_composites
+    from smriprep.utils.templates import get_template_xfm
+
+    anat2std_xfm = concat_composites(
+        [anat2hub_xfm, get_template_xfm(template, hub, fetch=True)],
+        Path("anat2std_xfm.h5").absolute(),
+    )
+    std2anat_xfm = concat_composites(
+        [get_template_xfm(hub, template, fetch=True), hub2anat_xfm],
+        Path("std2anat_xfm.h5").absolute(),
+    )
+    return anat2std_xfm, std2anat_xfm
+
+
+def _chain_qc(template, hub, reference, mask, chained_xfm, direct_xfm):
+    """Write the discrepancies between chained and direct normalizations."""
+    from json import dumps
+    from pathlib import Path
+    from smriprep.interfaces.resampling import compare_transforms
+
+    report = {"Template": template, "Hub": hub, "Units": "mm"}
+    report.update(compare_transforms(reference, [chained_xfm], [direct_xfm], mask=mask))
+    out_file = Path("chain_qc.json").absolute()
+    out_file.write_text(dumps(report, indent=2))
+    return str(out_file)
@@ -27,11 +27,14 @@ from niworkflows.interfaces.nibabel import ApplyMask
 from niworkflows.engine.workflows import LiterateWorkflow as Workflow
 
 from ..interfaces import DerivativesDataSink
+from ..utils.templates import get_surface_targets
 
 BIDS_TISSUE_ORDER = ("GM", "WM", "CSF")
 
 
-def init_anat_reports_wf(*, freesurfer, output_dir, name="anat_reports_wf"):
+def init_anat_reports_wf(
+    *, freesurfer, output_dir, hub_qc=False, low_mem=False, name="anat_reports_wf"
+):
     """
     Set up a battery of datasinks to store reports in the right location.
 
@@ -39,6 +42,12 @@ def init_anat_reports_wf(*, freesurfer, output_dir, name="anat_reports_wf"):
     ----------
     freesurfer : :obj:`bool`
         FreeSurfer was enabled
+    hub_qc : :obj:`bool`
+        Spatial normalization compared chained and direct transforms (see
+        :py:func:`~smriprep.workflows.norm.init_anat_norm_wf`): store the
+        discrepancies, given through ``qc_inputnode``
+    low_mem : :obj:`bool`
+        Generate intermediate images in single precision and uncompressed
     output_dir : :obj:`str`
         Directory in which to save derivatives
     name : :obj:`str`
@@ -68,6 +77,16 @@ def init_anat_reports_wf(*, freesurfer, output_dir, name="anat_reports_wf"):
     template
         Template space and specifications
 
+    With ``hub_qc``, ``qc_inputnode`` takes the following inputs (one per chained
+    template, separately from ``inputnode`` so as not to multiply its iterations):
+
+    source_file
+        Input T1w image
+    chain_qc
+        JSON file with the discrepancies between chained and direct transforms
+    template
+        Chained template
+
     """
     from niworkflows.interfaces.reportlets.registration import (
         SimpleBeforeAfterRPT as SimpleBeforeAfter,
@@ -138,10 +157,12 @@ def init_anat_reports_wf(*, freesurfer, output_dir, name="anat_reports_wf"):
         niu.Function(
             function=_rpt_masks,
             output_names=["before", "after"],
-            input_names=["mask_file", "before", "after", "after_mask"],
+            input_names=["mask_file", "before", "after", "after_mask", "low_mem"],
         ),
         name="norm_msk",
+        mem_gb=0.1 if low_mem else 0.2,
     )
+    norm_msk.inputs.low_mem = low_mem
     norm_rpt = pe.Node(SimpleBeforeAfter(), name="norm_rpt", mem_gb=0.1)
     norm_rpt.inputs.after_label = "Participant"  # after
 
@@ -193,6 +214,26 @@ def init_anat_reports_wf(*, freesurfer, output_dir, name="anat_reports_wf"):
         ])
         # fmt:on
 
+    if hub_qc:
+        qc_inputnode = pe.Node(
+            niu.IdentityInterface(fields=["source_file", "chain_qc", "template"]),
+            name="qc_inputnode",
+        )
+        ds_chain_qc = pe.Node(
+            DerivativesDataSink(
+                base_directory=output_dir, desc="chaining", datatype="figures"
+            ),
+            name="ds_chain_qc",
+            run_without_submitting=True,
+        )
+        # fmt:off
+        workflow.connect([
+            (qc_inputnode, ds_chain_qc, [('source_file', 'source_file'),
+                                         ('chain_qc', 'in_file'),
+                                         (('template', _fmt), 'space')]),
+        ])
+        # fmt:on
+
     return workflow
 
 
@@ -204,6 +245,8 @@ def init_anat_derivatives_wf(
     output_dir,
     spaces,
     name="anat_derivatives_wf",
+    norm_resolution=None,
+    batch_resampling=False,
     tpm_labels=BIDS_TISSUE_ORDER,
 ):
     """
@@ -221,6 +264,18 @@ def init_anat_derivatives_wf(
         Directory in which to save derivatives
     name : :obj:`str`
         Workflow name (default: anat_derivatives_wf)
+    norm_resolution : :obj:`int` or None
+        Resolution (index) of the template grids onto which spatial normalization
+        resampled ``std_mask``, ``std_dseg`` and ``std_tpms``.
+        These are written out directly (instead of resampled again) for output
+        spaces of the same resolution.
+        If ``None``, all outputs are resampled.
+    batch_resampling : :obj:`bool`
+        Spatial normalization resampled ``std_mask``, ``std_dseg`` and ``std_tpms``
+        with the approximate interpolators of
+        :py:class:`~smriprep.interfaces.resampling.MultiApplyTransforms`.
+        These are never written out: all outputs are resampled with
+        ``antsApplyTransforms`` (i.e., ``norm_resolution`` is ignored).
     tpm_labels : :obj:`tuple`
         Tissue probability maps in order
 
@@ -244,6 +299,9 @@ def init_anat_derivatives_wf(
     anat2std_xfm
         Nonlinear spatial transform to resample imaging data given in anatomical space
         into standard space.
+    anat2std_warp
+        The ``anat2std_xfm`` transforms composed into displacements fields on the
+        grids of spatial normalization.
     std2anat_xfm
         Inverse transform of ``anat2std_xfm``
     std_t1w
@@ -266,10 +324,16 @@ def init_anat_derivatives_wf(
         FreeSurfer's aseg segmentation, in native T1w space
     t1w_fs_aparc
         FreeSurfer's aparc+aseg segmentation, in native T1w space
+    t1w_fs_aparc_a2009s
+        FreeSurfer's aparc.a2009s+aseg segmentation, in native T1w space
+    t1w_fs_aparc_dkt
+        FreeSurfer's aparc.DKTatlas+aseg segmentation, in native T1w space
+    t1w_fs_wmparc
+        FreeSurfer's wmparc segmentation, in native T1w space
+    surface_maps
+        Cortical thickness, curvature and sulcal depth resampled onto standard surfaces
 
     """
-    from niworkflows.interfaces.utility import KeySelect
-
     workflow = Workflow(name=name)
 
     inputnode = pe.Node(
@@ -283,12 +347,20 @@ def init_anat_derivatives_wf(
                 "t1w_dseg",
                 "t1w_tpms",
                 "anat2std_xfm",
+                "anat2std_warp",
                 "std2anat_xfm",
+                "std_mask",
+                "std_dseg",
+                "std_tpms",
                 "t1w2fsnative_xfm",
                 "fsnative2t1w_xfm",
                 "surfaces",
                 "t1w_fs_aseg",
                 "t1w_fs_aparc",
+                "t1w_fs_aparc_a2009s",
+                "t1w_fs_aparc_dkt",
+                "t1w_fs_wmparc",
+                "surface_maps",
             ]
         ),
         name="inputnode",
@@ -399,158 +471,29 @@ def init_anat_derivatives_wf(
 
     # Write derivatives in standard spaces specified by --output-spaces
     if getattr(spaces, "_cached") is not None and spaces.cached.references:
-        from niworkflows.interfaces.space import SpaceDataSource
-        from niworkflows.interfaces.nibabel import GenerateSamplingReference
-        from niworkflows.interfaces.fixes import (
-            FixHeaderApplyTransforms as ApplyTransforms,
-        )
-
-        from ..interfaces.templateflow import TemplateFlowSelect
-
-        spacesource = pe.Node(
-            SpaceDataSource(), name="spacesource", run_without_submitting=True
-        )
-        spacesource.iterables = (
-            "in_tuple",
-            [(s.fullname, s.spec) for s in spaces.cached.get_standard(dim=(3,))],
-        )
-
-        gen_tplid = pe.Node(
-            niu.Function(function=_fmt_cohort),
-            name="gen_tplid",
-            run_without_submitting=True,
-        )
-
-        select_xfm = pe.Node(
-            KeySelect(fields=["anat2std_xfm"]),
-            name="select_xfm",
-            run_without_submitting=True,
-        )
-        select_tpl = pe.Node(
-            TemplateFlowSelect(), name="select_tpl", run_without_submitting=True
-        )
-
-        gen_ref = pe.Node(GenerateSamplingReference(), name="gen_ref", mem_gb=0.01)
-
-        # Mask T1w preproc images
-        mask_t1w = pe.Node(ApplyMask(), name='mask_t1w')
-
-        # Resample T1w-space inputs
-        anat2std_t1w = pe.Node(
-            ApplyTransforms(
-                dimension=3,
-                default_value=0,
-                float=True,
-                interpolation="LanczosWindowedSinc",
-            ),
-            name="anat2std_t1w",
-        )
-
-        anat2std_mask = pe.Node(
-            ApplyTransforms(interpolation="MultiLabel"), name="anat2std_mask"
-        )
-        anat2std_dseg = pe.Node(
-            ApplyTransforms(interpolation="MultiLabel"), name="anat2std_dseg"
-        )
-        anat2std_tpms = pe.MapNode(
-            ApplyTransforms(
-                dimension=3, default_value=0, float=True, interpolation="Gaussian"
-            ),
-            iterfield=["input_image"],
-            name="anat2std_tpms",
-        )
-
-        ds_std_t1w = pe.Node(
-            DerivativesDataSink(
-                base_directory=output_dir,
-                desc="preproc",
-                compress=True,
-            ),
-            name="ds_std_t1w",
-            run_without_submitting=True,
-        )
-        ds_std_t1w.inputs.SkullStripped = True
-
-        ds_std_mask = pe.Node(
-            DerivativesDataSink(
-                base_directory=output_dir, desc="brain", suffix="mask", compress=True
-            ),
-            name="ds_std_mask",
-            run_without_submitting=True,
-        )
-        ds_std_mask.inputs.Type = "Brain"
-
-        ds_std_dseg = pe.Node(
-            DerivativesDataSink(
-                base_directory=output_dir, suffix="dseg", compress=True
-            ),
-            name="ds_std_dseg",
-            run_without_submitting=True,
-        )
-
-        ds_std_tpms = pe.Node(
-            DerivativesDataSink(
-                base_directory=output_dir, suffix="probseg", compress=True
-            ),
-            name="ds_std_tpms",
-            run_without_submitting=True,
-        )
-
-        # CRITICAL: the sequence of labels here (CSF-GM-WM) is that of the output of FSL-FAST
-        #           (intensity mean, per tissue). This order HAS to be matched also by the ``tpms``
-        #           output in the data/io_spec.json file.
-        ds_std_tpms.inputs.label = tpm_labels
-        # fmt:off
-        workflow.connect([
-            (inputnode, mask_t1w, [('t1w_preproc', 'in_file'),
-                                   ('t1w_mask', 'in_mask')]),
-            (mask_t1w, anat2std_t1w, [('out_file', 'input_image')]),
-            (inputnode, anat2std_mask, [('t1w_mask', 'input_image')]),
-            (inputnode, anat2std_dseg, [('t1w_dseg', 'input_image')]),
-            (inputnode, anat2std_tpms, [('t1w_tpms', 'input_image')]),
-            (inputnode, gen_ref, [('t1w_preproc', 'moving_image')]),
-            (inputnode, select_xfm, [
-                ('anat2std_xfm', 'anat2std_xfm'),
-                ('template', 'keys')]),
-            (spacesource, gen_tplid, [('space', 'template'),
-                                      ('cohort', 'cohort')]),
-            (gen_tplid, select_xfm, [('out', 'key')]),
-            (spacesource, select_tpl, [('space', 'template'),
-                                       ('cohort', 'cohort'),
-                                       (('resolution', _no_native), 'resolution')]),
-            (spacesource, gen_ref, [(('resolution', _is_native), 'keep_native')]),
-            (select_tpl, gen_ref, [('t1w_file', 'fixed_image')]),
-            (anat2std_t1w, ds_std_t1w, [('output_image', 'in_file')]),
-            (anat2std_mask, ds_std_mask, [('output_image', 'in_file')]),
-            (anat2std_dseg, ds_std_dseg, [('output_image', 'in_file')]),
-            (anat2std_tpms, ds_std_tpms, [('output_image', 'in_file')]),
-            (select_tpl, ds_std_mask, [(('brain_mask', _drop_path), 'RawSources')]),
-        ])
-
-        workflow.connect(
-            # Connect apply transforms nodes
-            [
-                (gen_ref, n, [('out_file', 'reference_image')])
-                for n in (anat2std_t1w, anat2std_mask, anat2std_dseg, anat2std_tpms)
-            ]
-            + [
-                (select_xfm, n, [('anat2std_xfm', 'transforms')])
-                for n in (anat2std_t1w, anat2std_mask, anat2std_dseg, anat2std_tpms)
-            ]
-            # Connect the source_file input of these datasinks
-            + [
-                (inputnode, n, [('source_files', 'source_file')])
-                for n in (ds_std_t1w, ds_std_mask, ds_std_dseg, ds_std_tpms)
-            ]
-            # Connect the space input of these datasinks
-            + [
-                (spacesource, n, [
-                    ('space', 'space'), ('cohort', 'cohort'), ('resolution', 'resolution')
-                ])
-                for n in (ds_std_t1w, ds_std_mask, ds_std_dseg, ds_std_tpms)
-            ]
-        )
-        # fmt:on
+        # Spaces on the grid of spatial normalization reuse its outputs,
+        # other spaces (i.e., resolutions) are resampled here
+        std_spaces = spaces.cached.get_standard(dim=(3,))
+        if batch_resampling:
+            norm_resolution = None
+        norm_spaces = [
+            s for s in std_spaces
+            if norm_resolution is not None and _is_norm_grid(s.spec, norm_resolution)
+        ]
+        for suffix, group in (
+            ("", [s for s in std_spaces if s not in norm_spaces]),
+            ("_norm", norm_spaces),
+        ):
+            if group:
+                _connect_std_derivatives(
+                    workflow,
+                    inputnode,
+                    [(s.fullname, s.spec) for s in group],
+                    output_dir=output_dir,
+                    tpm_labels=tpm_labels,
+                    reuse_norm=bool(suffix),
+                    suffix=suffix,
+                )
 
     if not freesurfer:
         return workflow
@@ -614,6 +557,27 @@ def init_anat_derivatives_wf(
         name="ds_t1w_fsparc",
         run_without_submitting=True,
     )
+    ds_t1w_fsa2009s = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir, desc="aparca2009s", suffix="dseg", compress=True
+        ),
+        name="ds_t1w_fsa2009s",
+        run_without_submitting=True,
+    )
+    ds_t1w_fsdkt = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir, desc="aparcdkt", suffix="dseg", compress=True
+        ),
+        name="ds_t1w_fsdkt",
+        run_without_submitting=True,
+    )
+    ds_t1w_fswmparc = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir, desc="wmparc", suffix="dseg", compress=True
+        ),
+        name="ds_t1w_fswmparc",
+        run_without_submitting=True,
+    )
 
     # fmt:off
     workflow.connect([
@@ -632,8 +596,42 @@ def init_anat_derivatives_wf(
                                     ('source_files', 'source_file')]),
         (inputnode, ds_t1w_fsparc, [('t1w_fs_aparc', 'in_file'),
                                     ('source_files', 'source_file')]),
+        (inputnode, ds_t1w_fsa2009s, [('t1w_fs_aparc_a2009s', 'in_file'),
+                                      ('source_files', 'source_file')]),
+        (inputnode, ds_t1w_fsdkt, [('t1w_fs_aparc_dkt', 'in_file'),
+                                   ('source_files', 'source_file')]),
+        (inputnode, ds_t1w_fswmparc, [('t1w_fs_wmparc', 'in_file'),
+                                      ('source_files', 'source_file')]),
     ])
     # fmt:on
+
+    if get_surface_targets(spaces):
+        name_surf_maps = pe.MapNode(
+            Path2BIDS(
+                pattern=r"(?P<hemi>[lr])h\.(?P<suffix>\w+)_space-(?P<space>[a-zA-Z0-9]+)"
+                r"_den-(?P<density>[a-zA-Z0-9]+)(?P<extprefix>\.\w+)?"
+            ),
+            iterfield="in_file",
+            name="name_surf_maps",
+            run_without_submitting=True,
+        )
+        ds_surf_maps = pe.MapNode(
+            DerivativesDataSink(base_directory=output_dir, extension=".shape.gii"),
+            iterfield=["in_file", "hemi", "space", "density", "suffix"],
+            name="ds_surf_maps",
+            run_without_submitting=True,
+        )
+        # fmt:off
+        workflow.connect([
+            (inputnode, name_surf_maps, [('surface_maps', 'in_file')]),
+            (inputnode, ds_surf_maps, [('surface_maps', 'in_file'),
+                                       ('source_files', 'source_file')]),
+            (name_surf_maps, ds_surf_maps, [('hemi', 'hemi'),
+                                            ('space', 'space'),
+                                            ('density', 'density'),
+                                            ('suffix', 'suffix')]),
+        ])
+        # fmt:on
     return workflow
 
 
@@ -646,23 +644,27 @@ def _bids_relative(in_files, bids_root):
     return in_files
 
 
-def _rpt_masks(mask_file, before, after, after_mask=None):
+def _rpt_masks(mask_file, before, after, after_mask=None, low_mem=False):
     from os.path import abspath
+    import numpy as np
     import nibabel as nb
 
-    msk = nb.load(mask_file).get_fdata() > 0
+    # With low_mem, load single-precision data and skip compression
+    dtype, ext = ("float32", "nii") if low_mem else ("float64", "nii.gz")
+    msk = np.asanyarray(nb.load(mask_file).dataobj) > 0
     bnii = nb.load(before)
-    nb.Nifti1Image(bnii.get_fdata() * msk, bnii.affine, bnii.header).to_filename(
-        "before.nii.gz"
-    )
+    data = bnii.get_fdata(dtype=dtype)
+    data *= msk
+    nb.Nifti1Image(data, bnii.affine, bnii.header).to_filename(f"before.{ext}")
+    del data
     if after_mask is not None:
-        msk = nb.load(after_mask).get_fdata() > 0
+        msk = np.asanyarray(nb.load(after_mask).dataobj) > 0
 
     anii = nb.load(after)
-    nb.Nifti1Image(anii.get_fdata() * msk, anii.affine, anii.header).to_filename(
-        "after.nii.gz"
-    )
-    return abspath("before.nii.gz"), abspath("after.nii.gz")
+    data = anii.get_fdata(dtype=dtype)
+    data *= msk
+    nb.Nifti1Image(data, anii.affine, anii.header).to_filename(f"after.{ext}")
+    return abspath(f"before.{ext}"), abspath(f"after.{ext}")
 
 
 def _drop_cohort(in_template):
@@ -701,6 +703,236 @@ def _empty_report(in_file=None):
     return str(out_file)
 
 
+def _connect_std_derivatives(
+    workflow, inputnode, std_spaces, *, output_dir, tpm_labels, reuse_norm, suffix=""
+):
+    """
+    Write derivatives in a group of standard spaces.
+
+    The T1w is always resampled.
+    If ``reuse_norm`` is set, the mask, segmentation and tissue probability maps
+    are taken from the outputs of spatial normalization (``std_*`` inputs), which
+    must share the grid of these spaces, and the T1w is resampled through the
+    displacements field of normalization (``anat2std_warp``).
+    Otherwise, the transform is composed into a displacements field on the grid of
+    each space, through which all images are resampled.
+    Names of nodes are suffixed with ``suffix``.
+
+    """
+    from nipype.interfaces import ants
+    from niworkflows.interfaces.space import SpaceDataSource
+    from niworkflows.interfaces.nibabel import GenerateSamplingReference
+    from niworkflows.interfaces.fixes import (
+        FixHeaderApplyTransforms as ApplyTransforms,
+    )
+    from niworkflows.interfaces.utility import KeySelect
+
+    from ..interfaces.templateflow import TemplateFlowSelect
+
+    spacesource = pe.Node(
+        SpaceDataSource(), name=f"spacesource{suffix}", run_without_submitting=True
+    )
+    spacesource.iterables = ("in_tuple", std_spaces)
+
+    gen_tplid = pe.Node(
+        niu.Function(function=_fmt_cohort),
+        name=f"gen_tplid{suffix}",
+        run_without_submitting=True,
+    )
+
+    select_xfm = pe.Node(
+        KeySelect(fields=["anat2std_xfm"]),
+        name=f"select_xfm{suffix}",
+        run_without_submitting=True,
+    )
+    select_tpl = pe.Node(
+        TemplateFlowSelect(), name=f"select_tpl{suffix}", run_without_submitting=True
+    )
+
+    gen_ref = pe.Node(GenerateSamplingReference(), name=f"gen_ref{suffix}", mem_gb=0.01)
+
+    # Mask T1w preproc images
+    mask_t1w = pe.Node(ApplyMask(), name=f"mask_t1w{suffix}")
+
+    # Resample T1w-space inputs
+    anat2std_t1w = pe.Node(
+        ApplyTransforms(
+            dimension=3,
+            default_value=0,
+            float=True,
+            interpolation="LanczosWindowedSinc",
+        ),
+        name=f"anat2std_t1w{suffix}",
+    )
+
+    ds_std_t1w = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir,
+            desc="preproc",
+            compress=True,
+        ),
+        name=f"ds_std_t1w{suffix}",
+        run_without_submitting=True,
+    )
+    ds_std_t1w.inputs.SkullStripped = True
+
+    ds_std_mask = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir, desc="brain", suffix="mask", compress=True
+        ),
+        name=f"ds_std_mask{suffix}",
+        run_without_submitting=True,
+    )
+    ds_std_mask.inputs.Type = "Brain"
+
+    ds_std_dseg = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir, suffix="dseg", compress=True
+        ),
+        name=f"ds_std_dseg{suffix}",
+        run_without_submitting=True,
+    )
+
+    ds_std_tpms = pe.Node(
+        DerivativesDataSink(
+            base_directory=output_dir, suffix="probseg", compress=True
+        ),
+        name=f"ds_std_tpms{suffix}",
+        run_without_submitting=True,
+    )
+
+    # CRITICAL: the sequence of labels here (CSF-GM-WM) is that of the output of FSL-FAST
+    #           (intensity mean, per tissue). This order HAS to be matched also by the ``tpms``
+    #           output in the data/io_spec.json file.
+    ds_std_tpms.inputs.label = tpm_labels
+    # fmt:off
+    workflow.connect([
+        (inputnode, mask_t1w, [('t1w_preproc', 'in_file'),
+                               ('t1w_mask', 'in_mask')]),
+        (mask_t1w, anat2std_t1w, [('out_file', 'input_image')]),
+        (inputnode, gen_ref, [('t1w_preproc', 'moving_image')]),
+        (inputnode, select_xfm, [
+            ('anat2std_xfm', 'anat2std_xfm'),
+            ('template', 'keys')]),
+        (spacesource, gen_tplid, [('space', 'template'),
+                                  ('cohort', 'cohort')]),
+        (gen_tplid, select_xfm, [('out', 'key')]),
+        (spacesource, select_tpl, [('space', 'template'),
+                                   ('cohort', 'cohort'),
+                                   (('resolution', _no_native), 'resolution')]),
+        (spacesource, gen_ref, [(('resolution', _is_native), 'keep_native')]),
+        (select_tpl, gen_ref, [('t1w_file', 'fixed_image')]),
+        (gen_ref, anat2std_t1w, [('out_file', 'reference_image')]),
+        (anat2std_t1w, ds_std_t1w, [('output_image', 'in_file')]),
+        (select_tpl, ds_std_mask, [(('brain_mask', _drop_path), 'RawSources')]),
+    ])
+
+    workflow.connect(
+        # Connect the source_file input of these datasinks
+        [
+            (inputnode, n, [('source_files', 'source_file')])
+            for n in (ds_std_t1w, ds_std_mask, ds_std_dseg, ds_std_tpms)
+        ]
+        # Connect the space input of these datasinks
+        + [
+            (spacesource, n, [
+                ('space', 'space'), ('cohort', 'cohort'), ('resolution', 'resolution')
+            ])
+            for n in (ds_std_t1w, ds_std_mask, ds_std_dseg, ds_std_tpms)
+        ]
+    )
+    # fmt:on
+
+    if reuse_norm:
+        select_std = pe.Node(
+            KeySelect(fields=["anat2std_warp", "std_mask", "std_dseg", "std_tpms"]),
+            name=f"select_std{suffix}",
+            run_without_submitting=True,
+        )
+        # fmt:off
+        workflow.connect([
+            (inputnode, select_std, [('anat2std_warp', 'anat2std_warp'),
+                                     ('std_mask', 'std_mask'),
+                                     ('std_dseg', 'std_dseg'),
+                                     ('std_tpms', 'std_tpms'),
+                                     ('template', 'keys')]),
+            (gen_tplid, select_std, [('out', 'key')]),
+            (select_std, anat2std_t1w, [('anat2std_warp', 'transforms')]),
+            (select_std, ds_std_mask, [('std_mask', 'in_file')]),
+            (select_std, ds_std_dseg, [('std_dseg', 'in_file')]),
+            (select_std, ds_std_tpms, [('std_tpms', 'in_file')]),
+        ])
+        # fmt:on
+        return
+
+    # Compose the transform once for all images resampled onto this grid
+    anat2std_warp = pe.Node(
+        ants.ApplyTransforms(
+            dimension=3,
+            float=True,
+            print_out_composite_warp_file=True,
+            output_image="anat2std_warp.nii",
+        ),
+        name=f"anat2std_warp{suffix}",
+    )
+    anat2std_mask = pe.Node(
+        ApplyTransforms(interpolation="MultiLabel"), name=f"anat2std_mask{suffix}"
+    )
+    anat2std_dseg = pe.Node(
+        ApplyTransforms(interpolation="MultiLabel"), name=f"anat2std_dseg{suffix}"
+    )
+    anat2std_tpms = pe.MapNode(
+        ApplyTransforms(
+            dimension=3, default_value=0, float=True, interpolation="Gaussian"
+        ),
+        iterfield=["input_image"],
+        name=f"anat2std_tpms{suffix}",
+    )
+
+    # fmt:off
+    workflow.connect([
+        (gen_ref, anat2std_warp, [('out_file', 'input_image'),
+                                  ('out_file', 'reference_image')]),
+        (select_xfm, anat2std_warp, [('anat2std_xfm', 'transforms')]),
+        (inputnode, anat2std_mask, [('t1w_mask', 'input_image')]),
+        (inputnode, anat2std_dseg, [('t1w_dseg', 'input_image')]),
+        (inputnode, anat2std_tpms, [('t1w_tpms', 'input_image')]),
+        (anat2std_mask, ds_std_mask, [('output_image', 'in_file')]),
+        (anat2std_dseg, ds_std_dseg, [('output_image', 'in_file')]),
+        (anat2std_tpms, ds_std_tpms, [('output_image', 'in_file')]),
+    ])
+
+    workflow.connect(
+        [
+            (gen_ref, n, [('out_file', 'reference_image')])
+            for n in (anat2std_mask, anat2std_dseg, anat2std_tpms)
+        ]
+        + [
+            (anat2std_warp, n, [('output_image', 'transforms')])
+            for n in (anat2std_t1w, anat2std_mask, anat2std_dseg, anat2std_tpms)
+        ]
+    )
+    # fmt:on
+
+
+def _is_norm_grid(spec, norm_resolution):
+    """
+    Check whether an output space is sampled on the grid of spatial normalization.
+
+    >>> _is_norm_grid({}, 1)
+    True
+    >>> _is_norm_grid({"res": "01"}, 1)
+    True
+    >>> _is_norm_grid({"res": 2, "cohort": 1}, 1)
+    False
+    >>> _is_norm_grid({"res": "native"}, 1)
+    False
+
+    """
+    res = spec.get("res", spec.get("resolution"))
+    return res != "native" and _no_native(res) == norm_resolution
+
+
 def _is_native(value):
     return value == "native"
 
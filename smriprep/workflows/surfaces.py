@@ -32,24 +32,24 @@ from nipype.interfaces.base import Undefined
 from nipype.interfaces import (
     io as nio,
     utility as niu,
-    freesurfer as fs,
 )
 
-from ..interfaces.freesurfer import ReconAll
-from ..interfaces.surf import NormalizeSurf
+from ..interfaces.freesurfer import HeaderRegister, ReconAll
+from ..interfaces.resampling import ResampleLabels
+from ..interfaces.surf import FS2Gifti, Midthickness
+from ..utils.versions import fs_version
 
 from niworkflows.engine.workflows import LiterateWorkflow as Workflow
 from niworkflows.interfaces.freesurfer import (
     FSDetectInputs,
     FSInjectBrainExtracted,
-    MakeMidthickness,
     PatchedLTAConvert as LTAConvert,
     PatchedRobustRegister as RobustRegister,
     RefineBrainMask,
 )
 
 
-def init_surface_recon_wf(*, omp_nthreads, hires, name="surface_recon_wf"):
+def init_surface_recon_wf(*, omp_nthreads, hires, header_xfm=False, name="surface_recon_wf"):
     r"""
     Reconstruct anatomical surfaces using FreeSurfer's ``recon-all``.
 
@@ -120,6 +120,11 @@ def init_surface_recon_wf(*, omp_nthreads, hires, name="surface_recon_wf"):
         Maximum number of threads an individual process may use
     hires : bool
         Enable sub-millimeter preprocessing in FreeSurfer
+    header_xfm : bool
+        Derive the transform between FreeSurfer's conformed space and the T1w
+        from their header geometry, and only run ``mri_robust_register`` if the
+        images do not match that way (see
+        :py:class:`~smriprep.interfaces.freesurfer.HeaderRegister`)
 
     Inputs
     ------
@@ -159,6 +164,12 @@ def init_surface_recon_wf(*, omp_nthreads, hires, name="surface_recon_wf"):
         FreeSurfer's aseg segmentation, in native T1w space
     out_aparc
         FreeSurfer's aparc+aseg segmentation, in native T1w space
+    out_aparc_a2009s
+        FreeSurfer's aparc.a2009s+aseg segmentation, in native T1w space
+    out_aparc_dkt
+        FreeSurfer's aparc.DKTatlas+aseg segmentation, in native T1w space
+    out_wmparc
+        FreeSurfer's wmparc segmentation, in native T1w space
 
     See also
     --------
@@ -174,7 +185,7 @@ previously was refined with a custom variation of the method to reconcile
 ANTs-derived and FreeSurfer-derived segmentations of the cortical
 gray-matter of Mindboggle [RRID:SCR_002438, @mindboggle].
 """.format(
-        fs_ver=fs.Info().looseversion() or "<ver>"
+        fs_ver=fs_version() or "<ver>"
     )
 
     inputnode = pe.Node(
@@ -203,6 +214,9 @@ gray-matter of Mindboggle [RRID:SCR_002438, @mindboggle].
                 "out_brainmask",
                 "out_aseg",
                 "out_aparc",
+                "out_aparc_a2009s",
+                "out_aparc_dkt",
+                "out_wmparc",
             ]
         ),
         name="outputnode",
@@ -210,7 +224,9 @@ gray-matter of Mindboggle [RRID:SCR_002438, @mindboggle].
 
     recon_config = pe.Node(FSDetectInputs(hires_enabled=hires), name="recon_config")
 
-    fov_check = pe.Node(niu.Function(function=_check_cw256), name="fov_check")
+    fov_check = pe.Node(
+        niu.Function(function=_check_cw256), name="fov_check", run_without_submitting=True
+    )
     fov_check.inputs.default_flags = ['-noskullstrip', '-noT2pial', '-noFLAIRpial']
 
     autorecon1 = pe.Node(
@@ -224,18 +240,23 @@ gray-matter of Mindboggle [RRID:SCR_002438, @mindboggle].
 
     skull_strip_extern = pe.Node(FSInjectBrainExtracted(), name="skull_strip_extern")
 
-    fsnative2t1w_xfm = pe.Node(
-        RobustRegister(auto_sens=True, est_int_scale=True), name="fsnative2t1w_xfm"
-    )
+    if header_xfm:
+        fsnative2t1w_xfm = pe.Node(HeaderRegister(), name="fsnative2t1w_xfm")
+        workflow.connect(fov_check, "out", fsnative2t1w_xfm, "flags")
+    else:
+        fsnative2t1w_xfm = pe.Node(
+            RobustRegister(auto_sens=True, est_int_scale=True), name="fsnative2t1w_xfm"
+        )
     t1w2fsnative_xfm = pe.Node(
         LTAConvert(out_lta=True, invert=True), name="t1w2fsnative_xfm"
     )
 
     autorecon_resume_wf = init_autorecon_resume_wf(omp_nthreads=omp_nthreads)
-    gifti_surface_wf = init_gifti_surface_wf()
+    gifti_surface_wf = init_gifti_surface_wf(omp_nthreads=omp_nthreads)
 
-    aseg_to_native_wf = init_segs_to_native_wf()
-    aparc_to_native_wf = init_segs_to_native_wf(segmentation="aparc_aseg")
+    segs_to_native_wf = init_segs_to_native_wf(
+        segmentation=["aseg", "aparc_aseg", "aparc_a2009s", "aparc_dkt", "wmparc"]
+    )
     refine = pe.Node(RefineBrainMask(), name="refine")
 
     # fmt:off
@@ -276,17 +297,12 @@ gray-matter of Mindboggle [RRID:SCR_002438, @mindboggle].
         # Refine ANTs mask, deriving new mask from FS' aseg
         (inputnode, refine, [('corrected_t1', 'in_anat'),
                              ('ants_segs', 'in_ants')]),
-        (inputnode, aseg_to_native_wf, [('corrected_t1', 'inputnode.in_file')]),
-        (autorecon_resume_wf, aseg_to_native_wf, [
-            ('outputnode.subjects_dir', 'inputnode.subjects_dir'),
-            ('outputnode.subject_id', 'inputnode.subject_id')]),
-        (fsnative2t1w_xfm, aseg_to_native_wf, [('out_reg_file', 'inputnode.fsnative2t1w_xfm')]),
-        (inputnode, aparc_to_native_wf, [('corrected_t1', 'inputnode.in_file')]),
-        (autorecon_resume_wf, aparc_to_native_wf, [
+        (inputnode, segs_to_native_wf, [('corrected_t1', 'inputnode.in_file')]),
+        (autorecon_resume_wf, segs_to_native_wf, [
             ('outputnode.subjects_dir', 'inputnode.subjects_dir'),
             ('outputnode.subject_id', 'inputnode.subject_id')]),
-        (fsnative2t1w_xfm, aparc_to_native_wf, [('out_reg_file', 'inputnode.fsnative2t1w_xfm')]),
-        (aseg_to_native_wf, refine, [('outputnode.out_file', 'in_aseg')]),
+        (fsnative2t1w_xfm, segs_to_native_wf, [('out_reg_file', 'inputnode.fsnative2t1w_xfm')]),
+        (segs_to_native_wf, refine, [('outputnode.out_aseg', 'in_aseg')]),
 
         # Output
         (autorecon_resume_wf, outputnode, [('outputnode.subjects_dir', 'subjects_dir'),
@@ -295,8 +311,12 @@ gray-matter of Mindboggle [RRID:SCR_002438, @mindboggle].
         (t1w2fsnative_xfm, outputnode, [('out_lta', 't1w2fsnative_xfm')]),
         (fsnative2t1w_xfm, outputnode, [('out_reg_file', 'fsnative2t1w_xfm')]),
         (refine, outputnode, [('out_file', 'out_brainmask')]),
-        (aseg_to_native_wf, outputnode, [('outputnode.out_file', 'out_aseg')]),
-        (aparc_to_native_wf, outputnode, [('outputnode.out_file', 'out_aparc')]),
+        (segs_to_native_wf, outputnode, [
+            ('outputnode.out_aseg', 'out_aseg'),
+            ('outputnode.out_aparc_aseg', 'out_aparc'),
+            ('outputnode.out_aparc_a2009s', 'out_aparc_a2009s'),
+            ('outputnode.out_aparc_dkt', 'out_aparc_dkt'),
+            ('outputnode.out_wmparc', 'out_wmparc')]),
     ])
     # fmt:on
 
@@ -470,17 +490,20 @@ def init_autorecon_resume_wf(*, omp_nthreads, name="autorecon_resume_wf"):
     return workflow
 
 
-def init_gifti_surface_wf(*, name="gifti_surface_wf"):
+def init_gifti_surface_wf(*, omp_nthreads=1, name="gifti_surface_wf"):
     r"""
     Prepare GIFTI surfaces from a FreeSurfer subjects directory.
 
-    If midthickness (or graymid) surfaces do not exist, they are generated and
-    saved to the subject directory as ``lh/rh.midthickness``.
+    If up-to-date midthickness (or graymid) surfaces do not exist, they are
+    :py:class:`generated <smriprep.interfaces.surf.Midthickness>` (averaging the
+    white and pial surfaces of both hemispheres) and saved to the subject directory
+    as ``lh/rh.midthickness``.
     These, along with the gray/white matter boundary (``lh/rh.smoothwm``), pial
     sufaces (``lh/rh.pial``) and inflated surfaces (``lh/rh.inflated``) are
-    converted to GIFTI files.
-    Additionally, the vertex coordinates are :py:class:`recentered
-    <smriprep.interfaces.NormalizeSurf>` to align with native T1w space.
+    converted to GIFTI files, in a single process that converts surfaces in
+    parallel threads.
+    Vertex coordinates are mapped to scanner coordinates and :py:class:`recentered
+    <smriprep.interfaces.surf.FS2Gifti>` to align with native T1w space in one step.
 
     Workflow Graph
         .. workflow::
@@ -490,6 +513,11 @@ def init_gifti_surface_wf(*, name="gifti_surface_wf"):
             from smriprep.workflows.surfaces import init_gifti_surface_wf
             wf = init_gifti_surface_wf()
 
+    Parameters
+    ----------
+    omp_nthreads : int
+        Maximum number of threads an individual process may use
+
     Inputs
     ------
     subjects_dir
@@ -507,6 +535,11 @@ def init_gifti_surface_wf(*, name="gifti_surface_wf"):
 
     """
     workflow = Workflow(name=name)
+    workflow.__desc__ = """\
+Midthickness surfaces were generated by averaging the coordinates of corresponding
+vertices of the white-matter and pial surfaces (unless they were already available
+in the FreeSurfer subjects directory).
+"""
 
     inputnode = pe.Node(
         niu.IdentityInterface(["subjects_dir", "subject_id", "fsnative2t1w_xfm"]),
@@ -516,45 +549,34 @@ def init_gifti_surface_wf(*, name="gifti_surface_wf"):
 
     get_surfaces = pe.Node(nio.FreeSurferSource(), name="get_surfaces")
 
-    midthickness = pe.MapNode(
-        MakeMidthickness(thickness=True, distance=0.5, out_name="midthickness"),
-        iterfield="in_file",
-        name="midthickness",
-    )
-
-    save_midthickness = pe.Node(
-        nio.DataSink(parameterization=False), name="save_midthickness"
-    )
+    midthickness = pe.Node(Midthickness(), name="midthickness")
+    # Cheap if up to date, and checks whether the surfaces have been modified
+    midthickness.interface._always_run = True
 
     surface_list = pe.Node(
         niu.Merge(4, ravel_inputs=True),
         name="surface_list",
         run_without_submitting=True,
     )
-    fs2gii = pe.MapNode(
-        fs.MRIsConvert(out_datatype="gii", to_scanner=True), iterfield="in_file", name="fs2gii"
-    )
-    fix_surfs = pe.MapNode(NormalizeSurf(), iterfield="in_file", name="fix_surfs")
+    # Conversion is mostly nibabel I/O, which holds the GIL: threads only overlap
+    # reading and writing the surfaces, so do not reserve more than one slot for them
+    fs2gii = pe.Node(FS2Gifti(num_threads=omp_nthreads), name="fs2gii")
 
     # fmt:off
     workflow.connect([
         (inputnode, get_surfaces, [('subjects_dir', 'subjects_dir'),
                                    ('subject_id', 'subject_id')]),
-        (inputnode, save_midthickness, [('subjects_dir', 'base_directory'),
-                                        ('subject_id', 'container')]),
-        # Generate midthickness surfaces and save to FreeSurfer derivatives
-        (get_surfaces, midthickness, [('smoothwm', 'in_file'),
-                                      ('graymid', 'graymid')]),
-        (midthickness, save_midthickness, [('out_file', 'surf.@graymid')]),
+        # Generate midthickness surfaces into FreeSurfer derivatives
+        (inputnode, midthickness, [('subjects_dir', 'subjects_dir'),
+                                   ('subject_id', 'subject_id')]),
         # Produce valid GIFTI surface files (dense mesh)
         (get_surfaces, surface_list, [('smoothwm', 'in1'),
                                       ('pial', 'in2'),
                                       ('inflated', 'in3')]),
-        (save_midthickness, surface_list, [('out_file', 'in4')]),
-        (surface_list, fs2gii, [('out', 'in_file')]),
-        (fs2gii, fix_surfs, [('converted', 'in_file')]),
-        (inputnode, fix_surfs, [('fsnative2t1w_xfm', 'transform_file')]),
-        (fix_surfs, outputnode, [('out_file', 'surfaces')]),
+        (midthickness, surface_list, [('out_files', 'in4')]),
+        (surface_list, fs2gii, [('out', 'in_files')]),
+        (inputnode, fs2gii, [('fsnative2t1w_xfm', 'transform_file')]),
+        (fs2gii, outputnode, [('out_files', 'surfaces')]),
     ])
     # fmt:on
     return workflow
@@ -562,7 +584,10 @@ def init_gifti_surface_wf(*, name="gifti_surface_wf"):
 
 def init_segs_to_native_wf(*, name="segs_to_native", segmentation="aseg"):
     """
-    Get a segmentation from FreeSurfer conformed space into native T1w space.
+    Get segmentations from FreeSurfer conformed space into native T1w space.
+
+    All segmentations are resampled by a single process, which calculates the
+    nearest-neighbor mapping between the two grids once.
 
     Workflow Graph
         .. workflow::
@@ -574,8 +599,9 @@ def init_segs_to_native_wf(*, name="segs_to_native", segmentation="aseg"):
 
     Parameters
     ----------
-    segmentation
-        The name of a segmentation ('aseg' or 'aparc_aseg' or 'wmparc')
+    segmentation : :obj:`str` or :obj:`list` of :obj:`str`
+        The name of a segmentation ('aseg', 'aparc_aseg', 'aparc_a2009s',
+        'aparc_dkt' or 'wmparc'), or a list of them
 
     Inputs
     ------
@@ -592,66 +618,101 @@ def init_segs_to_native_wf(*, name="segs_to_native", segmentation="aseg"):
     -------
     out_file
         The selected segmentation, after resampling in native space
+        (if ``segmentation`` is a string)
+    out_<segmentation>
+        Each of the selected segmentations, after resampling in native space
+        (if ``segmentation`` is a list, e.g., ``out_aseg``)
 
     """
-    workflow = Workflow(name="%s_%s" % (name, segmentation))
+    if isinstance(segmentation, str):
+        name = "%s_%s" % (name, segmentation)
+        segs = [segmentation]
+        out_fields = ["out_file"]
+    else:
+        segs = list(segmentation)
+        out_fields = ["out_%s" % seg for seg in segs]
+
+    unknown = set(segs) - {"aseg", "wmparc"} - set(_PARC_PATTERNS)
+    if unknown:
+        raise ValueError("Unknown segmentation(s): %s" % ", ".join(sorted(unknown)))
+
+    workflow = Workflow(name=name)
     inputnode = pe.Node(
         niu.IdentityInterface(
             ["in_file", "subjects_dir", "subject_id", "fsnative2t1w_xfm"]
         ),
         name="inputnode",
     )
-    outputnode = pe.Node(niu.IdentityInterface(["out_file"]), name="outputnode")
+    outputnode = pe.Node(niu.IdentityInterface(out_fields), name="outputnode")
     # Extract the aseg and aparc+aseg outputs
     fssource = pe.Node(nio.FreeSurferSource(), name="fs_datasource")
+    merge_segs = pe.Node(
+        niu.Merge(len(segs)), name="merge_segs", run_without_submitting=True
+    )
     # Resample from T1.mgz to T1w.nii.gz, applying any offset in fsnative2t1w_xfm,
     # and convert to NIfTI while we're at it
-    resample = pe.Node(
-        fs.ApplyVolTransform(transformed_file="seg.nii.gz", interp="nearest"),
-        name="resample",
+    resample = pe.Node(ResampleLabels(), name="resample")
+    split_segs = pe.Node(
+        niu.Split(splits=[1] * len(segs), squeeze=True),
+        name="split_segs",
+        run_without_submitting=True,
     )
 
-    if segmentation.startswith("aparc"):
-        if segmentation == "aparc_aseg":
-
-            def _sel(x):
-                return [parc for parc in x if "aparc+" in parc][0]  # noqa
-
-        elif segmentation == "aparc_a2009s":
-
-            def _sel(x):
-                return [parc for parc in x if "a2009s+" in parc][0]  # noqa
-
-        elif segmentation == "aparc_dkt":
-
-            def _sel(x):
-                return [parc for parc in x if "DKTatlas+" in parc][0]  # noqa
-
-        segmentation = (segmentation, _sel)
+    for i, seg in enumerate(segs, 1):
+        if seg in _PARC_PATTERNS:
+            # FreeSurferSource's aparc_aseg lists all aparc*+aseg volumes
+            seg = ("aparc_aseg", _select_parc, _PARC_PATTERNS[seg])
+        workflow.connect(fssource, seg, merge_segs, "in%d" % i)
+        workflow.connect(split_segs, "out%d" % i, outputnode, out_fields[i - 1])
 
     # fmt:off
     workflow.connect([
         (inputnode, fssource, [
             ('subjects_dir', 'subjects_dir'),
             ('subject_id', 'subject_id')]),
-        (inputnode, resample, [('in_file', 'target_file'),
+        (inputnode, resample, [('in_file', 'reference_image'),
                                ('fsnative2t1w_xfm', 'lta_file')]),
-        (fssource, resample, [(segmentation, 'source_file')]),
-        (resample, outputnode, [('transformed_file', 'out_file')]),
+        (merge_segs, resample, [('out', 'in_files')]),
+        (resample, split_segs, [('out_files', 'inlist')]),
     ])
     # fmt:on
     return workflow
 
 
+_PARC_PATTERNS = {
+    "aparc_aseg": "aparc+",
+    "aparc_a2009s": "a2009s+",
+    "aparc_dkt": "DKTatlas+",
+}
+
+
+def _select_parc(in_files, pattern):
+    """
+    Select one of FreeSurfer's aparc*+aseg volumes.
+
+    >>> _select_parc(
+    ...     ["mri/aparc+aseg.mgz", "mri/aparc.a2009s+aseg.mgz", "mri/aparc.DKTatlas+aseg.mgz"],
+    ...     "a2009s+",
+    ... )
+    'mri/aparc.a2009s+aseg.mgz'
+
+    """
+    return [parc for parc in in_files if pattern in parc][0]
+
+
 def _check_cw256(in_files, default_flags):
+    """Add ``-cw256`` to the flags if the field of view of any input exceeds 256 mm."""
     import numpy as np
-    from nibabel.funcs import concat_images
+    import nibabel as nb
 
     if isinstance(in_files, str):
         in_files = [in_files]
-    summary_img = concat_images(in_files)
-    fov = np.array(summary_img.shape[:3]) * summary_img.header.get_zooms()[:3]
     flags = list(default_flags)
-    if np.any(fov > 256):
-        flags.append("-cw256")
+    for in_file in in_files:
+        # Only the header is read
+        hdr = nb.load(in_file).header
+        fov = np.array(hdr.get_data_shape()[:3]) * hdr.get_zooms()[:3]
+        if np.any(fov > 256):
+            flags.append("-cw256")
+            break
     return flags